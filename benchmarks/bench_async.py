@@ -0,0 +1,81 @@
+"""Пропускная способность AsyncDataAggregator против синхронного DataAggregator.
+
+Сценарий: N корутин-коллекторов, каждая сохраняет пачку балансов Yandex.
+Синхронный вариант вызывает save_yandex_balances_bulk по очереди (коммит на
+каждый вызов), асинхронный — из конкурентных корутин, и записи объединяются
+в общие транзакции.
+
+Запуск:
+    python benchmarks/bench_async.py [--collectors 500] [--rows 20] [--profile safe]
+"""
+
+import argparse
+import asyncio
+import sqlite3
+import time
+
+from common import create_database
+
+from sqlite_lib.async_database import AsyncDataAggregator
+from sqlite_lib.database import DataAggregator
+
+
+def make_chunks(collectors, rows):
+    return [
+        [{'login': f'ya_{c}_{r}', 'amount': float(r)} for r in range(rows)]
+        for c in range(collectors)
+    ]
+
+
+def run_sync(db_path, chunks, profile):
+    aggregator = DataAggregator(db_path, profile=profile)
+    started = time.perf_counter()
+    for chunk in chunks:
+        aggregator.save_yandex_balances_bulk(chunk)
+    elapsed = time.perf_counter() - started
+    aggregator.close()
+    return elapsed
+
+
+async def run_async(db_path, chunks, profile, readers):
+    async with AsyncDataAggregator(db_path, profile=profile, readers=readers) as db:
+        started = time.perf_counter()
+
+        async def collector(chunk):
+            # Имитация HTTP-запроса перед сохранением
+            await asyncio.sleep(0)
+            return await db.save_yandex_balances_bulk(chunk)
+
+        await asyncio.gather(*(collector(chunk) for chunk in chunks))
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--collectors', type=int, default=500)
+    parser.add_argument('--rows', type=int, default=20)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--profile', default='safe')
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.collectors, args.rows)
+    total_rows = args.collectors * args.rows
+
+    sync_path, async_path = create_database(), create_database()
+    sync_elapsed = run_sync(sync_path, chunks, args.profile)
+    async_elapsed = asyncio.run(run_async(async_path, chunks, args.profile, args.readers))
+    # Кабинеты всех пачек разные: каждая строка должна дойти до базы вставкой
+    for path in (sync_path, async_path):
+        conn = sqlite3.connect(path)
+        written = conn.execute('SELECT COUNT(*) FROM yandex_balances').fetchone()[0]
+        conn.close()
+        if written != total_rows:
+            raise RuntimeError(f'{path}: записано {written} строк из {total_rows}')
+
+    print(f"{'mode':<22} {'seconds':>9} {'rows/sec':>10}")
+    print(f"{'DataAggregator':<22} {sync_elapsed:>9.3f} {total_rows / sync_elapsed:>10.0f}")
+    print(f"{'AsyncDataAggregator':<22} {async_elapsed:>9.3f} {total_rows / async_elapsed:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
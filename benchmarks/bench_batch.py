@@ -0,0 +1,61 @@
+"""Скорость записи: коммит на каждую строку против batch() и write_behind.
+
+Запуск:
+    python benchmarks/bench_batch.py [--rows 2000] [--profile bulk-ingest]
+"""
+
+import argparse
+import time
+
+from common import PollClock, create_database
+
+from sqlite_lib.database import DataAggregator
+
+
+def write_rows(aggregator, rows):
+    clock = PollClock()
+    for i in range(rows):
+        aggregator.save_vk_balance(f'vk_{i % 100}', float(i), clock())
+
+
+def measure(rows, use_batch, profile=None, **batch_options):
+    write_behind = batch_options.pop('write_behind', False)
+    aggregator = DataAggregator(create_database(), profile=profile, write_behind=write_behind)
+    started = time.perf_counter()
+    if write_behind:
+        write_rows(aggregator, rows)
+        aggregator.flush()
+    elif use_batch:
+        with aggregator.batch(**batch_options):
+            write_rows(aggregator, rows)
+    else:
+        write_rows(aggregator, rows)
+    elapsed = time.perf_counter() - started
+    written = aggregator.conn.execute('SELECT COUNT(*) FROM vk_balances').fetchone()[0]
+    aggregator.close()
+    if written != rows:
+        raise RuntimeError(f'записано {written} строк из {rows}')
+    return rows / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--profile', default=None,
+                        help='профиль соединения, например bulk-ingest')
+    args = parser.parse_args()
+
+    cases = [
+        ('per-row commit', False, {}),
+        ('batch()', True, {}),
+        ('batch(flush_rows=500)', True, {'flush_rows': 500}),
+        ('batch(flush_interval=0.05)', True, {'flush_interval': 0.05}),
+        ('write_behind=True', False, {'write_behind': True}),
+    ]
+    print(f"{'mode':<28} {'rows/sec':>12}")
+    for title, use_batch, options in cases:
+        print(f'{title:<28} {measure(args.rows, use_batch, args.profile, **options):>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Сравнение set-based get_digest_data с прежним циклом по проектам.
+
+История по умолчанию — 30 дней опроса раз в 5 минут (288 замеров на
+кабинет в сутки): прежний цикл на каждый проект группирует сырые строки
+последних суток, новый читает суточные агрегаты. На короткой истории с
+редкими замерами прежний цикл почти ничего не группирует, и сравнение
+показывает только накладные расходы запросов.
+
+Запуск:
+    python benchmarks/bench_digest.py [--sizes 10 100 1000] [--repeat 5]
+        [--days 30] [--samples-per-day 288]
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+from common import best_of, create_database, seed_projects
+
+from sqlite_lib.database import DataAggregator, _period_start
+
+
+def legacy_period_stats(conn, vk_cabinet_id, yandex_cabinet_id, mytracker_project_id, days,
+                        date_from=None):
+    """Прежний get_project_stats_for_period: GROUP BY по сырым строкам.
+
+    Граница периода по умолчанию — как в прежнем коде: локальное now() минус
+    days, с временем суток (та же строка, что давал адаптер datetime модуля
+    sqlite3). Колонки mt_stats — текущие: прежний запрос ссылался на
+    несуществующие installs и cost.
+    """
+    if date_from is None:
+        date_from = str(datetime.now() - timedelta(days=days))
+    stats = {}
+    if vk_cabinet_id:
+        stats['vk_balances'] = conn.execute('''
+            SELECT DATE(fetched_at) as date, AVG(balance) as avg_balance
+            FROM vk_balances
+            WHERE vk_cabinet_id = ? AND fetched_at >= ?
+            GROUP BY DATE(fetched_at)
+            ORDER BY date
+        ''', (vk_cabinet_id, date_from)).fetchall()
+    if yandex_cabinet_id:
+        stats['yandex_balances'] = conn.execute('''
+            SELECT DATE(fetched_at) as date, AVG(balance) as avg_balance
+            FROM yandex_balances
+            WHERE yandex_cabinet_id = ? AND fetched_at >= ?
+            GROUP BY DATE(fetched_at)
+            ORDER BY date
+        ''', (yandex_cabinet_id, date_from)).fetchall()
+    if mytracker_project_id:
+        stats['mt_stats'] = conn.execute('''
+            SELECT
+                DATE(fetched_at) as date,
+                SUM(registrations) as total_registrations,
+                SUM(first_logins) as total_first_logins,
+                SUM(reactivations) as total_reactivations
+            FROM mt_stats
+            WHERE mytracker_project_id = ? AND fetched_at >= ?
+            GROUP BY DATE(fetched_at)
+            ORDER BY date
+        ''', (mytracker_project_id, date_from)).fetchall()
+    return stats
+
+
+def legacy_digest(aggregator, icon_path_template='logo/{project}.jpg', days_back=2,
+                  date_from=None):
+    """Прежняя реализация get_digest_data: до трех запросов к сырым таблицам на проект."""
+    yandex_data, vk_data, mt_data = [], [], []
+
+    for project in aggregator.get_list_of_projects():
+        if not project.get('is_active'):
+            continue
+
+        stats = legacy_period_stats(
+            aggregator.conn,
+            project.get('vk_cabinet_id'),
+            project.get('yandex_cabinet_id'),
+            project.get('mytracker_project_id'),
+            days_back,
+            date_from,
+        )
+
+        if project.get('yandex_cabinet_id') and stats.get('yandex_balances'):
+            balances = stats['yandex_balances']
+            current = balances[-1]['avg_balance']
+            previous = balances[-2]['avg_balance'] if len(balances) > 1 else current
+            yandex_data.append({
+                'project': project['name'],
+                'spend': aggregator._format_number(current),
+                'change': aggregator._calculate_change(current, previous)
+            })
+
+        if project.get('vk_cabinet_id') and stats.get('vk_balances'):
+            balances = stats['vk_balances']
+            current = balances[-1]['avg_balance']
+            previous = balances[-2]['avg_balance'] if len(balances) > 1 else current
+            vk_data.append({
+                'icon_path': icon_path_template.format(
+                    project=project['name'].lower().replace(' ', '_')),
+                'name': project['name'],
+                'spend': aggregator._format_number(current),
+                'change': aggregator._calculate_change(current, previous)
+            })
+
+        if project.get('mytracker_project_id') and stats.get('mt_stats'):
+            mt_stats = stats['mt_stats']
+            current = mt_stats[-1]
+            previous = mt_stats[-2] if len(mt_stats) > 1 else current
+            current_regs = current['total_registrations'] or 0
+            previous_regs = previous['total_registrations'] or 0
+            mt_data.append({
+                'name': project['name'],
+                'regs': str(current_regs),
+                'fl': str(current['total_first_logins'] or 0),
+                'ret': str(current['total_reactivations'] or 0),
+                'users': current_regs,
+                'change': aggregator._calculate_change(current_regs, previous_regs)
+            })
+
+    return {'yandex': yandex_data, 'vk': vk_data, 'mt': mt_data}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--samples-per-day', type=int, default=288)
+    args = parser.parse_args()
+
+    print(f'{args.days} дней истории, {args.samples_per_day} замеров на кабинет в сутки')
+
+    print(f"{'projects':>10} {'legacy, ms':>12} {'set-based, ms':>14} {'speedup':>9}")
+    for size in args.sizes:
+        db_path = create_database()
+        seed_projects(db_path, size, days=args.days, samples_per_day=args.samples_per_day)
+        aggregator = DataAggregator(db_path)
+
+        # Новый дайджест считает целые сутки UTC (_period_start), прежний —
+        # от локального now() минус days_back; при сверке прежнему циклу
+        # передается новая граница, замеряется он с прежней
+        expected = legacy_digest(aggregator, date_from=_period_start(2))
+        actual = aggregator.get_digest_data()
+        assert actual == expected, f'результаты расходятся при {size} проектах'
+
+        legacy = best_of(lambda: legacy_digest(aggregator), args.repeat)
+        set_based = best_of(aggregator.get_digest_data, args.repeat)
+        aggregator.close()
+
+        print(f'{size:>10} {legacy * 1000:>12.2f} {set_based * 1000:>14.2f} {legacy / set_based:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
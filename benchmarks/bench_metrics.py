@@ -0,0 +1,63 @@
+"""Накладные расходы метрик: DataAggregator(metrics=None) против metrics=True.
+
+Замеряются типичные операции: get_digest_data на заполненной базе,
+выгрузка iter_balance_history и одиночные save_vk_balance с коммитом.
+Выключенные метрики не стоят ничего (методы и соединения не обернуты);
+включенные дороже всего для iter_*, где замер идет на каждой строке.
+В конце печатаются самые медленные запросы из собранных метрик.
+
+Запуск:
+    python benchmarks/bench_metrics.py [--projects 200] [--writes 500] [--repeat 5]
+"""
+
+import argparse
+
+from common import PollClock, best_of, create_database, seed_projects
+
+from sqlite_lib.database import DataAggregator
+
+
+def operations(aggregator, writes, clock):
+    return {
+        'get_digest_data': aggregator.get_digest_data,
+        'iter_balance_history': lambda: sum(
+            1 for _ in aggregator.iter_balance_history('vk_balances', row_type='tuple')
+        ),
+        # последней: записи увеличивают таблицы для остальных операций
+        'save_vk_balance': lambda: [
+            aggregator.save_vk_balance(f'vk_{i % 50}', float(i), clock()) for i in range(writes)
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--projects', type=int, default=200)
+    parser.add_argument('--writes', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db_path = create_database()
+    seed_projects(db_path, args.projects)
+
+    plain = DataAggregator(db_path)
+    instrumented = DataAggregator(db_path, metrics=True)
+    clock = PollClock()
+    print(f"{'operation':<22} {'off, ms':>9} {'on, ms':>9} {'overhead':>9}")
+    for name, plain_run in operations(plain, args.writes, clock).items():
+        instrumented_run = operations(instrumented, args.writes, clock)[name]
+        off = best_of(plain_run, args.repeat)
+        on = best_of(instrumented_run, args.repeat)
+        print(f"{name:<22} {off * 1000:>9.2f} {on * 1000:>9.2f} {(on / off - 1) * 100:>8.1f}%")
+
+    queries = instrumented.get_metrics()['queries']
+    slowest = sorted(queries.items(), key=lambda item: item[1]['latency']['sum'], reverse=True)
+    print('\nСамые долгие запросы (суммарно):')
+    for sql, stats in slowest[:3]:
+        print(f"  {stats['latency']['sum'] * 1000:>8.1f} ms  {stats['calls']:>6} вызовов  {sql[:80]}")
+    plain.close()
+    instrumented.close()
+
+
+if __name__ == '__main__':
+    main()
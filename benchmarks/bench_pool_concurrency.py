@@ -0,0 +1,105 @@
+"""Нагрузка из нескольких потоков на один DataAggregator в режиме пула.
+
+Потоки вперемешку вызывают save_* и get_*; в конце проверяется, что все
+записи на месте и ни один вызов не упал. Каждая запись получает свое время
+замера (PollClock), так что ни одна строка не заменяет другую.
+
+Запуск:
+    python benchmarks/bench_pool_concurrency.py [--threads 8] [--ops 500] [--pool-size 4]
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+from common import PollClock, create_database, seed_projects
+
+from sqlite_lib.database import DataAggregator
+
+
+def worker(aggregator, worker_id, ops, clock, counters, errors):
+    rnd = random.Random(worker_id)
+    try:
+        for i in range(ops):
+            action = rnd.random()
+            if action < 0.3:
+                aggregator.save_vk_balance(f'vk_{rnd.randrange(50)}', rnd.uniform(0, 1000), clock())
+                counters['vk'][worker_id] += 1
+            elif action < 0.5:
+                # Разные кабинеты: повтор кабинета в одном замере — дубликат
+                saved = aggregator.save_yandex_balances_bulk([
+                    {'login': f'ya_{cabinet}', 'amount': rnd.uniform(0, 1000)}
+                    for cabinet in rnd.sample(range(50), 5)
+                ], fetched_at=clock())
+                counters['yandex'][worker_id] += saved
+            elif action < 0.6:
+                aggregator.save_mt_stats(f'mt_{rnd.randrange(50)}', registrations=1,
+                                         fetched_at=clock())
+                counters['mt'][worker_id] += 1
+            elif action < 0.7:
+                aggregator.get_digest_data()
+            elif action < 0.8:
+                aggregator.get_all_yandex_balances_today()
+            elif action < 0.9:
+                aggregator.get_project_by_vk_cabinet(f'vk_{rnd.randrange(50)}')
+            else:
+                aggregator.get_all_vk_balances()
+    except Exception as exc:  # noqa: BLE001 - нагрузочный тест собирает все ошибки
+        errors.append((worker_id, repr(exc)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=500)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--profile', default='bulk-ingest')
+    args = parser.parse_args()
+
+    db_path = create_database()
+    seed_projects(db_path, 50)
+    aggregator = DataAggregator(db_path, profile=args.profile, pool_size=args.pool_size)
+    before = {
+        table: aggregator.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        for table in ('vk_balances', 'yandex_balances', 'mt_stats')
+    }
+
+    counters = {key: [0] * args.threads for key in ('vk', 'yandex', 'mt')}
+    clock = PollClock()
+    errors = []
+    threads = [
+        threading.Thread(target=worker, args=(aggregator, n, args.ops, clock, counters, errors))
+        for n in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    expected = {
+        'vk_balances': before['vk_balances'] + sum(counters['vk']),
+        'yandex_balances': before['yandex_balances'] + sum(counters['yandex']),
+        'mt_stats': before['mt_stats'] + sum(counters['mt']),
+    }
+    actual = {
+        table: aggregator.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        for table in expected
+    }
+    pool_stats = aggregator._pool.stats()
+    aggregator.close()
+
+    total_ops = args.threads * args.ops
+    print(f'{total_ops} операций за {elapsed:.2f} с ({total_ops / elapsed:.0f} ops/sec), пул: {pool_stats}')
+    for worker_id, error in errors:
+        print(f'  поток {worker_id}: {error}')
+    if actual != expected:
+        print(f'  строки не сходятся: ожидалось {expected}, получено {actual}')
+    return 1 if errors or actual != expected else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Дайджест по нескольким базам: по очереди против ShardedAggregator.
+
+Создается --shards файлов по --projects проектов в каждом. Сначала
+дайджест строится как раньше — DataAggregator на каждый файл по очереди,
+затем через ShardedAggregator в пуле потоков и в пуле процессов.
+Проверяется, что склеенный результат совпадает с последовательным, и
+печатается ускорение; при числе баз не больше числа ядер пул процессов
+должен давать ускорение, близкое к числу баз.
+
+Запуск:
+    python benchmarks/bench_shards.py [--shards 8] [--projects 500] [--days 30] [--repeat 3]
+"""
+
+import argparse
+import os
+import tempfile
+
+from common import best_of, create_database, seed_projects
+
+from sqlite_lib.database import DataAggregator
+from sqlite_lib.shards import DIGEST_SECTIONS, ShardedAggregator
+
+
+def sequential_digest(db_paths):
+    digest = {section: [] for section in DIGEST_SECTIONS}
+    for db_path in db_paths:
+        aggregator = DataAggregator(db_path, profile='read-heavy')
+        result = aggregator.get_digest_data()
+        aggregator.close()
+        for section in DIGEST_SECTIONS:
+            digest[section].extend(result[section])
+    return digest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--projects', type=int, default=500)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='sqlite_lib_shards_')
+    db_paths = []
+    for shard in range(args.shards):
+        db_path = create_database(directory, f'group_{shard}.db')
+        seed_projects(db_path, args.projects, days=args.days, seed=shard)
+        DataAggregator(db_path, profile='read-heavy').close()  # миграции и агрегаты
+        db_paths.append(db_path)
+
+    expected = sequential_digest(db_paths)
+    sequential = best_of(lambda: sequential_digest(db_paths), args.repeat)
+    print(f'{args.shards} баз по {args.projects} проектов, ядер: {os.cpu_count()}')
+    print(f"{'mode':<12} {'seconds':>9} {'speedup':>8}")
+    print(f"{'sequential':<12} {sequential:>9.3f} {1:>7.2f}x")
+
+    for executor in ('thread', 'process'):
+        with ShardedAggregator(db_paths, executor=executor) as shards:
+            digest, report = shards.get_digest_report()  # прогрев пула
+            if digest != expected:
+                raise SystemExit(f'{executor}: дайджест не совпадает с последовательным')
+            elapsed = best_of(shards.get_digest_data, args.repeat)
+            slowest = max(report, key=lambda shard: shard['seconds'])
+        print(f"{executor:<12} {elapsed:>9.3f} {sequential / elapsed:>7.2f}x"
+              f"   самая медленная база: {os.path.basename(slowest['db_path'])} "
+              f"{slowest['seconds'] * 1000:.1f} ms")
+
+    # Ошибка одной базы не мешает остальным
+    broken = os.path.join(directory, 'missing.db')
+    with ShardedAggregator([*db_paths, broken]) as shards:
+        digest, report = shards.get_digest_report()
+    errors = [shard for shard in report if shard['error']]
+    print(f"с отсутствующей базой: ошибок {len(errors)}, "
+          f"строк vk {len(digest['vk'])} из {len(expected['vk'])}")
+    if os.path.exists(broken):
+        raise SystemExit('база только для чтения не должна создавать файл')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Старт короткого процесса (cron, CLI), который только строит дайджест.
+
+Для каждого режима DataAggregator печатается:
+    - cold: полный запуск python -c "..." — импорт библиотеки, открытие
+      базы и get_digest_data(), лучшее из --repeat;
+    - init: только конструктор в уже запущенном процессе;
+    - first digest: первый get_digest_data() после конструктора.
+
+Режимы: запись (как раньше), readonly, readonly + lazy и readonly +
+immutable на копии из backup() — снимке, который никто не пишет. Путь к
+базе в cold-запуске берется из SQLITE_LIB_DB_PATH. Дайджесты всех режимов
+сверяются, а открытие отсутствующего файла только на чтение не должно его
+создавать.
+
+Отдельно проверяется, что импорт sqlite_lib.database и конструктор не тянут
+numpy (sqlite_lib.timeseries грузится только для аналитики и больших
+дайджестов), и печатается, сколько стоил бы импорт numpy — если он
+установлен.
+
+Запуск:
+    python benchmarks/bench_startup.py [--projects 500] [--days 30] [--repeat 5]
+"""
+
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import best_of, create_database, seed_projects
+
+from sqlite_lib.database import DB_PATH_ENV, DataAggregator
+
+MODES = {
+    'read-write': {},
+    'readonly': {'readonly': True},
+    'readonly lazy': {'readonly': True, 'lazy': True},
+    'immutable': {'readonly': True, 'immutable': True, 'profile': 'read-heavy'},
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Модули, которых не должно быть в процессе сразу после старта
+HEAVY_MODULES = ('numpy', 'sqlite_lib.timeseries')
+
+
+def run_python(code, db_path=None):
+    """Запустить python -c code с библиотекой в PYTHONPATH, вернуть stdout"""
+    env = dict(os.environ)
+    if db_path is not None:
+        env[DB_PATH_ENV] = db_path
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    result = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                            capture_output=True, text=True)
+    return result.stdout
+
+
+def heavy_imports(db_path):
+    """Тяжелые модули, загруженные после импорта и конструктора"""
+    code = (
+        'import sys\n'
+        'from sqlite_lib.database import DataAggregator\n'
+        'aggregator = DataAggregator(readonly=True)\n'
+        f'print(" ".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))\n'
+    )
+    return run_python(code, db_path).split()
+
+
+def numpy_import_cost():
+    """Секунды на import numpy в отдельном процессе или None без numpy"""
+    if importlib.util.find_spec('numpy') is None:
+        return None
+    code = (
+        'import time\n'
+        'started = time.perf_counter()\n'
+        'import numpy\n'
+        'print(time.perf_counter() - started)\n'
+    )
+    return float(run_python(code))
+
+
+def cold_start(db_path, options):
+    """Секунды на запуск python, импорт, конструктор и дайджест"""
+    code = (
+        'from sqlite_lib.database import DataAggregator\n'
+        f'aggregator = DataAggregator(**{options!r})\n'
+        'aggregator.get_digest_data()\n'
+        'aggregator.close()\n'
+    )
+    started = time.perf_counter()
+    run_python(code, db_path)
+    return time.perf_counter() - started
+
+
+def warm_start(db_path, options):
+    """(секунды конструктора, секунды первого дайджеста, дайджест)"""
+    started = time.perf_counter()
+    aggregator = DataAggregator(db_path, **options)
+    opened = time.perf_counter()
+    digest = aggregator.get_digest_data()
+    finished = time.perf_counter()
+    aggregator.close()
+    return opened - started, finished - opened, digest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--projects', type=int, default=500)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='sqlite_lib_startup_')
+    db_path = create_database(directory, 'live.db')
+    seed_projects(db_path, args.projects, days=args.days)
+    aggregator = DataAggregator(db_path)  # миграции и агрегаты
+    snapshot = os.path.join(directory, 'snapshot.db')
+    aggregator.backup(snapshot)
+    expected = aggregator.get_digest_data()
+    aggregator.close()
+
+    print(f'{args.projects} проектов, {args.days} дней; лучшее из {args.repeat}')
+    print(f"{'mode':<14} {'cold, ms':>9} {'init, ms':>9} {'first digest, ms':>17}")
+    for mode, options in MODES.items():
+        path = snapshot if options.get('immutable') else db_path
+        cold = best_of(lambda: cold_start(path, options), args.repeat)
+        init, first, digest = min(
+            (warm_start(path, options) for _ in range(args.repeat)),
+            key=lambda timing: timing[0] + timing[1],
+        )
+        if digest != expected:
+            raise SystemExit(f'{mode}: дайджест не совпадает с режимом записи')
+        print(f'{mode:<14} {cold * 1000:>9.1f} {init * 1000:>9.2f} {first * 1000:>17.2f}')
+
+    loaded = heavy_imports(db_path)
+    if loaded:
+        raise SystemExit(f'старт не должен загружать: {", ".join(loaded)}')
+    cost = numpy_import_cost()
+    if cost is None:
+        print('numpy не установлен; старт его не требует')
+    else:
+        print(f'импорт и конструктор не загружают numpy (сэкономлено {cost * 1000:.1f} ms)')
+
+    missing = os.path.join(directory, 'missing.db')
+    lazy = DataAggregator(missing, readonly=True, lazy=True)
+    try:
+        lazy.get_digest_data()
+    except Exception as exc:  # noqa: BLE001 - ожидаемая ошибка открытия
+        print(f'отсутствующая база только на чтение: {type(exc).__name__}: {exc}')
+    else:
+        raise SystemExit('дайджест по отсутствующей базе не должен строиться')
+    lazy.close()
+    if os.path.exists(missing):
+        raise SystemExit('база только для чтения не должна создавать файл')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Пиковая память выгрузки yandex_balances: fetchall против iter_balance_history.
+
+Каждый режим выгрузки запускается в отдельном процессе, пиковая память —
+максимальный RSS процесса (ru_maxrss) за вычетом RSS до выгрузки.
+
+Запуск:
+    python benchmarks/bench_streaming.py [--rows 10000000] [--chunk-size 5000]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+
+from common import create_database
+
+from sqlite_lib.database import DataAggregator
+
+MODES = ('fetchall-dict', 'iter-dict', 'iter-namedtuple', 'iter-tuple')
+
+
+def fill_yandex_balances(db_path, rows, cabinets=1000):
+    """Сгенерировать rows строк yandex_balances одним INSERT ... SELECT"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        WITH RECURSIVE seq(n) AS (
+            SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n + 1 < ?
+        )
+        INSERT INTO yandex_balances (yandex_cabinet_id, balance, fetched_at)
+        SELECT
+            'ya_' || (n % ?),
+            (n % 100000) / 10.0,
+            datetime('2024-01-01', '+' || (n / ?) || ' minutes')
+        FROM seq
+    ''', (rows, cabinets, cabinets))
+    conn.commit()
+    conn.close()
+
+
+def max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS — байты
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def export(db_path, mode, chunk_size):
+    """Выгрузить всю таблицу в выбранном режиме (в дочернем процессе)"""
+    aggregator = DataAggregator(db_path)
+    baseline = max_rss_bytes()
+    started = time.perf_counter()
+    total, count = 0.0, 0
+
+    if mode == 'fetchall-dict':
+        cursor = aggregator.conn.execute(
+            'SELECT yandex_cabinet_id, balance, fetched_at FROM yandex_balances ORDER BY fetched_at'
+        )
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for row in rows:
+            total += row['balance']
+            count += 1
+    else:
+        row_type = mode.split('-', 1)[1]
+        for row in aggregator.iter_balance_history('yandex_balances', chunk_size=chunk_size,
+                                                   row_type=row_type):
+            total += row['balance'] if row_type == 'dict' else row[1]
+            count += 1
+
+    elapsed = time.perf_counter() - started
+    aggregator.close()
+    return {
+        'mode': mode,
+        'rows': count,
+        'seconds': round(elapsed, 3),
+        'peak_mb': round((max_rss_bytes() - baseline) / 2 ** 20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--worker', nargs=2, metavar=('DB_PATH', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(export(args.worker[0], args.worker[1], args.chunk_size)))
+        return
+
+    db_path = create_database()
+    # Схема DataAggregator (индексы, агрегаты) создается до заполнения,
+    # чтобы не мерить ее построение в дочерних процессах; агрегаты для
+    # выгрузки сырых строк не нужны
+    DataAggregator(db_path).close()
+    fill_yandex_balances(db_path, args.rows)
+
+    print(f"{'mode':<18} {'rows':>10} {'seconds':>9} {'peak MB':>9}")
+    for mode in args.modes:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--chunk-size', str(args.chunk_size),
+             '--worker', db_path, mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output)
+        print(f"{result['mode']:<18} {result['rows']:>10} {result['seconds']:>9.2f} "
+              f"{result['peak_mb']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""Набор бенчмарков всех публичных методов DataAggregator с отчетом в JSON.
+
+База заполняется синтетическими проектами и многомесячной историей
+балансов и статистики MyTracker (seed_projects, фиксированное зерно), так
+что при одинаковых параметрах запуски сравнимы между версиями. Для каждого
+метода печатаются и сохраняются: число вызовов, пропускная способность
+(вызовов и строк в секунду), перцентили задержки и пиковая память Python
+(tracemalloc, отдельным прогоном: память SQLite в нее не входит).
+
+Запуск:
+    python benchmarks/bench_suite.py run [--scale medium] [--projects 100]
+        [--days 90] [--samples-per-day 4] [--iterations 20] [--output results.json]
+    python benchmarks/bench_suite.py compare old.json new.json [--threshold 0.20]
+
+compare выводит изменения p50/p95 и пиковой памяти по каждому методу и
+завершается с кодом 1, если есть регрессии больше порога.
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from common import PollClock, create_database, seed_projects
+
+from sqlite_lib.database import DataAggregator
+from sqlite_lib.retention import RetentionPolicy
+
+# Готовые масштабы: проекты, дни истории, замеров баланса в день
+SCALES = {
+    'small': (20, 35, 4),
+    'medium': (100, 90, 4),
+    'large': (1000, 180, 6),
+}
+
+# Публичные методы, которые не замеряются отдельно, и почему
+SKIPPED = {
+    'close': 'закрывает соединение; входит во время каждого прогона',
+    'batch': 'контекстный менеджер; замеряется как batch_save_vk_balance',
+    'get_metrics': 'метрики выключены, метод возвращает None',
+    'get_metrics_prometheus': 'метрики выключены, метод возвращает None',
+    'move_rows_to_partitions': 'только для partitioned=True',
+}
+
+
+class Case:
+    """Замеряемая операция
+
+    Args:
+        name: имя в отчете (обычно имя метода)
+        run: функция (aggregator, state) -> число обработанных строк или None
+        setup: функция (aggregator, iteration) -> state, выполняется перед
+            каждым вызовом вне замера
+        iterations: сколько раз вызывать; None — как задано в --iterations
+    """
+
+    def __init__(self, name, run, setup=None, iterations=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.iterations = iterations
+
+
+def _count(rows):
+    return sum(1 for _ in rows)
+
+
+def _new_project(aggregator, iteration, clock):
+    """Проект с историей для delete_project (создается вне замера)"""
+    suffix = f'bench_{iteration}'
+    project_id = aggregator.add_project(f'Bench {iteration}', f'vk_{suffix}',
+                                        f'ya_{suffix}', f'mt_{suffix}')
+    for _ in range(10):
+        fetched_at = clock()
+        aggregator.save_vk_balance(f'vk_{suffix}', 1.0, fetched_at)
+        aggregator.save_yandex_balance(f'ya_{suffix}', 1.0, fetched_at)
+    aggregator.save_mt_stats(f'mt_{suffix}', 1, 1, 1)
+    return project_id
+
+
+def build_cases(projects, days):
+    """Операции в порядке прогона: чтение, запись, затем обслуживание
+
+    Записи получают время замера от общих часов (PollClock), а пачки —
+    разные кабинеты, так что замеряются вставки, а не замены строк.
+    """
+    today = datetime.now(timezone.utc).date()
+    month_ago = (today - timedelta(days=30)).isoformat()
+    bulk = 500
+    clock = PollClock()
+
+    def pick(iteration):
+        return iteration % projects
+
+    return [
+        Case('get_list_of_projects', lambda a, s: len(a.get_list_of_projects())),
+        Case('iter_list_of_projects', lambda a, s: _count(a.iter_list_of_projects(row_type='tuple'))),
+        Case('get_project_by_vk_cabinet',
+             lambda a, s: a.get_project_by_vk_cabinet(f'vk_{s}') and 1, lambda a, i: pick(i)),
+        Case('get_project_by_yandex_cabinet',
+             lambda a, s: a.get_project_by_yandex_cabinet(f'ya_{s}') and 1, lambda a, i: pick(i)),
+        Case('get_project_by_mytracker_id',
+             lambda a, s: a.get_project_by_mytracker_id(f'mt_{s}') and 1, lambda a, i: pick(i)),
+        Case('get_all_vk_balances', lambda a, s: len(a.get_all_vk_balances())),
+        Case('iter_all_vk_balances', lambda a, s: _count(a.iter_all_vk_balances(row_type='tuple'))),
+        Case('get_all_yandex_balances_today', lambda a, s: len(a.get_all_yandex_balances_today())),
+        Case('iter_yandex_balances_today',
+             lambda a, s: _count(a.iter_yandex_balances_today(False, row_type='tuple'))),
+        Case('iter_balance_history',
+             lambda a, s: _count(a.iter_balance_history('vk_balances', date_from=month_ago,
+                                                        row_type='tuple'))),
+        Case('get_time_series',
+             lambda a, s: len(a.get_time_series('yandex_balances', date_from=month_ago))),
+        Case('get_latest_data_for_digest', lambda a, s: len(a.get_latest_data_for_digest())),
+        Case('get_project_stats_for_period',
+             lambda a, s: len(a.get_project_stats_for_period(f'vk_{s}', f'ya_{s}', f'mt_{s}', days=30)),
+             lambda a, i: pick(i)),
+        Case('get_digest_data', lambda a, s: sum(len(part) for part in a.get_digest_data().values())),
+        Case('get_cache_stats', lambda a, s: a.get_cache_stats() and None),
+        Case('get_rejected_rows', lambda a, s: len(a.get_rejected_rows())),
+        Case('get_connection_settings', lambda a, s: a.get_connection_settings() and None),
+        Case('verify_indexes', lambda a, s: len(a.verify_indexes())),
+        Case('get_schema_version', lambda a, s: a.get_schema_version() and None),
+        Case('explain_query_plan',
+             lambda a, s: len(a.explain_query_plan(
+                 'SELECT * FROM vk_balances WHERE vk_cabinet_id = ? ORDER BY fetched_at', ('vk_1',)))),
+        Case('check_rollups', lambda a, s: len(a.check_rollups(date_from=month_ago)), iterations=3),
+        Case('export_rows', lambda a, s: a.export_rows('vk_balances', io.StringIO(), 'csv',
+                                                       date_from=month_ago), iterations=3),
+        Case('backup', lambda a, s: a.backup(os.path.join(s, 'backup.db'), sleep=0)['pages'],
+             lambda a, i: tempfile.mkdtemp(prefix='sqlite_lib_backup_'), iterations=3),
+
+        Case('add_project', lambda a, s: a.add_project(f'Added {s}', f'vk_added_{s}') and 1,
+             lambda a, i: i),
+        Case('save_vk_balance', lambda a, s: a.save_vk_balance(f'vk_{s}', 1.0, clock()) or 1,
+             lambda a, i: pick(i)),
+        Case('save_yandex_balance', lambda a, s: a.save_yandex_balance(f'ya_{s}', 1.0, clock()) or 1,
+             lambda a, i: pick(i)),
+        Case('save_mt_stats', lambda a, s: a.save_mt_stats(f'mt_{s}', 1, 1, 1, clock()) or 1,
+             lambda a, i: pick(i)),
+        Case('save_vk_balances_bulk', lambda a, s: a.save_vk_balances_bulk(
+            [{'vk_cabinet_id': f'vk_{i}', 'balance': float(i)} for i in range(bulk)], clock())),
+        Case('save_yandex_balances_bulk', lambda a, s: a.save_yandex_balances_bulk(
+            [{'login': f'ya_{i}', 'amount': float(i)} for i in range(bulk)], clock())),
+        Case('save_mt_stats_bulk', lambda a, s: a.save_mt_stats_bulk(
+            [{'mytracker_project_id': f'mt_{i}', 'registrations': i} for i in range(bulk)], clock())),
+        Case('batch_save_vk_balance', lambda a, s: _batch_writes(a, projects, bulk, clock)),
+        Case('import_rows', lambda a, s: a.import_rows('yandex_balances', s, 'csv'),
+             lambda a, i: _import_file(bulk, i)),
+        Case('flush', lambda a, s: a.flush()),
+        Case('toggle_project_status',
+             lambda a, s: a.toggle_project_status(s + 1, True) and 1, lambda a, i: pick(i)),
+        Case('edit_project_mytracker_id',
+             lambda a, s: a.edit_project_mytracker_id(s + 1, f'mt_{s}') and 1, lambda a, i: pick(i)),
+        Case('delete_project', lambda a, s: a.delete_project(s) and 1,
+             lambda a, i: _new_project(a, i, clock)),
+        Case('migrate_schema', lambda a, s: len(a.migrate_schema()), iterations=3),
+        Case('reset_projects_counter', lambda a, s: a.reset_projects_counter(), iterations=3),
+
+        Case('deduplicate_raw_rows', lambda a, s: sum(a.deduplicate_raw_rows().values()),
+             iterations=1),
+        Case('rebuild_rollups', lambda a, s: sum(a.rebuild_rollups(date_from=month_ago).values()),
+             iterations=3),
+        Case('rebuild_snapshots', lambda a, s: a.rebuild_snapshots() and None, iterations=3),
+        Case('apply_retention', lambda a, s: a.apply_retention(
+            RetentionPolicy(raw_days=days // 2, hourly_days=days))['tables'] and None, iterations=1),
+        Case('enable_incremental_vacuum', lambda a, s: a.enable_incremental_vacuum(), iterations=1),
+    ]
+
+
+def _import_file(rows, iteration):
+    """CSV для import_rows: rows строк истории за час iteration часов назад"""
+    fetched_at = (datetime.now(timezone.utc) - timedelta(hours=iteration)).strftime('%Y-%m-%d %H:%M:%S')
+    lines = ['yandex_cabinet_id,balance,fetched_at']
+    lines.extend(f'ya_{i},{float(i)},{fetched_at}' for i in range(rows))
+    return io.StringIO('\n'.join(lines))
+
+
+def _batch_writes(aggregator, projects, rows, clock):
+    with aggregator.batch():
+        for i in range(rows):
+            aggregator.save_vk_balance(f'vk_{i % projects}', float(i), clock())
+    return rows
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу из отсортированного списка"""
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def measure(aggregator, case, iterations):
+    """Прогнать операцию iterations раз и отдельно замерить память"""
+    timings, rows = [], 0
+    for iteration in range(iterations):
+        state = case.setup(aggregator, iteration) if case.setup else None
+        started = time.perf_counter()
+        processed = case.run(aggregator, state)
+        timings.append(time.perf_counter() - started)
+        rows += processed or 0
+
+    # Память — отдельным вызовом: tracemalloc сильно замедляет Python-код
+    state = case.setup(aggregator, iterations) if case.setup else None
+    tracemalloc.start()
+    try:
+        case.run(aggregator, state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    total = sum(timings)
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'rows': rows,
+        'seconds_total': round(total, 6),
+        'ops_per_sec': round(iterations / total, 2) if total else None,
+        'rows_per_sec': round(rows / total, 2) if total and rows else None,
+        'latency_ms': {
+            'min': round(timings[0] * 1000, 4),
+            'mean': round(total / iterations * 1000, 4),
+            'p50': round(percentile(timings, 0.50) * 1000, 4),
+            'p95': round(percentile(timings, 0.95) * 1000, 4),
+            'p99': round(percentile(timings, 0.99) * 1000, 4),
+            'max': round(timings[-1] * 1000, 4),
+        },
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def uncovered_methods(cases):
+    """Публичные методы DataAggregator без замера и без причины в SKIPPED"""
+    covered = {case.name for case in cases} | set(SKIPPED)
+    return sorted(
+        name for name, value in vars(DataAggregator).items()
+        if not name.startswith('_') and callable(value) and name not in covered
+    )
+
+
+def package_version():
+    try:
+        from importlib.metadata import version
+        return version('sqlite_lib')
+    except Exception:
+        return None
+
+
+def run(args):
+    projects, days, samples = SCALES[args.scale]
+    projects = args.projects or projects
+    days = args.days or days
+    samples = args.samples_per_day or samples
+
+    cases = build_cases(projects, days)
+    if args.only:
+        cases = [case for case in cases if case.name in args.only]
+    missing = uncovered_methods(build_cases(projects, days))
+    if missing:
+        print(f"Внимание: методы без бенчмарка: {', '.join(missing)}", file=sys.stderr)
+
+    db_path = create_database()
+    started = time.perf_counter()
+    seed_projects(db_path, projects, days=days, samples_per_day=samples, seed=args.seed)
+    aggregator = DataAggregator(db_path, profile=args.profile)
+    setup_seconds = time.perf_counter() - started
+
+    results = {}
+    print(f"{'method':<32} {'calls':>6} {'p50, ms':>10} {'p95, ms':>10} {'ops/s':>10} {'peak KB':>9}")
+    for case in cases:
+        result = measure(aggregator, case, case.iterations or args.iterations)
+        results[case.name] = result
+        print(f"{case.name:<32} {result['iterations']:>6} {result['latency_ms']['p50']:>10.3f} "
+              f"{result['latency_ms']['p95']:>10.3f} {result['ops_per_sec'] or 0:>10.1f} "
+              f"{result['peak_memory_kb']:>9.1f}")
+    aggregator.close()
+
+    report = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            'package_version': package_version(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'scale': {'projects': projects, 'days': days, 'samples_per_day': samples,
+                      'seed': args.seed},
+            'profile': args.profile,
+            'setup_seconds': round(setup_seconds, 3),
+            'uncovered_methods': missing,
+        },
+        'cases': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты записаны в {args.output}")
+    return 0
+
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+
+    if baseline['meta'].get('scale') != current['meta'].get('scale'):
+        print("Внимание: файлы сняты на разных масштабах данных", file=sys.stderr)
+
+    regressions = []
+    print(f"{'method':<32} {'p50 old':>9} {'p50 new':>9} {'p50':>8} {'p95':>8} {'memory':>8}")
+    for name, new in current['cases'].items():
+        old = baseline['cases'].get(name)
+        if old is None:
+            print(f"{name:<32} {'новый метод':>9}")
+            continue
+        changes = {
+            'p50': _change(old['latency_ms']['p50'], new['latency_ms']['p50'], args.min_delta_ms),
+            'p95': _change(old['latency_ms']['p95'], new['latency_ms']['p95'], args.min_delta_ms),
+            'memory': _change(old['peak_memory_kb'], new['peak_memory_kb'], args.min_delta_kb),
+        }
+        flagged = [key for key, change in changes.items()
+                   if key != 'p95' and change is not None and change > args.threshold]
+        marker = '  РЕГРЕССИЯ' if flagged else ''
+        print(f"{name:<32} {old['latency_ms']['p50']:>9.3f} {new['latency_ms']['p50']:>9.3f} "
+              + ' '.join(_format_change(changes[key]) for key in ('p50', 'p95', 'memory'))
+              + marker)
+        if flagged:
+            regressions.append((name, flagged))
+
+    for name in baseline['cases'].keys() - current['cases'].keys():
+        print(f"{name:<32} {'нет в новом прогоне':>9}")
+
+    if regressions:
+        print(f"\nРегрессии больше {args.threshold:.0%}: "
+              + ', '.join(f"{name} ({'/'.join(keys)})" for name, keys in regressions))
+        return 1
+    print(f"\nРегрессий больше {args.threshold:.0%} нет")
+    return 0
+
+
+def _change(old, new, min_delta):
+    """Относительное изменение; None, если разница меньше шума min_delta"""
+    if abs(new - old) < min_delta or not old:
+        return None
+    return new / old - 1
+
+
+def _format_change(change):
+    return f"{'~':>8}" if change is None else f"{change:>+8.1%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='прогнать бенчмарки')
+    run_parser.add_argument('--scale', choices=SCALES, default='medium')
+    run_parser.add_argument('--projects', type=int, help='переопределить число проектов')
+    run_parser.add_argument('--days', type=int, help='переопределить дни истории')
+    run_parser.add_argument('--samples-per-day', type=int, help='замеров баланса в день')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--iterations', type=int, default=20)
+    run_parser.add_argument('--profile', default=None, help='профиль соединения')
+    run_parser.add_argument('--only', nargs='+', help='только эти методы')
+    run_parser.add_argument('--output', help='файл для JSON-отчета')
+
+    compare_parser = commands.add_parser('compare', help='сравнить два JSON-отчета')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.20,
+                                help='допустимый рост p50 и памяти, доля (0.20 = 20%%)')
+    compare_parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                                help='изменения задержки меньше этого считаются шумом')
+    compare_parser.add_argument('--min-delta-kb', type=float, default=16.0,
+                                help='изменения памяти меньше этого считаются шумом')
+
+    args = parser.parse_args()
+    sys.exit(run(args) if args.command == 'run' else compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Импорт, экспорт и онлайн-копия: import_rows/export_rows/backup.
+
+1. Загрузка --rows строк истории Yandex: циклом save_yandex_balances_bulk
+   по одной пачке на замер (как раньше при бэкфилле) против import_rows
+   из CSV. Обе базы затем сверяются.
+2. Выгрузка всей истории в CSV и JSONL: скорость и пиковая память Python
+   (tracemalloc) — она не должна расти с объемом.
+3. backup() под нагрузкой: поток пишет балансы, пока снимается копия;
+   печатается длительность копии и худшая задержка записи.
+
+Запуск:
+    python benchmarks/bench_transfer.py [--rows 200000] [--cabinets 200]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from common import PollClock, create_database
+
+from sqlite_lib.database import DataAggregator
+
+
+def history(rows, cabinets):
+    """Строки (кабинет, баланс, fetched_at) по часам назад от текущего часа"""
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    for i in range(rows):
+        fetched_at = now - timedelta(hours=i // cabinets)
+        yield f'ya_{i % cabinets}', float(i % 100000), fetched_at.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def write_csv(path, rows, cabinets):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('yandex_cabinet_id,balance,fetched_at\n')
+        for row in history(rows, cabinets):
+            file.write(','.join(map(str, row)) + '\n')
+
+
+def load_with_bulk(aggregator, rows, cabinets):
+    """Как бэкфилл циклом: save_yandex_balances_bulk на каждый замер
+
+    fetched_at у save_* — текущее время, поэтому строки пишутся напрямую
+    через _insert_raw_rows с нужным временем, тем же путем, что и save_*.
+    """
+    batch = []
+    for row in history(rows, cabinets):
+        batch.append(row)
+        if len(batch) == cabinets:
+            with aggregator._writer():
+                aggregator._insert_raw_rows('yandex_balances', batch)
+                aggregator._commit(len(batch))
+            batch = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--cabinets', type=int, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='sqlite_lib_transfer_')
+    csv_path = os.path.join(directory, 'yandex_balances.csv')
+    write_csv(csv_path, args.rows, args.cabinets)
+
+    bulk = DataAggregator(create_database(directory, 'bulk.db'), profile='bulk-ingest')
+    started = time.perf_counter()
+    load_with_bulk(bulk, args.rows, args.cabinets)
+    bulk_seconds = time.perf_counter() - started
+
+    imported = DataAggregator(create_database(directory, 'import.db'), profile='bulk-ingest')
+    started = time.perf_counter()
+    imported.import_rows('yandex_balances', csv_path)
+    import_seconds = time.perf_counter() - started
+
+    same = (list(bulk.iter_balance_history('yandex_balances'))
+            == list(imported.iter_balance_history('yandex_balances')))
+    print(f'Загрузка {args.rows} строк:')
+    print(f'  save_*_bulk по замерам  {bulk_seconds:8.2f} с  {args.rows / bulk_seconds:>10.0f} строк/с')
+    print(f'  import_rows из CSV      {import_seconds:8.2f} с  {args.rows / import_seconds:>10.0f} строк/с'
+          f'  ({bulk_seconds / import_seconds:.1f}x)')
+    print(f'  данные совпадают: {same}, агрегаты: {imported.check_rollups() or "ok"}')
+    bulk.close()
+
+    print('Выгрузка:')
+    for fmt in ('csv', 'jsonl'):
+        path = os.path.join(directory, f'export.{fmt}')
+        started = time.perf_counter()
+        count = imported.export_rows('yandex_balances', path)
+        seconds = time.perf_counter() - started
+        tracemalloc.start()
+        imported.export_rows('yandex_balances', path)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'  {fmt:<6} {count} строк за {seconds:.2f} с ({count / seconds:.0f} строк/с), '
+              f'пик памяти {peak / 1024:.0f} КиБ, файл {os.path.getsize(path) / 2 ** 20:.1f} МиБ')
+
+    stop = threading.Event()
+    latencies = []
+
+    def writer():
+        aggregator = DataAggregator(imported.db_path, profile='bulk-ingest')
+        clock = PollClock()
+        i = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            aggregator.save_vk_balance(f'vk_{i % args.cabinets}', float(i), clock())
+            latencies.append(time.perf_counter() - started)
+            i += 1
+            time.sleep(0.002)
+        aggregator.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    time.sleep(0.1)
+    result = imported.backup(os.path.join(directory, 'backup.db'), pages=500, sleep=0.005)
+    stop.set()
+    thread.join()
+    check = sqlite3.connect(os.path.join(directory, 'backup.db'))
+    integrity = check.execute('PRAGMA integrity_check').fetchone()[0]
+    check.close()
+    print(f"backup: {result['pages']} страниц за {result['seconds']:.2f} с, перезапусков "
+          f"{result['restarts']}, integrity_check: {integrity}")
+    print(f'  записей во время копии: {len(latencies)}, худшая задержка '
+          f'{max(latencies) * 1000:.1f} мс')
+    imported.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Общие утилиты для бенчмарков: схема, генерация данных, замер времени."""
+
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    vk_cabinet_id TEXT,
+    yandex_cabinet_id TEXT,
+    mytracker_project_id TEXT,
+    is_active INTEGER DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS vk_balances (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vk_cabinet_id TEXT NOT NULL,
+    balance REAL,
+    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS yandex_balances (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    yandex_cabinet_id TEXT NOT NULL,
+    balance REAL,
+    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS mt_stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mytracker_project_id TEXT NOT NULL,
+    registrations INTEGER DEFAULT 0,
+    first_logins INTEGER DEFAULT 0,
+    reactivations INTEGER DEFAULT 0,
+    fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+
+def create_database(directory=None, name='bench.db'):
+    """Создать пустую базу со схемой во временной директории.
+
+    Returns:
+        str: путь к файлу базы данных.
+    """
+    directory = directory or tempfile.mkdtemp(prefix='sqlite_lib_bench_')
+    db_path = os.path.join(directory, name)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def seed_projects(db_path, projects_count, days=3, samples_per_day=4, seed=42):
+    """Заполнить базу проектами и историей балансов/статистики.
+
+    Args:
+        db_path: путь к базе
+        projects_count: количество проектов
+        days: сколько дней истории сгенерировать (включая сегодня)
+        samples_per_day: сколько замеров баланса на кабинет в день
+        seed: зерно генератора случайных чисел
+    """
+    rnd = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    conn = sqlite3.connect(db_path)
+
+    projects = []
+    for i in range(projects_count):
+        projects.append((
+            f'Project {i}',
+            f'vk_{i}',
+            f'ya_{i}',
+            f'mt_{i}',
+            0 if i % 10 == 9 else 1,
+        ))
+    conn.executemany('''
+        INSERT INTO projects (name, vk_cabinet_id, yandex_cabinet_id, mytracker_project_id, is_active)
+        VALUES (?, ?, ?, ?, ?)
+    ''', projects)
+
+    # Строки пишутся по дню, чтобы длинная история не копилась в памяти
+    step = timedelta(hours=24 / samples_per_day)
+    for day in range(days):
+        vk_rows, ya_rows, mt_rows = [], [], []
+        day_start = (now - timedelta(days=day)).replace(hour=0, minute=0, second=0)
+        for sample in range(samples_per_day):
+            ts = (day_start + step * sample).strftime('%Y-%m-%d %H:%M:%S')
+            for i in range(projects_count):
+                vk_rows.append((f'vk_{i}', round(rnd.uniform(0, 100000), 2), ts))
+                ya_rows.append((f'ya_{i}', round(rnd.uniform(0, 100000), 2), ts))
+        ts = day_start.strftime('%Y-%m-%d %H:%M:%S')
+        for i in range(projects_count):
+            mt_rows.append((f'mt_{i}', rnd.randint(0, 500), rnd.randint(0, 400), rnd.randint(0, 50), ts))
+
+        conn.executemany(
+            'INSERT INTO vk_balances (vk_cabinet_id, balance, fetched_at) VALUES (?, ?, ?)', vk_rows)
+        conn.executemany(
+            'INSERT INTO yandex_balances (yandex_cabinet_id, balance, fetched_at) VALUES (?, ?, ?)', ya_rows)
+        conn.executemany('''
+            INSERT INTO mt_stats (mytracker_project_id, registrations, first_logins, reactivations, fetched_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', mt_rows)
+    conn.commit()
+    conn.close()
+
+
+class PollClock:
+    """Метки fetched_at для замеров подряд, каждая на секунду позже предыдущей
+
+    Натуральный ключ сырых строк — (кабинет, fetched_at), а бенчмарки пишут
+    быстрее одного замера в секунду: с текущим временем замеры одного
+    кабинета заменяли бы друг друга, и замерялись бы замены, а не вставки.
+    Часы можно делить между потоками: next() у itertools.count атомарен.
+    """
+
+    def __init__(self, start=None):
+        self.start = start or datetime.utcnow().replace(microsecond=0)
+        self._counter = itertools.count()
+
+    def __call__(self):
+        moment = self.start + timedelta(seconds=next(self._counter))
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def best_of(func, repeat=5):
+    """Минимальное время выполнения func за repeat запусков, в секундах."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
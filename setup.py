@@ -3,5 +3,9 @@ from setuptools import setup, find_packages
 setup(
     name="sqlite_lib",
     version="0.3.1",
-    packages=find_packages()
+    packages=find_packages(),
+    extras_require={
+        "numpy": ["numpy"],
+        "arrow": ["numpy", "pyarrow"],
+    }
 )
\ No newline at end of file
@@ -0,0 +1,324 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from .database import DataAggregator
+
+
+class AsyncDataAggregator:
+    """Асинхронная обертка над DataAggregator для коллекторов на asyncio
+
+    Вся работа с SQLite идет в отдельных потоках, event loop не блокируется:
+    - записи выполняются в одном потоке-писателе; вызовы, пришедшие от
+      разных корутин, пока писатель занят, объединяются в одну транзакцию
+      (каждый вызов в своем SAVEPOINT, так что ошибка одного не откатывает
+      остальные);
+    - чтения выполняются в пуле потоков через соединения пула
+      DataAggregator (readers > 0) или в потоке-писателе (readers == 0);
+    - iter_* — асинхронные генераторы: порции по chunk_size строк читаются
+      в пуле потоков, пока генератор не исчерпан или не закрыт, он держит
+      соединение пула;
+    - import_rows и flush выполняются в потоке-писателе после уже
+      поставленных в очередь записей, но вне общей транзакции.
+
+    Служебные методы обслуживания базы (rebuild_rollups, rebuild_snapshots,
+    check_rollups, apply_retention, enable_incremental_vacuum,
+    deduplicate_raw_rows, move_rows_to_partitions, backup, migrate_schema,
+    reset_projects_counter, verify_indexes, explain_query_plan) намеренно
+    не обернуты: их запускают разово из скриптов через DataAggregator.
+
+    Пример:
+        async with AsyncDataAggregator('marketing_digest.db', profile='bulk-ingest') as db:
+            await asyncio.gather(*(db.save_yandex_balances_bulk(chunk) for chunk in chunks))
+            digest = await db.get_digest_data()
+            async for row in db.iter_balance_history('vk_balances'):
+                ...
+    """
+
+    def __init__(self, db_path=None, profile=None, readers=2, max_batch=1000):
+        """
+        Args:
+            db_path: путь к файлу базы данных (по умолчанию default_db_path())
+            profile: профиль соединения (см. CONNECTION_PROFILES)
+            readers: число потоков и соединений для чтения; 0 — читать
+                в потоке-писателе
+            max_batch: сколько вызовов записи объединять в одну транзакцию
+        """
+        self.readers = readers
+        self.max_batch = max_batch
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+        self._read_executor = (
+            ThreadPoolExecutor(max_workers=readers, thread_name_prefix='sqlite-reader')
+            if readers else self._write_executor
+        )
+        # Соединение на запись создается в потоке-писателе
+        self._opening = self._write_executor.submit(
+            DataAggregator, db_path, profile=profile, pool_size=readers
+        )
+        self._aggregator = None
+        self._pending = []
+        self._writer_task = None
+        self._closed = False
+
+    async def __aenter__(self):
+        await self._get_aggregator()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get_aggregator(self):
+        if self._aggregator is None:
+            self._aggregator = await asyncio.wrap_future(self._opening)
+        return self._aggregator
+
+    async def _read(self, method, *args, **kwargs):
+        aggregator = await self._get_aggregator()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._read_executor, lambda: getattr(aggregator, method)(*args, **kwargs)
+        )
+
+    async def _iterate(self, method, *args, **kwargs):
+        """Асинхронный генератор поверх iter_*: порции читаются в пуле потоков"""
+        aggregator = await self._get_aggregator()
+        loop = asyncio.get_running_loop()
+        chunk_size = kwargs['chunk_size']
+        rows = await loop.run_in_executor(
+            self._read_executor, lambda: getattr(aggregator, method)(*args, **kwargs)
+        )
+        try:
+            while True:
+                chunk = await loop.run_in_executor(
+                    self._read_executor, _next_chunk, rows, chunk_size
+                )
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield row
+        finally:
+            # Закрыть генератор в потоке чтения, чтобы вернуть соединение в пул
+            await loop.run_in_executor(self._read_executor, rows.close)
+
+    async def _write_alone(self, method, *args, **kwargs):
+        """Выполнить вызов в потоке-писателе вне пачки записей
+
+        Сначала дописываются уже поставленные в очередь записи.
+        """
+        if self._closed:
+            raise RuntimeError("AsyncDataAggregator закрыт")
+        aggregator = await self._get_aggregator()
+        if self._writer_task is not None:
+            await self._writer_task
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._write_executor, lambda: getattr(aggregator, method)(*args, **kwargs)
+        )
+
+    async def _write(self, method, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError("AsyncDataAggregator закрыт")
+        await self._get_aggregator()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((method, args, kwargs, future))
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._drain())
+        return await future
+
+    async def _drain(self):
+        """Выполнять накопленные записи пачками, пока очередь не опустеет"""
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            operations = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            calls = [(method, args, kwargs) for method, args, kwargs, _ in operations]
+            try:
+                results = await loop.run_in_executor(self._write_executor, self._apply, calls)
+            except asyncio.CancelledError:
+                for *_, future in operations:
+                    future.cancel()
+                raise
+            except Exception as exc:
+                for *_, future in operations:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (*_, future), (ok, value) in zip(operations, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _apply(self, calls):
+        """Выполнить вызовы одной транзакцией (в потоке-писателе)
+
+        Returns:
+            list: пары (успех, результат или исключение) по каждому вызову
+        """
+        aggregator = self._aggregator
+        results = []
+        with aggregator.batch():
+            conn = aggregator.conn
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            for method, args, kwargs in calls:
+                conn.execute('SAVEPOINT async_write')
+                try:
+                    value = getattr(aggregator, method)(*args, **kwargs)
+                except Exception as exc:
+                    conn.execute('ROLLBACK TO async_write')
+                    conn.execute('RELEASE async_write')
+                    results.append((False, exc))
+                else:
+                    conn.execute('RELEASE async_write')
+                    results.append((True, value))
+        return results
+
+    async def close(self):
+        """Дописать очередь записей и закрыть соединения"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer_task is not None:
+            await self._writer_task
+        aggregator = await self._get_aggregator()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._write_executor, aggregator.close)
+        self._write_executor.shutdown(wait=True)
+        if self._read_executor is not self._write_executor:
+            self._read_executor.shutdown(wait=True)
+
+    # Запись
+
+    async def add_project(self, name, vk_cabinet_id=None,
+                          yandex_cabinet_id=None, mytracker_project_id=None):
+        """Добавить новый проект"""
+        return await self._write('add_project', name, vk_cabinet_id,
+                                 yandex_cabinet_id, mytracker_project_id)
+
+    async def save_vk_balance(self, vk_cabinet_id, balance, fetched_at=None):
+        """Сохранить баланс VK для кабинета"""
+        return await self._write('save_vk_balance', vk_cabinet_id, balance, fetched_at)
+
+    async def save_yandex_balance(self, yandex_cabinet_id, balance, fetched_at=None):
+        """Сохранить баланс Yandex для кабинета"""
+        return await self._write('save_yandex_balance', yandex_cabinet_id, balance, fetched_at)
+
+    async def save_vk_balances_bulk(self, balances, fetched_at=None):
+        """Сохранить балансы VK для нескольких кабинетов (см. DataAggregator)"""
+        return await self._write('save_vk_balances_bulk', balances, fetched_at)
+
+    async def save_yandex_balances_bulk(self, balances, fetched_at=None):
+        """Сохранить балансы Yandex для нескольких кабинетов (см. DataAggregator)"""
+        return await self._write('save_yandex_balances_bulk', balances, fetched_at)
+
+    async def save_mt_stats(self, mytracker_project_id, registrations=0, first_logins=0,
+                            reactivations=0, fetched_at=None):
+        """Сохранить статистику MyTracker для проекта"""
+        return await self._write('save_mt_stats', mytracker_project_id, registrations,
+                                 first_logins, reactivations, fetched_at)
+
+    async def save_mt_stats_bulk(self, stats, fetched_at=None, replace_for_date=False):
+        """Сохранить статистику MyTracker для нескольких проектов (см. DataAggregator)"""
+        return await self._write('save_mt_stats_bulk', stats, fetched_at, replace_for_date)
+
+    async def delete_project(self, project_id):
+        """Удалить проект и все связанные данные"""
+        return await self._write('delete_project', project_id)
+
+    async def toggle_project_status(self, project_id, is_active):
+        """Активировать/деактивировать проект"""
+        return await self._write('toggle_project_status', project_id, is_active)
+
+    async def edit_project_mytracker_id(self, project_id, mytracker_project_id):
+        """Изменить mytracker_id проекта"""
+        return await self._write('edit_project_mytracker_id', project_id, mytracker_project_id)
+
+    async def import_rows(self, table, source, format=None, chunk_size=10000,
+                          transaction_rows=200000, rebuild_indexes=True):
+        """Потоковый импорт строк таблицы из CSV или JSONL (см. DataAggregator)"""
+        return await self._write_alone('import_rows', table, source, format, chunk_size,
+                                       transaction_rows, rebuild_indexes)
+
+    async def flush(self):
+        """Дописать очередь записей и закоммитить накопленные изменения"""
+        return await self._write_alone('flush')
+
+    # Чтение
+
+    async def get_list_of_projects(self):
+        """Получить список всех проектов"""
+        return await self._read('get_list_of_projects')
+
+    def iter_list_of_projects(self, chunk_size=1000, row_type='dict'):
+        """Асинхронно перебрать все проекты порциями (см. DataAggregator)"""
+        return self._iterate('iter_list_of_projects', chunk_size=chunk_size, row_type=row_type)
+
+    async def get_project_by_vk_cabinet(self, vk_cabinet_id):
+        """Найти проект по VK кабинету"""
+        return await self._read('get_project_by_vk_cabinet', vk_cabinet_id)
+
+    async def get_project_by_yandex_cabinet(self, yandex_cabinet_id):
+        """Найти проект по Yandex кабинету"""
+        return await self._read('get_project_by_yandex_cabinet', yandex_cabinet_id)
+
+    async def get_project_by_mytracker_id(self, mytracker_project_id):
+        """Найти проект по MyTracker ID"""
+        return await self._read('get_project_by_mytracker_id', mytracker_project_id)
+
+    async def get_all_vk_balances(self):
+        """Получить балансы VK по проектам за сегодня"""
+        return await self._read('get_all_vk_balances')
+
+    def iter_all_vk_balances(self, chunk_size=1000, row_type='dict'):
+        """Асинхронно перебрать балансы VK по проектам за сегодня (см. DataAggregator)"""
+        return self._iterate('iter_all_vk_balances', chunk_size=chunk_size, row_type=row_type)
+
+    async def get_all_yandex_balances_today(self, latest_per_cabinet=True):
+        """Получить балансы Yandex за сегодня"""
+        return await self._read('get_all_yandex_balances_today', latest_per_cabinet)
+
+    def iter_yandex_balances_today(self, latest_per_cabinet=True, chunk_size=1000,
+                                   row_type='dict'):
+        """Асинхронно перебрать балансы Yandex за сегодня (см. DataAggregator)"""
+        return self._iterate('iter_yandex_balances_today', latest_per_cabinet,
+                             chunk_size=chunk_size, row_type=row_type)
+
+    def iter_balance_history(self, table, cabinet_ids=None, date_from=None, date_to=None,
+                             chunk_size=5000, row_type='tuple'):
+        """Асинхронно перебрать историю сырых строк порциями (см. DataAggregator)"""
+        return self._iterate('iter_balance_history', table, cabinet_ids, date_from, date_to,
+                             chunk_size=chunk_size, row_type=row_type)
+
+    async def get_time_series(self, table, cabinet_ids=None, date_from=None, date_to=None,
+                              value=None, resample=None, how='mean', chunk_size=10000):
+        """Получить временной ряд по сырой таблице (см. DataAggregator)"""
+        return await self._read('get_time_series', table, cabinet_ids, date_from, date_to,
+                                value, resample, how, chunk_size)
+
+    async def get_latest_data_for_digest(self):
+        """Получить последние данные по всем активным проектам для дайджеста"""
+        return await self._read('get_latest_data_for_digest')
+
+    async def get_project_stats_for_period(self, vk_cabinet_id=None, yandex_cabinet_id=None,
+                                           mytracker_project_id=None, days=7):
+        """Получить статистику проекта за период"""
+        return await self._read('get_project_stats_for_period', vk_cabinet_id,
+                                yandex_cabinet_id, mytracker_project_id, days)
+
+    async def get_digest_data(self, icon_path_template='logo/{project}.jpg', days_back=2):
+        """Получить данные для дайджеста со всеми расчетами"""
+        return await self._read('get_digest_data', icon_path_template, days_back)
+
+    async def export_rows(self, table, target, format=None, date_from=None, date_to=None,
+                          chunk_size=5000):
+        """Потоковая выгрузка таблицы в CSV или JSONL (см. DataAggregator)"""
+        return await self._read('export_rows', table, target, format, date_from, date_to,
+                                chunk_size)
+
+
+def _next_chunk(rows, size):
+    """Следующие size строк итератора списком (пустой — итератор исчерпан)"""
+    return list(itertools.islice(rows, size))
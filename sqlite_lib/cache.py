@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ProjectCache:
+    """LRU-кэш с TTL для поиска проекта по ID кабинета
+
+    Ключ — пара (тип ID, значение), например ('vk_cabinet_id', '123'), так
+    что у каждого типа кабинета свой индекс в общем словаре. Кэшируются и
+    отрицательные ответы (проект не найден). Потокобезопасен.
+    """
+
+    # Признак промаха: None — это закэшированный ответ "проект не найден"
+    MISSING = object()
+
+    def __init__(self, ttl=60.0, max_size=1024):
+        """
+        Args:
+            ttl: время жизни записи в секундах
+            max_size: максимальное число записей; самые давно
+                использованные вытесняются первыми
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, kind, value):
+        """Получить проект из кэша
+
+        Returns:
+            dict или None из кэша; ProjectCache.MISSING, если записи нет
+            или она устарела.
+        """
+        key = (kind, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return self.MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            project = entry[1]
+        return dict(project) if project is not None else None
+
+    def put(self, kind, value, project, generation=None):
+        """Положить ответ в кэш
+
+        Args:
+            generation: значение self.generation, прочитанное до запроса
+                к базе; если с тех пор был invalidate(), ответ мог устареть
+                и не кэшируется.
+        """
+        key = (kind, value)
+        stored = dict(project) if project is not None else None
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        """Сбросить все записи (после изменения таблицы projects)"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        """Счетчики кэша
+
+        Returns:
+            dict: hits, misses, evictions, size
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
+
@@ -1,42 +1,738 @@
+import importlib.util
+import os
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+from . import natural_keys, partitions, retention, rollups, schema, snapshots
+from .cache import ProjectCache
+from .metrics import QueryMetrics
+from .pool import ConnectionPool
+from .schema import INDEXES
+from .write_behind import WriteBehindQueue
+
+# Переменная окружения с путем к базе по умолчанию и путь, если она не задана
+DB_PATH_ENV = 'SQLITE_LIB_DB_PATH'
+DEFAULT_DB_PATH = 'marketing_digest.db'
+
+# Именованные наборы PRAGMA для соединения. Значения cache_size < 0 задаются
+# в КиБ, mmap_size в байтах, busy_timeout в миллисекундах.
+CONNECTION_PROFILES = {
+    # Надежность важнее скорости: полный fsync на каждый коммит
+    'safe': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+    },
+    # Коллекторы, пишущие много строк: NORMAL в WAL не теряет целостность,
+    # но пропускает fsync на каждом коммите
+    'bulk-ingest': {
+        'busy_timeout': 10000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+    # Дашборды и дайджесты: большой mmap и кэш страниц
+    'read-heavy': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -131072,
+        'mmap_size': 1073741824,
+        'temp_store': 'MEMORY',
+    },
+}
+
+# Порядок важен: busy_timeout до смены journal_mode, чтобы переключение
+# в WAL подождало чужие блокировки
+CONNECTION_PRAGMAS = (
+    'busy_timeout', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store',
+)
+
+_SYNCHRONOUS_NAMES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+_TEMP_STORE_NAMES = {0: 'DEFAULT', 1: 'FILE', 2: 'MEMORY'}
+
+
+def _resolve_profile(profile):
+    """Получить словарь PRAGMA по имени профиля или проверить переданный словарь"""
+    if profile is None:
+        return {}
+    if isinstance(profile, str):
+        if profile not in CONNECTION_PROFILES:
+            raise ValueError(
+                f"Неизвестный профиль соединения: {profile!r}. "
+                f"Доступны: {', '.join(CONNECTION_PROFILES)}"
+            )
+        return dict(CONNECTION_PROFILES[profile])
+    unknown = set(profile) - set(CONNECTION_PRAGMAS)
+    if unknown:
+        raise ValueError(f"Неподдерживаемые PRAGMA: {', '.join(sorted(unknown))}")
+    return dict(profile)
+
+
+def _apply_profile(conn, profile):
+    """Применить профиль соединения (имя из CONNECTION_PROFILES или словарь PRAGMA)"""
+    pragmas = _resolve_profile(profile)
+    for name in CONNECTION_PRAGMAS:
+        if name in pragmas:
+            if not str(pragmas[name]).lstrip('-').isalnum():
+                raise ValueError(f"Недопустимое значение PRAGMA {name}: {pragmas[name]!r}")
+            conn.execute(f'PRAGMA {name} = {pragmas[name]}').fetchall()
+    return pragmas
+
+
+def _read_connection_settings(conn):
+    settings = {}
+    for name in CONNECTION_PRAGMAS:
+        value = conn.execute(f'PRAGMA {name}').fetchone()[0]
+        if name == 'synchronous':
+            value = _SYNCHRONOUS_NAMES.get(value, value)
+        elif name == 'temp_store':
+            value = _TEMP_STORE_NAMES.get(value, value)
+        elif name == 'journal_mode':
+            value = value.upper()
+        settings[name] = value
+    return settings
+
+
+# С какого числа строк раздела дайджеста изменения считаются в numpy: на
+# меньших дайджестах цикл не медленнее, и процесс не платит за импорт numpy
+_VECTORIZED_DIGEST_ROWS = 1000
+
+# Сырые таблицы и колонки кабинета/проекта в них
+_RAW_KEYS = (
+    ('vk_balances', 'vk_cabinet_id'),
+    ('yandex_balances', 'yandex_cabinet_id'),
+    ('mt_stats', 'mytracker_project_id'),
+)
+
+# Публичные методы, которые не замеряются: batch() возвращает контекстный
+# менеджер, а вызовы get_metrics* не должны попадать в сами метрики
+_UNINSTRUMENTED_METHODS = ('batch', 'get_metrics', 'get_metrics_prometheus')
+
+# Форматы строк для потоковых iter_* методов
+ROW_TYPES = ('dict', 'tuple', 'namedtuple', 'row')
+
+
+def _row_converter(row_type, description):
+    """Функция преобразования кортежа из курсора в строку нужного формата
+
+    Returns:
+        callable или None, если строку нужно отдавать как есть
+    """
+    if row_type in ('tuple', 'row'):
+        return None
+    columns = [column[0] for column in description]
+    if row_type == 'dict':
+        return lambda row: dict(zip(columns, row))
+    return namedtuple('Record', columns, rename=True)._make
+
+
+def _file_uri(path, **params):
+    """URI file:... для sqlite3.connect(..., uri=True) с параметрами (mode=ro и т.п.)"""
+    query = '&'.join(f'{name}={value}' for name, value in params.items())
+    path = path.replace('%', '%25').replace('?', '%3f').replace('#', '%23')
+    return f'file:{path}?{query}' if query else f'file:{path}'
+
+
+def _utc_timestamp():
+    """Текущее время UTC в формате CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS')"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _clamp_to_raw_horizon(conn, date_from):
+    """Сдвинуть начало периода на границу, до которой сырые строки удалены"""
+    horizon = retention.raw_horizon(conn)
+    if horizon is not None and (date_from is None or date_from < horizon):
+        return horizon
+    return date_from
+
+
+def _clip_to_month(month, date_from, date_to):
+    """Пересечение периода [date_from, date_to) с месяцем партиции"""
+    month_from, month_to = partitions.month_bounds(month)
+    return (max(date_from or month_from, month_from),
+            min(date_to or month_to, month_to))
+
+
+def _to_date(value):
+    """Привести datetime, date или строку 'YYYY-MM-DD[ HH:MM:SS]' к date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _numpy_available():
+    """Установлен ли numpy (без импорта)"""
+    return importlib.util.find_spec('numpy') is not None
+
+
+def _period_start(days):
+    """Первый день периода из days дней назад (UTC) в формате 'YYYY-MM-DD'"""
+    return (datetime.now(timezone.utc) - timedelta(days=days)).date().isoformat()
+
+
+def _day_range(day=None):
+    """Полуинтервал [начало суток, начало следующих суток) для фильтра по fetched_at.
+
+    Сравнение fetched_at >= ? AND fetched_at < ? позволяет SQLite искать по
+    индексу, в отличие от DATE(fetched_at) = ?.
 
-def init_from_file(db_path='marketing_digest.db', schema_file='schema.sql'):
-    """Инициализация базы данных из SQL файла схемы
-    
     Args:
-        db_path (str): Путь к файлу базы данных SQLite.
-        schema_file (str): Путь к SQL файлу со схемой базы данных.
+        day: дата (по умолчанию сегодня по UTC, как DATE('now'))
+
+    Returns:
+        tuple: (начало, конец) в формате 'YYYY-MM-DD'
+    """
+    day = _to_date(day) if day is not None else datetime.now(timezone.utc).date()
+    return day.isoformat(), (day + timedelta(days=1)).isoformat()
+
+
+def default_db_path():
+    """Путь к базе по умолчанию: переменная окружения SQLITE_LIB_DB_PATH или DEFAULT_DB_PATH"""
+    return os.environ.get(DB_PATH_ENV) or DEFAULT_DB_PATH
+
+
+def init_from_file(db_path=None, schema_file=None, profile=None):
+    """Инициализация базы данных по встроенной схеме или из SQL файла схемы
+
+    Args:
+        db_path (str): Путь к файлу базы данных SQLite (по умолчанию
+            default_db_path()).
+        schema_file (str): Путь к SQL файлу со схемой базы данных; по
+            умолчанию используется встроенная схема (см. schema.MIGRATIONS).
+            Таблицы из файла дополняются недостающими миграциями.
+        profile: профиль соединения (имя из CONNECTION_PROFILES или словарь
+            PRAGMA). journal_mode=WAL сохраняется в файле базы.
     """
     
+    if db_path is None:
+        db_path = default_db_path()
     conn = sqlite3.connect(db_path)
-    with open(schema_file, 'r', encoding='utf-8') as f:
-        conn.executescript(f.read())
-    conn.commit()
+    # До таблиц из schema_file, пока база пустая
+    schema.enable_auto_vacuum(conn)
+    _apply_profile(conn, profile)
+    if schema_file is not None:
+        with open(schema_file, 'r', encoding='utf-8') as f:
+            conn.executescript(f.read())
+        conn.commit()
+    schema.migrate(conn)
     conn.close()
-    print(f"✅ База данных создана из {schema_file}")
+    print(f"✅ База данных создана из {schema_file or 'встроенной схемы'} "
+          f"(версия схемы {schema.SCHEMA_VERSION})")
+
+
+class _WriteBatch:
+    """Состояние открытого DataAggregator.batch(): счетчики для авто-сброса"""
+
+    def __init__(self, flush_rows=None, flush_interval=None):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.reset()
+
+    def reset(self):
+        self.rows = 0
+        self.started = time.monotonic()
+
+    def is_due(self):
+        if self.flush_rows is not None and self.rows >= self.flush_rows:
+            return True
+        if self.flush_interval is not None:
+            return time.monotonic() - self.started >= self.flush_interval
+        return False
 
 
 class DataAggregator:
-    def __init__(self, db_path='/Users/aleksejrusakov/Python/sql-lite-lib/marketing_digest.db'):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row
-        
+    def __init__(self, db_path=None,
+                 profile=None, pool_size=0, pool_timeout=30.0,
+                 write_behind=False, flush_rows=500, flush_interval=1.0, queue_size=10000,
+                 project_cache_ttl=60.0, project_cache_size=1024,
+                 partitioned=False, partition_dir=None, partition_mmap_size=268435456,
+                 metrics=None, auto_migrate=True, readonly=False, immutable=False, lazy=False):
+        """
+        Args:
+            db_path: путь к файлу базы данных; по умолчанию — из переменной
+                окружения SQLITE_LIB_DB_PATH, иначе marketing_digest.db в
+                текущем каталоге (см. default_db_path)
+            profile: профиль соединения — имя из CONNECTION_PROFILES
+                ('safe', 'bulk-ingest', 'read-heavy') или словарь PRAGMA,
+                например {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}.
+                По умолчанию настройки SQLite не меняются.
+            pool_size: если больше 0, включается режим пула для работы из
+                нескольких потоков: одно соединение на запись (доступ
+                сериализуется блокировкой) и до pool_size соединений на
+                чтение. Читатели не ждут писателя только в journal_mode=WAL,
+                поэтому пул стоит использовать с профилем WAL.
+            pool_timeout: сколько секунд ждать свободное соединение на чтение
+            write_behind: если True, save_vk_balance и save_yandex_balance
+                не пишут в базу сразу, а ставят строку в очередь; фоновый
+                поток записывает очередь пачками через executemany в одной
+                транзакции. Время fetched_at фиксируется в момент вызова.
+                Очередь гарантированно записывается в flush() и close().
+                Строка без кабинета отвергается сразу в save_*; строки,
+                которые база не приняла при записи пачки, откладываются
+                (см. get_rejected_rows), а остальные строки пачки пишутся.
+                Внутри batch() очередь не используется: строка пишется
+                сразу в транзакцию блока.
+            flush_rows: сбрасывать очередь, когда в ней столько строк
+            flush_interval: сбрасывать очередь не реже, чем раз в столько секунд
+            queue_size: максимальный размер очереди; при заполнении вызовы
+                save_* ждут, пока фоновый поток ее разгрузит
+            project_cache_ttl: сколько секунд кэшировать ответы
+                get_project_by_*; 0 или None отключает кэш. Кэш сбрасывается
+                методами, меняющими проекты; изменения из других процессов
+                становятся видны через TTL.
+            project_cache_size: максимальное число записей в кэше проектов
+            partitioned: если True, сырые строки (vk_balances,
+                yandex_balances, mt_stats) пишутся в помесячные файлы
+                <имя базы>_YYYY_MM.db, которые подключаются через ATTACH по
+                мере надобности; проекты, агрегаты и снимки остаются в
+                основной базе. Запросы по периоду читают только партиции
+                своих месяцев. Строки, записанные до включения режима,
+                переносятся методом move_rows_to_partitions().
+            partition_dir: каталог партиций (по умолчанию каталог базы)
+            partition_mmap_size: mmap_size для закрытых месяцев, которые
+                соединения пула подключают только на чтение
+            metrics: True или экземпляр QueryMetrics — считать вызовы,
+                время, строки публичных методов и SQL-запросов, время
+                коммитов и вести журнал медленных запросов (см.
+                get_metrics). По умолчанию выключено и ничего не стоит.
+            auto_migrate: применить недостающие миграции схемы при открытии
+                (см. schema.MIGRATIONS). Если False, устаревшая схема — ошибка:
+                миграции тогда запускаются отдельно через migrate_schema().
+            readonly: открыть базу только на чтение (file:...?mode=ro):
+                файл не создается, миграции не применяются, любая запись
+                падает с sqlite3.OperationalError. journal_mode из профиля
+                не применяется — его может сменить только соединение на
+                запись. Для mmap при чтении подойдет profile='read-heavy'.
+            immutable: только с readonly=True — файл считается неизменяемым
+                (immutable=1): SQLite не берет блокировки и не проверяет
+                изменения. Только для снимков, которые никто не пишет, —
+                копий из backup() и выгруженных файлов; у живой базы в WAL
+                так не видны строки, еще не перенесенные из -wal.
+            lazy: открыть соединение (и проверить или применить миграции)
+                при первом обращении к базе, а не в конструкторе. Такое
+                соединение не привязано к потоку (его можно открыть в одном
+                потоке и закрыть в другом), но одновременная работа из
+                нескольких потоков по-прежнему требует pool_size.
+        """
+        if db_path is None:
+            db_path = default_db_path()
+        if immutable and not readonly:
+            raise ValueError("immutable=True допускается только вместе с readonly=True")
+        self.db_path = db_path
+        self.profile = profile
+        self.readonly = readonly
+        self.immutable = immutable
+        self._auto_migrate = auto_migrate
+        self._check_same_thread = not (pool_size or write_behind or lazy)
+        self._conn = None
+        self._write_lock = threading.RLock()
+        self._batch = None
+        self._batch_thread = None
+        self._pool = None
+        self._keyed_sources = set()
+        self._metrics = QueryMetrics() if metrics is True else (metrics or None)
+
+        if pool_size and db_path == ':memory:':
+            raise ValueError("Режим пула не поддерживается для базы ':memory:'")
+        if partitioned and db_path == ':memory:':
+            raise ValueError("Режим партиций не поддерживается для базы ':memory:'")
+        if readonly and db_path == ':memory:':
+            raise ValueError("Режим только для чтения не поддерживается для базы ':memory:'")
+        self._partitions = (
+            partitions.PartitionStore(db_path, partition_dir, partition_mmap_size)
+            if partitioned else None
+        )
+
+        if self._metrics is not None:
+            self._instrument_methods()
+        if not lazy:
+            self._open()
+        if pool_size:
+            self._pool = ConnectionPool(
+                lambda: self._connect(check_same_thread=False), pool_size, pool_timeout
+            )
+        self._projects_changed = False
+        self._project_cache = (
+            ProjectCache(project_cache_ttl, project_cache_size) if project_cache_ttl else None
+        )
+        self._write_behind = None
+        if write_behind:
+            self._write_behind = WriteBehindQueue(
+                self._write_buffered_rows, flush_rows, flush_interval, queue_size,
+                validate=self._validate_buffered_row,
+            )
+
+    @property
+    def conn(self):
+        """Основное соединение (на запись); при lazy=True открывается здесь"""
+        if self._conn is None:
+            self._open()
+        return self._conn
+
+    def _open(self):
+        """Открыть основное соединение и проверить или применить миграции"""
+        with self._write_lock:
+            if self._conn is not None:
+                return
+            conn = self._connect(check_same_thread=self._check_same_thread)
+            if self._auto_migrate and not self.readonly:
+                schema.migrate(conn)
+            elif schema.schema_version(conn) < schema.SCHEMA_VERSION:
+                version = schema.schema_version(conn)
+                conn.close()
+                raise RuntimeError(
+                    f"Схема базы версии {version} устарела (нужна {schema.SCHEMA_VERSION}); "
+                    f"выполните migrate_schema() или откройте на запись с auto_migrate=True"
+                )
+            self._conn = conn
+
+    def _connect(self, check_same_thread=True):
+        # uri=True нужен, чтобы подключать закрытые партиции как file:...?mode=ro
+        connect = sqlite3.connect if self._metrics is None else self._metrics.connect
+        if self.readonly:
+            params = {'mode': 'ro', 'immutable': 1} if self.immutable else {'mode': 'ro'}
+            conn = connect(_file_uri(self.db_path, **params),
+                           check_same_thread=check_same_thread, uri=True)
+        else:
+            conn = connect(self.db_path, check_same_thread=check_same_thread,
+                           uri=self._partitions is not None)
+        conn.row_factory = sqlite3.Row
+        profile = self.profile
+        if self.readonly:
+            profile = {name: value for name, value in _resolve_profile(profile).items()
+                       if name != 'journal_mode'}
+        _apply_profile(conn, profile)
+        return conn
+
+    def _instrument_methods(self):
+        """Обернуть публичные методы экземпляра замером QueryMetrics"""
+        for name, function in vars(DataAggregator).items():
+            if name.startswith('_') or name in _UNINSTRUMENTED_METHODS or not callable(function):
+                continue
+            setattr(self, name, self._metrics.wrap(name, getattr(self, name)))
+
+    @contextmanager
+    def _writer(self):
+        """Соединение на запись; доступ из разных потоков сериализуется"""
+        with self._write_lock:
+            yield self.conn
+
+    @contextmanager
+    def _reader(self):
+        """Соединение на чтение: из пула или основное
+
+        Поток, открывший batch(), читает через соединение на запись, чтобы
+        видеть свои незакоммиченные изменения.
+        """
+        if self._pool is None or self._batch_thread == threading.get_ident():
+            yield self.conn
+            return
+        if self._conn is None:
+            self._open()  # миграции — до первого чтения через пул
+        with self._pool.connection() as conn:
+            yield conn
+
+    def _commit(self, rows=1):
+        """Зафиксировать запись или отложить ее до конца batch()
+
+        Вызывается внутри _writer().
+
+        Args:
+            rows: сколько строк записала операция (для авто-сброса по flush_rows)
+        """
+        if self._batch is None:
+            self._commit_now()
+            return
+        self._batch.rows += rows
+        if self._batch.is_due():
+            self._commit_now()
+            self._batch.reset()
+
+    def _commit_now(self):
+        """Закоммитить транзакцию и сбросить кэш проектов, если они менялись
+
+        Кэш сбрасывается после коммита, иначе читатель из пула успел бы
+        закэшировать еще не закоммиченное старое состояние.
+        """
+        self.conn.commit()
+        if self._projects_changed:
+            self._projects_changed = False
+            self._invalidate_project_cache()
+
+    @contextmanager
+    def batch(self, flush_rows=None, flush_interval=None):
+        """Выполнить все записи внутри блока одной транзакцией
+
+        Методы save_*, add_project и другие не коммитят каждую строку, а
+        копят изменения; коммит выполняется при выходе из блока, при
+        исключении изменения откатываются. Вложенные batch() присоединяются
+        к внешнему. В режиме пула другие потоки ждут конца блока, чтобы
+        записать свои данные.
+
+        Пример:
+            with aggregator.batch(flush_rows=5000):
+                for cabinet_id, balance in balances:
+                    aggregator.save_vk_balance(cabinet_id, balance)
+
+        Args:
+            flush_rows: коммитить промежуточно каждые N записанных строк
+            flush_interval: коммитить промежуточно, если с прошлого коммита
+                прошло больше T секунд (проверяется при очередной записи)
+
+        Откат при исключении затрагивает только строки после последнего
+        промежуточного коммита.
+        """
+        with self._writer():
+            if self._batch is not None:
+                yield self
+                return
+
+            self._batch = _WriteBatch(flush_rows, flush_interval)
+            self._batch_thread = threading.get_ident()
+            try:
+                yield self
+            except BaseException:
+                self.conn.rollback()
+                # В кэш могли попасть проекты из откаченной транзакции
+                self._projects_changed = False
+                self._invalidate_project_cache()
+                raise
+            else:
+                self._commit_now()
+            finally:
+                self._batch = None
+                self._batch_thread = None
+
+    def _invalidate_project_cache(self):
+        if self._project_cache is not None:
+            self._project_cache.invalidate()
+
+    def get_cache_stats(self):
+        """Получить счетчики кэша проектов
+
+        Returns:
+            dict: hits, misses, evictions, size; None, если кэш отключен
+        """
+        if self._project_cache is None:
+            return None
+        return self._project_cache.stats()
+
+    def get_metrics(self):
+        """Получить метрики методов и запросов (см. QueryMetrics.to_dict)
+
+        Returns:
+            dict или None, если метрики выключены
+        """
+        if self._metrics is None:
+            return None
+        return self._metrics.to_dict()
+
+    def get_metrics_prometheus(self):
+        """Получить метрики в текстовом формате Prometheus
+
+        Returns:
+            str или None, если метрики выключены
+        """
+        if self._metrics is None:
+            return None
+        return self._metrics.to_prometheus()
+
+    def flush(self):
+        """Записать очередь write_behind и закоммитить накопленные в batch() изменения"""
+        if self._write_behind is not None:
+            self._write_behind.flush()
+        with self._writer():
+            self._commit_now()
+            if self._batch is not None:
+                self._batch.reset()
+
+    def _buffer_row(self, item):
+        """Поставить строку в очередь write_behind
+
+        Внутри batch() строка не ставится в очередь: поток держит блокировку
+        записи до конца блока, и фоновый сброс не смог бы разгрузить
+        заполненную очередь — put() ждал бы его вечно. Строки, поставленные
+        в очередь до batch(), записываются после его коммита.
+
+        Returns:
+            bool: строка принята очередью; False — ее нужно записать сразу
+        """
+        if self._write_behind is None or self._batch_thread == threading.get_ident():
+            return False
+        self._write_behind.put(item)
+        return True
+
+    @staticmethod
+    def _validate_buffered_row(item):
+        """Проверить строку до постановки в очередь write_behind
+
+        Raises:
+            ValueError: если строку заведомо нельзя записать (NOT NULL)
+        """
+        table, cabinet_id, _, fetched_at = item
+        if cabinet_id is None or fetched_at is None:
+            raise ValueError(f"Для {table} нужны ID кабинета и fetched_at")
+
+    def _write_buffered_rows(self, items):
+        """Записать строки из очереди write_behind одной транзакцией
+
+        Если пачку не приняла база (нарушение ограничения и т.п.), ее
+        изменения откатываются, и строки пишутся по одной: отвергнутые
+        возвращаются, остальные записываются. Ошибки SQLite, которые могут
+        пройти сами (sqlite3.OperationalError: блокировка, нет места),
+        пробрасываются: очередь повторит пачку.
+
+        Args:
+            items: список (таблица, кабинет, баланс, fetched_at)
+
+        Returns:
+            list: отвергнутые пары (элемент, ошибка)
+        """
+        with self._writer():
+            try:
+                with self._savepoint('write_behind'):
+                    self._insert_buffered_rows(items)
+                rejected = []
+            except sqlite3.OperationalError:
+                raise
+            except sqlite3.DatabaseError:
+                rejected = []
+                with self._savepoint('write_behind'):
+                    for item in items:
+                        try:
+                            with self._savepoint('write_behind_row'):
+                                self._insert_buffered_rows([item])
+                        except sqlite3.OperationalError:
+                            raise
+                        except sqlite3.DatabaseError as exc:
+                            rejected.append((item, exc))
+            self._commit(len(items) - len(rejected))
+            return rejected
+
+    def _insert_buffered_rows(self, items):
+        rows = {'vk_balances': [], 'yandex_balances': []}
+        for table, cabinet_id, balance, fetched_at in items:
+            rows[table].append((cabinet_id, balance, fetched_at))
+        for table, table_rows in rows.items():
+            if table_rows:
+                self._insert_raw_rows(table, table_rows)
+
+    @contextmanager
+    def _savepoint(self, name):
+        """Вложенная транзакция внутри _writer(): при исключении откатывается только она
+
+        Если транзакцию начал сам блок (вне batch()), при исключении она
+        откатывается целиком, чтобы не держать блокировку записи.
+        """
+        conn = self.conn
+        began = not conn.in_transaction
+        if began:
+            conn.execute('BEGIN')
+        conn.execute(f'SAVEPOINT {name}')
+        try:
+            yield conn
+        except BaseException:
+            if began:
+                conn.rollback()
+            else:
+                conn.execute(f'ROLLBACK TO {name}')
+                conn.execute(f'RELEASE {name}')
+            raise
+        conn.execute(f'RELEASE {name}')
+
+    def get_rejected_rows(self):
+        """Получить строки write_behind, которые база отвергла при записи
+
+        Такие строки не повторяются и не мешают записи остальных.
+
+        Returns:
+            list: пары ((таблица, кабинет, баланс, fetched_at), ошибка);
+                пустой список, если write_behind выключен
+        """
+        if self._write_behind is None:
+            return []
+        return list(self._write_behind.rejected)
+
+    def _insert_raw_rows(self, table, rows):
+        """Записать сырые строки по натуральному ключу и обновить агрегаты и снимки
+
+        Вызывается внутри _writer(). Строка заменяет сохраненную строку того
+        же кабинета и fetched_at (см. natural_keys), так что повторная запись
+        той же пачки ничего не удваивает. Новые строки учитываются в
+        агрегатах инкрементально, дни с замененными строками пересчитываются
+        из сырых строк.
+
+        Args:
+            rows: кортежи (кабинет, баланс, fetched_at) для балансов или
+                (проект, регистрации, первые входы, реактивации, fetched_at)
+                для mt_stats
+        """
+        rows = natural_keys.latest_per_key(rows)
+        replaced = []
+        for month, month_rows in self._rows_by_month(rows, -1).items():
+            source = self._raw_writer_source(table, month, create=True)
+            existing = natural_keys.existing_keys(self.conn, table, source, month_rows)
+            self.conn.executemany(
+                natural_keys.upsert_sql(table, source, self._keyed(source)), month_rows
+            )
+            fresh = [row for row in month_rows if natural_keys.row_key(row) not in existing]
+            if table == 'mt_stats':
+                rollups.apply_mt_rows(self.conn, fresh)
+            else:
+                rollups.apply_balance_rows(self.conn, table, fresh)
+            if existing:
+                replaced.append((existing, source.split('.')[0] if '.' in source else None))
+        # Пересчет после инкрементального учета: он перезаписывает весь день
+        # кабинета, включая новые строки этого дня
+        for existing, schema in replaced:
+            natural_keys.refresh_days(self.conn, table, existing, schema)
+        snapshots.apply_rows(self.conn, table, rows)
+
+    def _keyed(self, source):
+        """Есть ли у сырой таблицы source уникальный индекс натурального ключа
+
+        Вызывается внутри _writer(). Запоминается только наличие индекса:
+        таблица с дубликатами проверяется при каждой записи, чтобы после
+        deduplicate_raw_rows (в том числе из другого процесса) строки сразу
+        пошли через upsert.
+        """
+        if source in self._keyed_sources:
+            return True
+        schema_name, _, table = source.rpartition('.')
+        if natural_keys.has_unique_index(self.conn, table, schema_name or 'main'):
+            self._keyed_sources.add(source)
+            return True
+        return False
+
     def add_project(self, name, vk_cabinet_id=None, 
                     yandex_cabinet_id=None, mytracker_project_id=None):
         """Добавить новый проект"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO projects (name, vk_cabinet_id, yandex_cabinet_id, mytracker_project_id)
-            VALUES (?, ?, ?, ?)
-        ''', (name, vk_cabinet_id, yandex_cabinet_id, mytracker_project_id))
-        self.conn.commit()
-        return cursor.lastrowid
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO projects (name, vk_cabinet_id, yandex_cabinet_id, mytracker_project_id)
+                VALUES (?, ?, ?, ?)
+            ''', (name, vk_cabinet_id, yandex_cabinet_id, mytracker_project_id))
+            self._projects_changed = True
+            self._commit()
+            return cursor.lastrowid
     
     def get_list_of_projects(self):
         """Получить список всех проектов"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
+        return list(self.iter_list_of_projects())
+
+    def iter_list_of_projects(self, chunk_size=1000, row_type='dict'):
+        """Потоковый вариант get_list_of_projects (см. _stream)"""
+        return self._stream('''
                        SELECT 
                             p.id, 
                             p.name, 
@@ -45,55 +741,213 @@ class DataAggregator:
                             p.mytracker_project_id,
                             p.is_active 
                        FROM projects p
-                       ''')
-        return [dict(row) for row in cursor.fetchall()]
-
-    def save_vk_balance(self, vk_cabinet_id, balance):
-        """Сохранить баланс VK для кабинета"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO vk_balances (vk_cabinet_id, balance)
-            VALUES (?, ?)
-        ''', (vk_cabinet_id, balance))
-        self.conn.commit()
+                       ''', (), chunk_size, row_type)
+
+    def _stream(self, sql, params, chunk_size=1000, row_type='dict', raw=None):
+        """Выполнить запрос и отдавать строки порциями через fetchmany
+
+        В памяти одновременно держится не больше chunk_size строк. В режиме
+        пула соединение занято, пока итератор не исчерпан или не закрыт.
+
+        Args:
+            chunk_size: сколько строк читать из SQLite за раз
+            row_type: формат строк — 'dict', 'tuple' (быстрее всего и
+                компактнее всего), 'namedtuple' или 'row' (sqlite3.Row)
+            raw: (сырая таблица, date_from, date_to), если запрос читает
+                сырую таблицу: вместо ее имени в sql стоит {source}. В режиме
+                партиций запрос выполняется по очереди в партиции каждого
+                месяца периода.
+        """
+        if row_type not in ROW_TYPES:
+            raise ValueError(f"row_type должен быть одним из: {', '.join(ROW_TYPES)}")
+        return self._iter_rows(sql, params, chunk_size, row_type, raw)
+
+    def _iter_rows(self, sql, params, chunk_size, row_type, raw):
+        if raw is None:
+            with self._reader() as conn:
+                yield from self._fetch_rows(conn, sql, params, chunk_size, row_type)
+            return
+
+        table, date_from, date_to = raw
+        for month in self._raw_months(date_from, date_to):
+            with self._raw_reader(table, month) as (conn, source):
+                if source is not None:
+                    yield from self._fetch_rows(
+                        conn, sql.format(source=source), params, chunk_size, row_type
+                    )
+
+    @staticmethod
+    def _fetch_rows(conn, sql, params, chunk_size, row_type):
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row if row_type == 'row' else None
+        cursor.execute(sql, params)
+        convert = _row_converter(row_type, cursor.description)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if convert is None:
+                    yield from rows
+                else:
+                    for row in rows:
+                        yield convert(row)
+        finally:
+            cursor.close()
+
+    def _raw_months(self, date_from=None, date_to=None):
+        """Месяцы партиций, которые покрывают период; [None] без партиций"""
+        if self._partitions is None:
+            return [None]
+        return self._partitions.months_for_range(date_from, date_to)
+
+    @contextmanager
+    def _raw_reader(self, table, month):
+        """Соединение на чтение и имя сырой таблицы в партиции month
+
+        Без партиций — обычный _reader() и само имя таблицы. Если партиции
+        месяца нет, вместо имени отдается None.
+        """
+        if self._partitions is None:
+            with self._reader() as conn:
+                yield conn, table
+            return
+        with self._partition_reader(month) as (conn, schema):
+            yield conn, (f'{schema}.{table}' if schema else None)
+
+    @contextmanager
+    def _partition_reader(self, month):
+        """Соединение на чтение с подключенной партицией месяца
+
+        К соединению пула партиция подключается на время блока (закрытые
+        месяцы — только на чтение, с mmap). Соединение на запись держит
+        партиции подключенными на запись.
+
+        Yields:
+            (соединение, имя схемы партиции или None, если партиции нет)
+        """
+        with self._reader() as conn:
+            pooled = conn is not self.conn
+            schema = self._partitions.attach(conn, month, readonly=pooled)
+            try:
+                yield conn, schema
+            finally:
+                if schema and pooled:
+                    self._partitions.detach(conn, schema)
+
+    def _raw_writer_source(self, table, month, create=False):
+        """Имя сырой таблицы для записи через соединение на запись
+
+        Вызывается внутри _writer(). В режиме партиций подключает партицию
+        месяца (create=True — создает ее при необходимости).
+
+        Returns:
+            str: 'vk_balances' или 'p_2024_05.vk_balances'; None, если
+                партиции нет и create=False
+        """
+        if self._partitions is None:
+            return table
+        schema = self._partitions.attach(self.conn, month, create=create)
+        return f'{schema}.{table}' if schema else None
+
+    def _rows_by_month(self, rows, fetched_at_index):
+        """Разложить строки по месяцам fetched_at ({None: rows} без партиций)"""
+        if self._partitions is None:
+            return {None: rows}
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(partitions.month_of(row[fetched_at_index]), []).append(row)
+        return grouped
+
+    def save_vk_balance(self, vk_cabinet_id, balance, fetched_at=None):
+        """Сохранить баланс VK для кабинета
+
+        Args:
+            fetched_at: время замера (по умолчанию текущее, UTC). Повторная
+                запись кабинета с тем же fetched_at заменяет строку.
+        """
+        if fetched_at is None:
+            fetched_at = _utc_timestamp()
+        if self._buffer_row(('vk_balances', vk_cabinet_id, balance, fetched_at)):
+            return
+        with self._writer():
+            self._insert_raw_rows('vk_balances', [(vk_cabinet_id, balance, fetched_at)])
+            self._commit()
     
-    def save_yandex_balance(self, yandex_cabinet_id, balance):
-        """Сохранить баланс Yandex для кабинета"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO yandex_balances (yandex_cabinet_id, balance)
-            VALUES (?, ?)
-        ''', (yandex_cabinet_id, balance))
-        self.conn.commit()
+    def save_yandex_balance(self, yandex_cabinet_id, balance, fetched_at=None):
+        """Сохранить баланс Yandex для кабинета
+
+        Args:
+            fetched_at: время замера (по умолчанию текущее, UTC). Повторная
+                запись кабинета с тем же fetched_at заменяет строку.
+        """
+        if fetched_at is None:
+            fetched_at = _utc_timestamp()
+        if self._buffer_row(('yandex_balances', yandex_cabinet_id, balance, fetched_at)):
+            return
+        with self._writer():
+            self._insert_raw_rows('yandex_balances', [(yandex_cabinet_id, balance, fetched_at)])
+            self._commit()
 
-    def save_yandex_balances_bulk(self, balances):
+    def save_yandex_balances_bulk(self, balances, fetched_at=None):
         """Сохранить балансы Yandex для нескольких кабинетов одним запросом.
 
         Args:
             balances: список словарей в формате
                 [{'login': 'cabinet_id', 'amount': 123.45}, ...]
+            fetched_at: общее время замера (по умолчанию текущее, UTC)
 
         Returns:
-            int: количество успешно добавленных записей.
+            int: количество успешно добавленных записей. Повторная запись
+                кабинета с тем же fetched_at заменяет его строку.
         """
+        if fetched_at is None:
+            fetched_at = _utc_timestamp()
         rows_to_insert = []
         for item in balances:
             login = item.get('login')
             amount = item.get('amount')
             if not login or amount is None:
                 continue
-            rows_to_insert.append((login, amount))
+            rows_to_insert.append((login, amount, fetched_at))
 
         if not rows_to_insert:
             return 0
 
-        cursor = self.conn.cursor()
-        cursor.executemany('''
-            INSERT INTO yandex_balances (yandex_cabinet_id, balance)
-            VALUES (?, ?)
-        ''', rows_to_insert)
-        self.conn.commit()
-        return len(rows_to_insert)
+        with self._writer():
+            self._insert_raw_rows('yandex_balances', rows_to_insert)
+            self._commit(len(rows_to_insert))
+            return len(rows_to_insert)
+
+    def save_vk_balances_bulk(self, balances, fetched_at=None):
+        """Сохранить балансы VK для нескольких кабинетов одним запросом.
+
+        Args:
+            balances: список словарей в формате
+                [{'vk_cabinet_id': 'cabinet_id', 'balance': 123.45}, ...]
+            fetched_at: общее время замера (по умолчанию текущее, UTC)
+
+        Returns:
+            int: количество успешно добавленных записей. Повторная запись
+                кабинета с тем же fetched_at заменяет его строку.
+        """
+        if fetched_at is None:
+            fetched_at = _utc_timestamp()
+        rows_to_insert = []
+        for item in balances:
+            cabinet_id = item.get('vk_cabinet_id')
+            balance = item.get('balance')
+            if not cabinet_id or balance is None:
+                continue
+            rows_to_insert.append((cabinet_id, balance, fetched_at))
+
+        if not rows_to_insert:
+            return 0
+
+        with self._writer():
+            self._insert_raw_rows('vk_balances', rows_to_insert)
+            self._commit(len(rows_to_insert))
+            return len(rows_to_insert)
     
     def save_mt_stats(self, mytracker_project_id, registrations=0, first_logins=0, 
                      reactivations=0, fetched_at=None):
@@ -106,18 +960,14 @@ class DataAggregator:
             reactivations: количество реактиваций
             fetched_at: дата/время записи (опционально)
         """
-        cursor = self.conn.cursor()
         if fetched_at is None:
-            cursor.execute('''
-                INSERT INTO mt_stats (mytracker_project_id, registrations, first_logins, reactivations)
-                VALUES (?, ?, ?, ?)
-            ''', (mytracker_project_id, registrations, first_logins, reactivations))
-        else:
-            cursor.execute('''
-                INSERT INTO mt_stats (mytracker_project_id, registrations, first_logins, reactivations, fetched_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (mytracker_project_id, registrations, first_logins, reactivations, fetched_at))
-        self.conn.commit()
+            fetched_at = _utc_timestamp()
+        with self._writer():
+            self._insert_raw_rows('mt_stats', [(
+                mytracker_project_id, int(registrations or 0), int(first_logins or 0),
+                int(reactivations or 0), fetched_at,
+            )])
+            self._commit()
 
     def save_mt_stats_bulk(self, stats, fetched_at=None, replace_for_date=False):
         """Сохранить статистику MyTracker для нескольких проектов.
@@ -131,7 +981,9 @@ class DataAggregator:
                 удаляются записи за эту дату по указанным проектам.
 
         Returns:
-            int: количество добавленных записей.
+            int: количество добавленных записей. Повторная запись проекта
+                с тем же fetched_at заменяет его строку; replace_for_date
+                заменяет все строки проекта за сутки.
         """
         rows_to_insert = []
         for item in stats:
@@ -148,64 +1000,87 @@ class DataAggregator:
         if not rows_to_insert:
             return 0
 
-        cursor = self.conn.cursor()
-
-        if replace_for_date and fetched_at is not None:
-            ids = sorted(set(row[0] for row in rows_to_insert))
-            placeholders = ",".join(["?"] * len(ids))
-            cursor.execute(
-                f'''
-                DELETE FROM mt_stats
-                WHERE DATE(fetched_at) = DATE(?)
-                  AND mytracker_project_id IN ({placeholders})
-                ''',
-                [fetched_at, *ids],
-            )
+        replace_for_date = replace_for_date and fetched_at is not None
+        with self._writer() as conn:
+            cursor = conn.cursor()
 
-        if fetched_at is None:
-            cursor.executemany('''
-                INSERT INTO mt_stats (mytracker_project_id, registrations, first_logins, reactivations)
-                VALUES (?, ?, ?, ?)
-            ''', rows_to_insert)
-        else:
-            rows_with_date = [(*row, fetched_at) for row in rows_to_insert]
-            cursor.executemany('''
-                INSERT INTO mt_stats (mytracker_project_id, registrations, first_logins, reactivations, fetched_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', rows_with_date)
+            if replace_for_date:
+                ids = sorted(set(row[0] for row in rows_to_insert))
+                placeholders = ",".join(["?"] * len(ids))
+                day_from, day_to = _day_range(fetched_at)
+                source = self._raw_writer_source('mt_stats', partitions.month_of(day_from))
+                if source is not None:
+                    cursor.execute(
+                        f'''
+                        DELETE FROM {source}
+                        WHERE fetched_at >= ? AND fetched_at < ?
+                          AND mytracker_project_id IN ({placeholders})
+                        ''',
+                        [day_from, day_to, *ids],
+                    )
+                cursor.execute(
+                    f'''
+                    DELETE FROM mt_stats_daily
+                    WHERE day = ? AND mytracker_project_id IN ({placeholders})
+                    ''',
+                    [day_from, *ids],
+                )
 
-        self.conn.commit()
-        return len(rows_to_insert)
+            if fetched_at is None:
+                fetched_at = _utc_timestamp()
+            self._insert_raw_rows('mt_stats', [(*row, fetched_at) for row in rows_to_insert])
+            if replace_for_date:
+                # Удаленные строки могли быть последними по проекту. Проекты
+                # только что получили строки за этот день, поэтому более
+                # ранние партиции на снимок уже не влияют
+                schemas = [None]
+                if self._partitions is not None:
+                    schemas = [
+                        self._raw_writer_source('mt_stats', month).split('.')[0]
+                        for month in self._partitions.months_for_range(day_from)
+                    ]
+                snapshots.refresh_snapshots(conn, 'mt_stats', ids, schemas)
+
+            self._commit(len(rows_to_insert))
+            return len(rows_to_insert)
     
     def get_project_by_vk_cabinet(self, vk_cabinet_id):
         """Найти проект по VK кабинету"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM projects 
-            WHERE vk_cabinet_id = ? AND is_active = 1
-        ''', (vk_cabinet_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return self._get_active_project('vk_cabinet_id', vk_cabinet_id)
     
     def get_project_by_yandex_cabinet(self, yandex_cabinet_id):
         """Найти проект по Yandex кабинету"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM projects 
-            WHERE yandex_cabinet_id = ? AND is_active = 1
-        ''', (yandex_cabinet_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return self._get_active_project('yandex_cabinet_id', yandex_cabinet_id)
     
     def get_project_by_mytracker_id(self, mytracker_project_id):
         """Найти проект по MyTracker ID"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM projects 
-            WHERE mytracker_project_id = ? AND is_active = 1
-        ''', (mytracker_project_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return self._get_active_project('mytracker_project_id', mytracker_project_id)
+
+    def _get_active_project(self, column, value):
+        """Найти активный проект по колонке кабинета, с учетом кэша проектов"""
+        cache = self._project_cache
+        if self._projects_changed and self._batch_thread == threading.get_ident():
+            # Поток batch() изменил проекты: кэш не знает о незакоммиченных
+            # изменениях, а их ответы нельзя класть в кэш до коммита
+            cache = None
+        if cache is not None:
+            project = cache.get(column, value)
+            if project is not ProjectCache.MISSING:
+                return project
+            generation = cache.generation
+
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT * FROM projects 
+                WHERE {column} = ? AND is_active = 1
+            ''', (value,))
+            row = cursor.fetchone()
+            project = dict(row) if row else None
+
+        if cache is not None:
+            cache.put(column, value, project, generation)
+        return project
     
     def get_all_vk_balances(self):
         """
@@ -213,23 +1088,20 @@ class DataAggregator:
         - Название проекта
         - Баланс
         """
-        cursor = self.conn.cursor()
-        cursor.execute('''
+        return list(self.iter_all_vk_balances())
+
+    def iter_all_vk_balances(self, chunk_size=1000, row_type='dict'):
+        """Потоковый вариант get_all_vk_balances (см. _stream)"""
+        today = _day_range()
+        return self._stream('''
             SELECT 
                 p.name as project_name,
                 vb.balance,
                 vb.fetched_at
-            FROM vk_balances vb
+            FROM {source} vb
             JOIN projects p ON vb.vk_cabinet_id = p.vk_cabinet_id
-            WHERE DATE(vb.fetched_at) = DATE('now')
-        ''')
-
-        # Получаем названия колонок
-        columns = [description[0] for description in cursor.description]
-
-        # Преобразуем каждую строку в словарь
-        results = cursor.fetchall()
-        return [dict(zip(columns, row)) for row in results]
+            WHERE vb.fetched_at >= ? AND vb.fetched_at < ?
+        ''', today, chunk_size, row_type, raw=('vk_balances', *today))
 
     def get_all_yandex_balances_today(self, latest_per_cabinet=True):
         """
@@ -239,68 +1111,176 @@ class DataAggregator:
             latest_per_cabinet: если True, возвращается только последний
                 баланс по каждому кабинету за сегодня.
         """
-        cursor = self.conn.cursor()
+        return list(self.iter_yandex_balances_today(latest_per_cabinet))
+
+    def iter_yandex_balances_today(self, latest_per_cabinet=True, chunk_size=1000, row_type='dict'):
+        """Потоковый вариант get_all_yandex_balances_today (см. _stream)"""
+        today = _day_range()
 
         if latest_per_cabinet:
-            cursor.execute('''
+            # Последний баланс кабинета за сегодня — это его снимок,
+            # если снимок сделан сегодня
+            return self._stream('''
                 SELECT
-                    yb.yandex_cabinet_id,
+                    yl.yandex_cabinet_id,
                     p.name AS project_name,
-                    yb.balance,
-                    yb.fetched_at
-                FROM yandex_balances yb
+                    yl.balance,
+                    yl.fetched_at
+                FROM yandex_balances_latest yl
                 LEFT JOIN projects p
-                    ON yb.yandex_cabinet_id = p.yandex_cabinet_id
-                INNER JOIN (
-                    SELECT
-                        yandex_cabinet_id,
-                        MAX(fetched_at) AS max_fetched_at
-                    FROM yandex_balances
-                    WHERE DATE(fetched_at) = DATE('now')
-                    GROUP BY yandex_cabinet_id
-                ) latest
-                    ON yb.yandex_cabinet_id = latest.yandex_cabinet_id
-                   AND yb.fetched_at = latest.max_fetched_at
-                ORDER BY yb.yandex_cabinet_id
-            ''')
-        else:
-            cursor.execute('''
-                SELECT
-                    yb.yandex_cabinet_id,
-                    p.name AS project_name,
-                    yb.balance,
-                    yb.fetched_at
-                FROM yandex_balances yb
-                LEFT JOIN projects p
-                    ON yb.yandex_cabinet_id = p.yandex_cabinet_id
-                WHERE DATE(yb.fetched_at) = DATE('now')
-                ORDER BY yb.yandex_cabinet_id, yb.fetched_at
-            ''')
+                    ON yl.yandex_cabinet_id = p.yandex_cabinet_id
+                WHERE yl.fetched_at >= ? AND yl.fetched_at < ?
+                ORDER BY yl.yandex_cabinet_id
+            ''', today, chunk_size, row_type)
+
+        return self._stream('''
+            SELECT
+                yb.yandex_cabinet_id,
+                p.name AS project_name,
+                yb.balance,
+                yb.fetched_at
+            FROM {source} yb
+            LEFT JOIN projects p
+                ON yb.yandex_cabinet_id = p.yandex_cabinet_id
+            WHERE yb.fetched_at >= ? AND yb.fetched_at < ?
+            -- унарный плюс: сортировка не должна склонять планировщик
+            -- к полному проходу по индексу (кабинет, fetched_at)
+            ORDER BY +yb.yandex_cabinet_id, yb.fetched_at
+        ''', today, chunk_size, row_type, raw=('yandex_balances', *today))
+
+    def iter_balance_history(self, table, cabinet_ids=None, date_from=None, date_to=None,
+                             chunk_size=5000, row_type='tuple'):
+        """Потоковая выгрузка истории сырых строк за период
+
+        Предназначена для экспорта больших объемов: строки читаются порциями
+        по chunk_size и по умолчанию отдаются кортежами.
+
+        Args:
+            table: 'vk_balances', 'yandex_balances' или 'mt_stats'
+            cabinet_ids: список ID кабинетов/проектов (по умолчанию все)
+            date_from: начало периода включительно ('YYYY-MM-DD[ HH:MM:SS]')
+            date_to: конец периода, не включается
+            chunk_size, row_type: см. _stream
+
+        Yields:
+            строки с колонками (ID кабинета, значения..., fetched_at)
+            в порядке fetched_at
+        """
+        key, columns = self._history_source(table)
+        where, params = self._history_filter(key, cabinet_ids, date_from, date_to)
+
+        return self._stream(f'''
+            SELECT {key}, {', '.join(columns)}, fetched_at
+            FROM {{source}}
+            WHERE {where}
+            ORDER BY fetched_at
+        ''', params, chunk_size, row_type, raw=(table, date_from, date_to))
+
+    def get_time_series(self, table, cabinet_ids=None, date_from=None, date_to=None,
+                        value=None, resample=None, how='mean', chunk_size=10000):
+        """Временные ряды нескольких кабинетов в колоночном виде
+
+        Колонки заполняются прямо из курсора порциями fetchmany, без
+        построения словаря на каждую строку. Если установлен numpy, это
+        массивы numpy, иначе array.array (см. timeseries.TimeSeries).
+        Строки с пустым значением пропускаются.
+
+        Args:
+            table: 'vk_balances', 'yandex_balances' или 'mt_stats'
+            cabinet_ids: список ID кабинетов/проектов (по умолчанию все)
+            date_from: начало периода включительно ('YYYY-MM-DD[ HH:MM:SS]')
+            date_to: конец периода, не включается
+            value: колонка значений (по умолчанию balance; для mt_stats —
+                registrations)
+            resample: None, 'hour' или 'day' — передискретизировать ряды
+            how: агрегат при передискретизации (см. TimeSeries.resample)
+
+        Returns:
+            timeseries.TimeSeries: строки отсортированы по кабинету и времени
+        """
+        from . import timeseries  # тянет numpy — только для аналитики, не при старте
+        key, columns = self._history_source(table)
+        if cabinet_ids is not None:
+            cabinet_ids = list(cabinet_ids)
+        value = value or columns[0]
+        if value not in columns:
+            raise ValueError(f"Колонка {value!r} отсутствует в {table}")
+        where, params = self._history_filter(key, cabinet_ids, date_from, date_to)
+
+        # В режиме партиций ряды читаются по месяцам и склеиваются
+        parts = []
+        cabinets = cabinet_ids
+        for month in self._raw_months(date_from, date_to):
+            with self._raw_reader(table, month) as (conn, source):
+                if source is None:
+                    continue
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                cursor.execute(f'''
+                    SELECT {key}, CAST(strftime('%s', fetched_at) AS INTEGER), {value}
+                    FROM {source}
+                    WHERE {where} AND {value} IS NOT NULL
+                    ORDER BY {key}, fetched_at
+                ''', params)
+                parts.append(timeseries.TimeSeries.from_cursor(cursor, chunk_size, cabinets))
+                cabinets = parts[-1].cabinets
+                cursor.close()
+        series = timeseries.TimeSeries.concat(parts)
+
+        if resample is not None:
+            series = series.resample(resample, how)
+        return series
 
-        return [dict(row) for row in cursor.fetchall()]
+    @staticmethod
+    def _history_source(table):
+        """Ключ и колонки значений сырой таблицы"""
+        if table not in snapshots.SNAPSHOTS:
+            raise ValueError(f"Неизвестная таблица: {table!r}")
+        key, columns, _ = snapshots.SNAPSHOTS[table]
+        return key, columns
+
+    @staticmethod
+    def _history_filter(key, cabinet_ids, date_from, date_to):
+        """Условие WHERE по кабинетам и периоду и его параметры"""
+        conditions, params = [], []
+        if cabinet_ids is not None:
+            cabinet_ids = list(cabinet_ids)
+            conditions.append(f'{key} IN ({", ".join("?" * len(cabinet_ids))})')
+            params.extend(cabinet_ids)
+        if date_from is not None:
+            conditions.append('fetched_at >= ?')
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append('fetched_at < ?')
+            params.append(date_to)
+        return ' AND '.join(conditions) or '1', params
 
     def get_latest_data_for_digest(self):
-        """Получить последние данные по всем активным проектам для дайджеста"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT 
-                p.name,
-                (SELECT balance FROM vk_balances 
-                 WHERE vk_cabinet_id = p.vk_cabinet_id 
-                 ORDER BY fetched_at DESC LIMIT 1) as vk_balance,
-                (SELECT balance FROM yandex_balances 
-                 WHERE yandex_cabinet_id = p.yandex_cabinet_id 
-                 ORDER BY fetched_at DESC LIMIT 1) as yandex_balance,
-                (SELECT installs FROM mt_stats 
-                 WHERE mytracker_project_id = p.mytracker_project_id 
-                 ORDER BY fetched_at DESC LIMIT 1) as mt_installs,
-                (SELECT cost FROM mt_stats 
-                 WHERE mytracker_project_id = p.mytracker_project_id 
-                 ORDER BY fetched_at DESC LIMIT 1) as mt_cost
-            FROM projects p
-            WHERE p.is_active = 1
-        ''')
-        return cursor.fetchall()
+        """Получить последние данные по всем активным проектам для дайджеста
+
+        Значения берутся из снимков последних строк (*_latest).
+
+        Returns:
+            list: строки с колонками name, vk_balance, yandex_balance,
+                mt_registrations, mt_first_logins, mt_reactivations
+        """
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    p.name,
+                    vl.balance as vk_balance,
+                    yl.balance as yandex_balance,
+                    ml.registrations as mt_registrations,
+                    ml.first_logins as mt_first_logins,
+                    ml.reactivations as mt_reactivations
+                FROM projects p
+                LEFT JOIN vk_balances_latest vl ON vl.vk_cabinet_id = p.vk_cabinet_id
+                LEFT JOIN yandex_balances_latest yl ON yl.yandex_cabinet_id = p.yandex_cabinet_id
+                LEFT JOIN mt_stats_latest ml ON ml.mytracker_project_id = p.mytracker_project_id
+                WHERE p.is_active = 1
+            ''')
+            return cursor.fetchall()
     
     def get_project_stats_for_period(self, vk_cabinet_id=None, yandex_cabinet_id=None, 
                                      mytracker_project_id=None, days=7):
@@ -310,54 +1290,56 @@ class DataAggregator:
             vk_cabinet_id: ID кабинета VK (опционально)
             yandex_cabinet_id: ID кабинета Yandex (опционально)
             mytracker_project_id: ID проекта MyTracker (опционально)
-            days: количество дней для статистики
+            days: количество дней для статистики; считаются целые сутки
+                (UTC), начиная с даты days дней назад
+
+        Данные читаются из суточных агрегатов (*_daily), а не из сырых таблиц.
         """
-        date_from = datetime.now() - timedelta(days=days)
+        date_from = _period_start(days)
         stats = {}
         
-        cursor = self.conn.cursor()
+        with self._reader() as conn:
+            cursor = conn.cursor()
         
-        # VK балансы
-        if vk_cabinet_id:
-            cursor.execute('''
-                SELECT 
-                    DATE(fetched_at) as date,
-                    AVG(balance) as avg_balance
-                FROM vk_balances
-                WHERE vk_cabinet_id = ? AND fetched_at >= ?
-                GROUP BY DATE(fetched_at)
-                ORDER BY date
-            ''', (vk_cabinet_id, date_from))
-            stats['vk_balances'] = cursor.fetchall()
+            # VK балансы
+            if vk_cabinet_id:
+                cursor.execute('''
+                    SELECT 
+                        day as date,
+                        balance_sum / balance_count as avg_balance
+                    FROM vk_balances_daily
+                    WHERE vk_cabinet_id = ? AND day >= ?
+                    ORDER BY day
+                ''', (vk_cabinet_id, date_from))
+                stats['vk_balances'] = cursor.fetchall()
         
-        # Yandex балансы
-        if yandex_cabinet_id:
-            cursor.execute('''
-                SELECT 
-                    DATE(fetched_at) as date,
-                    AVG(balance) as avg_balance
-                FROM yandex_balances
-                WHERE yandex_cabinet_id = ? AND fetched_at >= ?
-                GROUP BY DATE(fetched_at)
-                ORDER BY date
-            ''', (yandex_cabinet_id, date_from))
-            stats['yandex_balances'] = cursor.fetchall()
+            # Yandex балансы
+            if yandex_cabinet_id:
+                cursor.execute('''
+                    SELECT 
+                        day as date,
+                        balance_sum / balance_count as avg_balance
+                    FROM yandex_balances_daily
+                    WHERE yandex_cabinet_id = ? AND day >= ?
+                    ORDER BY day
+                ''', (yandex_cabinet_id, date_from))
+                stats['yandex_balances'] = cursor.fetchall()
         
-        # MyTracker статистика
-        if mytracker_project_id:
-            cursor.execute('''
-                SELECT 
-                    DATE(fetched_at) as date,
-                    SUM(installs) as total_installs,
-                    SUM(cost) as total_cost
-                FROM mt_stats
-                WHERE mytracker_project_id = ? AND fetched_at >= ?
-                GROUP BY DATE(fetched_at)
-                ORDER BY date
-            ''', (mytracker_project_id, date_from))
-            stats['mt_stats'] = cursor.fetchall()
+            # MyTracker статистика
+            if mytracker_project_id:
+                cursor.execute('''
+                    SELECT 
+                        day as date,
+                        registrations_sum as total_registrations,
+                        first_logins_sum as total_first_logins,
+                        reactivations_sum as total_reactivations
+                    FROM mt_stats_daily
+                    WHERE mytracker_project_id = ? AND day >= ?
+                    ORDER BY day
+                ''', (mytracker_project_id, date_from))
+                stats['mt_stats'] = cursor.fetchall()
         
-        return stats
+            return stats
     
     def get_digest_data(self, icon_path_template='logo/{project}.jpg', days_back=2):
         """Получить данные для дайджеста со всеми расчетами
@@ -369,81 +1351,167 @@ class DataAggregator:
         Returns:
             dict: готовые данные для дайджеста с разделами yandex, vk, mt
         """
-        projects = self.get_list_of_projects()
-        
+        date_from = _period_start(days_back)
+
+        yandex_rows = self._get_digest_balance_rows('yandex_balances_daily', 'yandex_cabinet_id', date_from)
+        yandex_changes = self._digest_changes(yandex_rows, 'current', 'previous')
         yandex_data = []
+        for row, change in zip(yandex_rows, yandex_changes):
+            yandex_data.append({
+                'project': row['name'],
+                'spend': self._format_number(row['current']),
+                'change': change
+            })
+
+        vk_rows = self._get_digest_balance_rows('vk_balances_daily', 'vk_cabinet_id', date_from)
+        vk_changes = self._digest_changes(vk_rows, 'current', 'previous')
         vk_data = []
-        mt_data = []
-        
-        for project in projects:
-            if not project.get('is_active'):
-                continue
-                
-            # Получаем статистику за период
-            stats = self.get_project_stats_for_period(
-                vk_cabinet_id=project.get('vk_cabinet_id'),
-                yandex_cabinet_id=project.get('yandex_cabinet_id'),
-                mytracker_project_id=project.get('mytracker_project_id'),
-                days=days_back
+        for row, change in zip(vk_rows, vk_changes):
+            # Формируем путь к иконке
+            icon_path = icon_path_template.format(
+                project=row['name'].lower().replace(' ', '_')
             )
-            
-            # Yandex данные
-            if project.get('yandex_cabinet_id') and 'yandex_balances' in stats:
-                yandex_balances = stats['yandex_balances']
-                if len(yandex_balances) >= 1:
-                    current = yandex_balances[-1]['avg_balance']
-                    previous = yandex_balances[-2]['avg_balance'] if len(yandex_balances) > 1 else current
-                    
-                    yandex_data.append({
-                        'project': project['name'],
-                        'spend': self._format_number(current),
-                        'change': self._calculate_change(current, previous)
-                    })
-            
-            # VK данные
-            if project.get('vk_cabinet_id') and 'vk_balances' in stats:
-                vk_balances = stats['vk_balances']
-                if len(vk_balances) >= 1:
-                    current = vk_balances[-1]['avg_balance']
-                    previous = vk_balances[-2]['avg_balance'] if len(vk_balances) > 1 else current
-                    
-                    # Формируем путь к иконке
-                    icon_path = icon_path_template.format(
-                        project=project['name'].lower().replace(' ', '_')
-                    )
-                    
-                    vk_data.append({
-                        'icon_path': icon_path,
-                        'name': project['name'],
-                        'spend': self._format_number(current),
-                        'change': self._calculate_change(current, previous)
-                    })
-            
-            # MyTracker данные
-            if project.get('mytracker_project_id') and 'mt_stats' in stats:
-                mt_stats = stats['mt_stats']
-                if len(mt_stats) >= 1:
-                    current = mt_stats[-1]
-                    previous = mt_stats[-2] if len(mt_stats) > 1 else current
-                    
-                    current_regs = current['total_registrations'] or 0
-                    previous_regs = previous['total_registrations'] or 0
-                    
-                    mt_data.append({
-                        'name': project['name'],
-                        'regs': str(current_regs),
-                        'fl': str(current['total_first_logins'] or 0),
-                        'ret': str(current['total_reactivations'] or 0),
-                        'users': current_regs,
-                        'change': self._calculate_change(current_regs, previous_regs)
-                    })
-        
+
+            vk_data.append({
+                'icon_path': icon_path,
+                'name': row['name'],
+                'spend': self._format_number(row['current']),
+                'change': change
+            })
+
+        mt_rows = self._get_digest_mt_rows(date_from)
+        mt_changes = self._digest_changes(mt_rows, 'total_registrations', 'previous_registrations')
+        mt_data = []
+        for row, change in zip(mt_rows, mt_changes):
+            current_regs = row['total_registrations'] or 0
+            mt_data.append({
+                'name': row['name'],
+                'regs': str(current_regs),
+                'fl': str(row['total_first_logins'] or 0),
+                'ret': str(row['total_reactivations'] or 0),
+                'users': current_regs,
+                'change': change
+            })
+
         return {
             'yandex': yandex_data,
             'vk': vk_data,
             'mt': mt_data
         }
+
+    def _get_digest_balance_rows(self, rollup, cabinet_column, date_from):
+        """Дневные средние балансы за последние два дня по всем активным проектам.
+
+        Один запрос на источник вместо запроса на каждый проект: дневные
+        значения берутся из суточных агрегатов, а последний и предпоследний
+        день выбираются оконными функциями.
+
+        Args:
+            rollup: таблица суточных агрегатов (vk_balances_daily или yandex_balances_daily)
+            cabinet_column: колонка с ID кабинета в этой таблице и в projects
+            date_from: первый день периода ('YYYY-MM-DD')
+
+        Returns:
+            list: строки (name, current, previous, days_count) в порядке проектов
+        """
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                WITH ranked AS (
+                    SELECT
+                        {cabinet_column} AS cabinet_id,
+                        balance_sum / balance_count AS avg_balance,
+                        LAG(balance_sum / balance_count) OVER (
+                            PARTITION BY {cabinet_column} ORDER BY day
+                        ) AS previous,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY {cabinet_column} ORDER BY day DESC
+                        ) AS rn,
+                        COUNT(*) OVER (PARTITION BY {cabinet_column}) AS days_count
+                    FROM {rollup}
+                    WHERE day >= ?
+                      AND {cabinet_column} IN (
+                          SELECT {cabinet_column} FROM projects WHERE is_active = 1
+                      )
+                )
+                SELECT
+                    p.name,
+                    r.avg_balance AS current,
+                    r.previous,
+                    r.days_count
+                FROM projects p
+                JOIN ranked r ON r.cabinet_id = p.{cabinet_column} AND r.rn = 1
+                WHERE p.is_active = 1 AND p.{cabinet_column} != ''
+                ORDER BY p.id
+            ''', (date_from,))
+            return cursor.fetchall()
+
+    def _get_digest_mt_rows(self, date_from):
+        """Дневные суммы MyTracker за последние два дня по всем активным проектам.
+
+        Args:
+            date_from: первый день периода ('YYYY-MM-DD')
+
+        Returns:
+            list: строки с суммами за последний день и регистрациями за предыдущий
+        """
+        with self._reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                WITH ranked AS (
+                    SELECT
+                        mytracker_project_id,
+                        registrations_sum AS total_registrations,
+                        first_logins_sum AS total_first_logins,
+                        reactivations_sum AS total_reactivations,
+                        LAG(registrations_sum) OVER (
+                            PARTITION BY mytracker_project_id ORDER BY day
+                        ) AS previous_registrations,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY mytracker_project_id ORDER BY day DESC
+                        ) AS rn,
+                        COUNT(*) OVER (PARTITION BY mytracker_project_id) AS days_count
+                    FROM mt_stats_daily
+                    WHERE day >= ?
+                      AND mytracker_project_id IN (
+                          SELECT mytracker_project_id FROM projects WHERE is_active = 1
+                      )
+                )
+                SELECT
+                    p.name,
+                    r.total_registrations,
+                    r.total_first_logins,
+                    r.total_reactivations,
+                    r.previous_registrations,
+                    r.days_count
+                FROM projects p
+                JOIN ranked r
+                    ON r.mytracker_project_id = p.mytracker_project_id AND r.rn = 1
+                WHERE p.is_active = 1 AND p.mytracker_project_id != ''
+                ORDER BY p.id
+            ''', (date_from,))
+            return cursor.fetchall()
     
+    @classmethod
+    def _digest_changes(cls, rows, current_column, previous_column):
+        """Процентные изменения к предыдущему дню для строк дайджеста
+
+        Если у проекта данные только за один день, изменение равно 0.
+        Пустые значения MyTracker считаются нулями. Большие дайджесты
+        считаются векторно (timeseries.change_percent), если установлен
+        numpy; результат тот же, что у _calculate_change.
+
+        Returns:
+            list: изменения в порядке rows
+        """
+        current = [row[current_column] or 0 for row in rows]
+        previous = [(row[previous_column] or 0) if row['days_count'] > 1 else value
+                    for row, value in zip(rows, current)]
+        if len(rows) >= _VECTORIZED_DIGEST_ROWS and _numpy_available():
+            from . import timeseries  # тянет numpy — только для больших дайджестов
+            return timeseries.change_percent(current, previous, exact=True)
+        return [cls._calculate_change(value, before) for value, before in zip(current, previous)]
+
     @staticmethod
     def _calculate_change(current, previous):
         """Вычислить процентное изменение"""
@@ -461,37 +1529,72 @@ class DataAggregator:
 
 
     def delete_project(self, project_id):
-        """Удалить проект и все связанные данные"""
-        cursor = self.conn.cursor()
+        """Удалить проект и все связанные данные
+
+        В режиме партиций внутри batch() удаление затрагивает все месяцы
+        одной транзакцией, поэтому партиций должно быть не больше
+        partitions.MAX_ATTACHED.
+        """
+        with self._writer() as conn:
+            cursor = conn.cursor()
         
-        # Получаем cabinet_id проекта
-        cursor.execute('''
-            SELECT vk_cabinet_id, yandex_cabinet_id, mytracker_project_id 
-            FROM projects WHERE id = ?
-        ''', (project_id,))
-        project = cursor.fetchone()
+            # Получаем cabinet_id проекта
+            cursor.execute('''
+                SELECT vk_cabinet_id, yandex_cabinet_id, mytracker_project_id 
+                FROM projects WHERE id = ?
+            ''', (project_id,))
+            project = cursor.fetchone()
         
-        if not project:
-            return False
+            if not project:
+                return False
+
+            if self._partitions is not None:
+                # Сырые строки в партициях удаляются по транзакции на месяц:
+                # в одну транзакцию помещается не больше MAX_ATTACHED партиций
+                for month in self._partitions.months():
+                    for table, key in _RAW_KEYS:
+                        if project[key]:
+                            source = self._raw_writer_source(table, month)
+                            cursor.execute(f'DELETE FROM {source} WHERE {key} = ?', (project[key],))
+                    self._commit()
         
-        # Удаляем связанные данные по cabinet_id
-        if project['vk_cabinet_id']:
-            cursor.execute('DELETE FROM vk_balances WHERE vk_cabinet_id = ?', 
-                         (project['vk_cabinet_id'],))
+            # Удаляем связанные данные по cabinet_id
+            if project['vk_cabinet_id']:
+                cursor.execute('DELETE FROM vk_balances WHERE vk_cabinet_id = ?', 
+                             (project['vk_cabinet_id'],))
+                cursor.execute('DELETE FROM vk_balances_daily WHERE vk_cabinet_id = ?',
+                               (project['vk_cabinet_id'],))
+                cursor.execute('DELETE FROM vk_balances_latest WHERE vk_cabinet_id = ?',
+                               (project['vk_cabinet_id'],))
         
-        if project['yandex_cabinet_id']:
-            cursor.execute('DELETE FROM yandex_balances WHERE yandex_cabinet_id = ?', 
-                         (project['yandex_cabinet_id'],))
+            if project['yandex_cabinet_id']:
+                cursor.execute('DELETE FROM yandex_balances WHERE yandex_cabinet_id = ?', 
+                             (project['yandex_cabinet_id'],))
+                cursor.execute('DELETE FROM yandex_balances_daily WHERE yandex_cabinet_id = ?',
+                               (project['yandex_cabinet_id'],))
+                cursor.execute('DELETE FROM yandex_balances_latest WHERE yandex_cabinet_id = ?',
+                               (project['yandex_cabinet_id'],))
         
-        if project['mytracker_project_id']:
-            cursor.execute('DELETE FROM mt_stats WHERE mytracker_project_id = ?', 
-                         (project['mytracker_project_id'],))
+            if project['mytracker_project_id']:
+                cursor.execute('DELETE FROM mt_stats WHERE mytracker_project_id = ?', 
+                             (project['mytracker_project_id'],))
+                cursor.execute('DELETE FROM mt_stats_daily WHERE mytracker_project_id = ?',
+                               (project['mytracker_project_id'],))
+                cursor.execute('DELETE FROM mt_stats_latest WHERE mytracker_project_id = ?',
+                               (project['mytracker_project_id'],))
         
-        # Удаляем сам проект
-        cursor.execute('DELETE FROM projects WHERE id = ?', (project_id,))
+            # Почасовые агрегаты есть, только если применялось хранение истории
+            for table, key in _RAW_KEYS:
+                if project[key] and schema.table_exists(conn, retention.HOURLY[table]):
+                    cursor.execute(f'DELETE FROM {retention.HOURLY[table]} WHERE {key} = ?',
+                                   (project[key],))
+
+            # Удаляем сам проект
+            cursor.execute('DELETE FROM projects WHERE id = ?', (project_id,))
         
-        self.conn.commit()
-        return cursor.rowcount > 0
+            self._projects_changed = True
+            self._commit()
+            return cursor.rowcount > 0
 
     def toggle_project_status(self, project_id, is_active):
         """Активировать/деактивировать проект
@@ -500,15 +1603,17 @@ class DataAggregator:
             project_id: ID проекта
             is_active: True для активации, False для деактивации
         """
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE projects 
-            SET is_active = ? 
-            WHERE id = ?
-        ''', (1 if is_active else 0, project_id))
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE projects 
+                SET is_active = ? 
+                WHERE id = ?
+            ''', (1 if is_active else 0, project_id))
         
-        self.conn.commit()
-        return cursor.rowcount > 0
+            self._projects_changed = True
+            self._commit()
+            return cursor.rowcount > 0
     
 
     def edit_project_mytracker_id(self, project_id, mytracker_project_id):
@@ -518,22 +1623,663 @@ class DataAggregator:
             project_id: ID проекта
             mytracker_project_id: Новый mytracker_project_id
         """
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE projects 
-            SET mytracker_project_id = ? 
-            WHERE id = ?
-        ''', (mytracker_project_id, project_id))
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE projects 
+                SET mytracker_project_id = ? 
+                WHERE id = ?
+            ''', (mytracker_project_id, project_id))
         
-        self.conn.commit()
-        return cursor.rowcount > 0
+            self._projects_changed = True
+            self._commit()
+            return cursor.rowcount > 0
     
     def reset_projects_counter(self):
         """Сбросить счетчик ID проектов (использовать только если таблица пустая!)"""
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM sqlite_sequence WHERE name='projects'")
-        self.conn.commit()
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name='projects'")
+            self._commit()
+    
+    def rebuild_rollups(self, date_from=None, date_to=None):
+        """Пересчитать суточные агрегаты из сырых таблиц (backfill)
+
+        Нужен после ручной правки сырых таблиц или импорта в обход
+        DataAggregator. Агрегаты за дни [date_from, date_to) удаляются и
+        считаются заново одной транзакцией (в режиме партиций — транзакцией
+        на каждый месяц, для которого есть партиция). Дни, сырые строки
+        которых уже удалены apply_retention, не пересчитываются.
+
+        Args:
+            date_from: первый день ('YYYY-MM-DD', date или datetime), по умолчанию вся история
+            date_to: день, не включаемый в пересчет
+
+        Returns:
+            dict: {таблица агрегатов: количество строк в диапазоне}
+        """
+        date_from = _to_date(date_from).isoformat() if date_from is not None else None
+        date_to = _to_date(date_to).isoformat() if date_to is not None else None
+        with self._writer() as conn:
+            date_from = _clamp_to_raw_horizon(conn, date_from)
+            if self._partitions is None:
+                result = rollups.rebuild_rollups(conn, date_from, date_to)
+                self._commit()
+                return result
+
+        # В режиме партиций — транзакция на месяц, за который есть партиция
+        result = {}
+        for month in self._partitions.months_for_range(date_from, date_to):
+            with self._writer() as conn:
+                schema = self._partitions.attach(conn, month)
+                month_result = rollups.rebuild_rollups(
+                    conn, *_clip_to_month(month, date_from, date_to), schema=schema
+                )
+                self._commit()
+            for rollup, count in month_result.items():
+                result[rollup] = result.get(rollup, 0) + count
+        return result
+
+    def rebuild_snapshots(self):
+        """Пересчитать снимки последних значений (*_latest) из сырых таблиц"""
+        with self._writer() as conn:
+            if self._partitions is None:
+                snapshots.rebuild_snapshots(conn)
+                self._commit()
+                return
+
+            # Снимки собираются во временных таблицах по партиции за
+            # транзакцию и заменяются целиком в конце; блокировка записи
+            # держится все время, чтобы не потерять новые строки
+            for table in snapshots.SNAPSHOTS:
+                stage = snapshots.stage_snapshots(conn, table)
+                for month in self._partitions.months():
+                    snapshots.stage_from(conn, table, stage, self._partitions.attach(conn, month))
+                    self._commit()
+                snapshots.replace_from_stage(conn, table, stage)
+                self._commit()
+
+    def check_rollups(self, date_from=None, date_to=None):
+        """Сверить суточные агрегаты с сырыми таблицами
+
+        Args:
+            date_from: первый день ('YYYY-MM-DD', date или datetime), по умолчанию вся история
+            date_to: день, не включаемый в проверку
+
+        Returns:
+            list: расхождения (table, cabinet_id, day, column, expected, actual);
+                пустой список, если агрегаты согласованы. Дни до границы
+                хранения сырых строк не проверяются.
+        """
+        date_from = _to_date(date_from).isoformat() if date_from is not None else None
+        date_to = _to_date(date_to).isoformat() if date_to is not None else None
+        with self._reader() as conn:
+            date_from = _clamp_to_raw_horizon(conn, date_from)
+            if self._partitions is None:
+                return rollups.check_rollups(conn, date_from, date_to)
+
+        mismatches = []
+        for month in self._partitions.months_for_range(date_from, date_to):
+            with self._partition_reader(month) as (conn, schema):
+                mismatches.extend(rollups.check_rollups(
+                    conn, *_clip_to_month(month, date_from, date_to), schema=schema
+                ))
+        return mismatches
+
+    def apply_retention(self, policy=None, tables=None, chunk_size=5000, vacuum_pages=1000):
+        """Применить политику хранения истории
+
+        Сырые строки старше policy.raw_days сворачиваются в почасовые
+        агрегаты (*_hourly), при необходимости копируются в архив и
+        удаляются; затем удаляются устаревшие почасовые и суточные агрегаты
+        и освобождается место в файле. Каждая порция из chunk_size строк —
+        отдельная транзакция, между порциями другие потоки могут писать.
+
+        Args:
+            policy: retention.RetentionPolicy (по умолчанию сырые строки 30
+                дней, почасовые агрегаты 365 дней, суточные всегда) или
+                словарь {сырая таблица: RetentionPolicy}
+            tables: сырые таблицы для обработки (по умолчанию все)
+            chunk_size: сколько сырых строк обрабатывать за транзакцию
+            vacuum_pages: сколько свободных страниц возвращать за шаг
+                incremental_vacuum; 0 — не возвращать
+
+        Returns:
+            dict: {'tables': {таблица: {'raw_deleted', 'archived',
+                'hourly_deleted', 'daily_deleted'}}, 'freed_pages': int}
+        """
+        if self._batch_thread == threading.get_ident():
+            raise RuntimeError("apply_retention нельзя вызывать внутри batch()")
+        if not isinstance(policy, dict):
+            policy = dict.fromkeys(retention.HOURLY, policy or retention.RetentionPolicy())
+
+        with self._writer() as conn:
+            selected = [
+                table for table in retention.HOURLY
+                if table in policy and (tables is None or table in tables)
+                and schema.table_exists(conn, table)
+            ]
+            retention.ensure_retention_tables(conn, selected)
+            self._commit()
+
+        report = {
+            table: self._apply_table_retention(table, policy[table], chunk_size)
+            for table in selected
+        }
+        return {'tables': report, 'freed_pages': self._incremental_vacuum(vacuum_pages)}
+
+    def _apply_table_retention(self, table, policy, chunk_size):
+        """Применить политику к одной сырой таблице (см. apply_retention)"""
+        stats = {'raw_deleted': 0, 'archived': 0, 'hourly_deleted': 0, 'daily_deleted': 0}
+
+        if policy.raw_days is not None:
+            raw_before = _period_start(policy.raw_days)
+            if policy.hourly_days == 0:
+                hourly_from = False
+            elif policy.hourly_days is None:
+                hourly_from = None
+            else:
+                hourly_from = _period_start(policy.hourly_days)
+
+            with self._archive_attached(policy.archive, policy.archive_path):
+                with self._writer() as conn:
+                    # Граница фиксируется до удаления: с этого момента агрегаты
+                    # за более ранние дни нельзя пересчитывать из сырых строк
+                    retention.record_horizon(conn, table, raw_before)
+                    self._commit()
+                months = self._raw_months(date_to=raw_before)
+                for month in months:
+                    while True:
+                        with self._writer() as conn:
+                            schema = month and self._partitions.attach(conn, month)
+                            if policy.archive is not None:
+                                retention.ensure_archive_table(
+                                    conn, table, policy.archive, schema or 'main'
+                                )
+                            deleted = retention.move_raw_chunk(
+                                conn, table, raw_before, hourly_from, policy.archive,
+                                chunk_size, schema
+                            )
+                            self._commit(deleted)
+                        if not deleted:
+                            break
+                        stats['raw_deleted'] += deleted
+                    if month is not None:
+                        self._remove_empty_partition(month, raw_before)
+            if policy.archive is not None:
+                stats['archived'] = stats['raw_deleted']
+
+        if policy.hourly_days:
+            stats['hourly_deleted'] = self._trim_aggregates(
+                retention.HOURLY[table], table, 'hour', _period_start(policy.hourly_days)
+            )
+        if policy.daily_days is not None:
+            rollup = rollups.MT_ROLLUP if table == 'mt_stats' else rollups.BALANCE_ROLLUPS[table][1]
+            stats['daily_deleted'] = self._trim_aggregates(
+                rollup, table, 'day', _period_start(policy.daily_days)
+            )
+        return stats
+
+    @contextmanager
+    def _archive_attached(self, archive, archive_path):
+        """Подключить архивную базу на время блока, если archive='database'"""
+        if archive != 'database':
+            yield
+            return
+        with self._writer() as conn:
+            conn.execute(f'ATTACH DATABASE ? AS {retention.ARCHIVE_SCHEMA}', (archive_path,))
+        try:
+            yield
+        finally:
+            with self._writer() as conn:
+                conn.execute(f'DETACH DATABASE {retention.ARCHIVE_SCHEMA}')
+
+    def _remove_empty_partition(self, month, raw_before):
+        """Удалить файл партиции месяца, целиком ушедшего за границу хранения"""
+        if partitions.month_bounds(month)[1] > raw_before:
+            return
+        with self._writer() as conn:
+            schema = self._partitions.attach(conn, month)
+            if schema is None or conn.in_transaction:
+                return
+            for table in partitions.RAW_TABLES:
+                if conn.execute(f'SELECT 1 FROM {schema}.{table} LIMIT 1').fetchone():
+                    return
+            self._partitions.detach(conn, schema)
+            self._partitions.remove(month)
+
+    def _trim_aggregates(self, aggregate_table, table, bucket_column, before):
+        """Удалить агрегаты старше before порциями по retention.KEYS_PER_CHUNK кабинетов"""
+        key_column, _ = rollups.aggregate_layout(table)
+        with self._reader() as conn:
+            keys = retention.aggregate_keys(conn, aggregate_table, key_column)
+
+        deleted = 0
+        for start in range(0, len(keys), retention.KEYS_PER_CHUNK):
+            chunk = keys[start:start + retention.KEYS_PER_CHUNK]
+            with self._writer() as conn:
+                rows = retention.trim_aggregates(
+                    conn, aggregate_table, key_column, bucket_column, before, chunk
+                )
+                self._commit(rows)
+            deleted += rows
+        return deleted
+
+    def _incremental_vacuum(self, pages):
+        """Возвращать свободные страницы шагами по pages, пока они есть"""
+        freed = 0
+        while pages:
+            with self._writer() as conn:
+                step = retention.incremental_vacuum(conn, pages)
+            if not step:
+                break
+            freed += step
+        return freed
+
+    def enable_incremental_vacuum(self):
+        """Перевести базу в режим auto_vacuum = INCREMENTAL
+
+        Для существующей базы режим меняется только полным VACUUM, который
+        перестраивает весь файл и блокирует запись на время работы; делается
+        один раз. Новые базы по встроенной схеме создаются сразу в этом режиме.
+        """
+        with self._writer() as conn:
+            if conn.in_transaction:
+                self._commit_now()
+            schema.enable_auto_vacuum(conn)
+            conn.execute('VACUUM')
+
+    def deduplicate_raw_rows(self, tables=None, chunk_size=schema.DEDUP_CHUNK_SIZE,
+                             archive=None, archive_path=None):
+        """Удалить дубликаты натуральных ключей и создать уникальные индексы
+
+        Нужен для баз, в которых до натуральных ключей одна и та же строка
+        (кабинет, fetched_at) записывалась несколько раз: миграция схемы
+        создает уникальный индекс только для таблиц без дубликатов и строк
+        не удаляет. Из строк одного ключа остается записанная последней.
+        Таблица обходится порциями по rowid, каждая порция — отдельная
+        транзакция; агрегаты затронутых суток пересчитываются, снимки
+        обновляются. Хвост, дописанный другими процессами во время обхода,
+        дочищается в одной транзакции с созданием индекса. В режиме партиций
+        обрабатываются основная база и все партиции.
+
+        Args:
+            tables: сырые таблицы для обработки (по умолчанию все)
+            chunk_size: сколько строк по rowid проверять за транзакцию
+            archive: куда переносить удаляемые строки: None — никуда,
+                'table' — в таблицы <таблица>_archive этой же базы,
+                'database' — в одноименные таблицы базы archive_path
+                (как в RetentionPolicy)
+            archive_path: путь к архивной базе для archive='database'
+
+        Returns:
+            dict: {сырая таблица: сколько строк удалено}
+        """
+        if self._batch_thread == threading.get_ident():
+            raise RuntimeError("deduplicate_raw_rows нельзя вызывать внутри batch()")
+        if archive not in retention.ARCHIVE_MODES:
+            raise ValueError("archive должен быть None, 'table' или 'database'")
+        if archive == 'database' and not archive_path:
+            raise ValueError("Для archive='database' нужен archive_path")
+
+        months = [None]
+        if self._partitions is not None:
+            months.extend(self._partitions.months())
+        deleted = {}
+        with self._archive_attached(archive, archive_path):
+            for table, _ in _RAW_KEYS:
+                if tables is not None and table not in tables:
+                    continue
+                deleted[table] = sum(
+                    self._deduplicate_source(table, month, chunk_size, archive) for month in months
+                )
+        return deleted
+
+    def _deduplicate_source(self, table, month, chunk_size, archive):
+        """Удалить дубликаты в сырой таблице основной базы (month=None) или партиции"""
+        with self._writer() as conn:
+            schema_name = month and self._partitions.attach(conn, month)
+            exists = schema_name is not None if month else schema.table_exists(conn, table)
+            if not exists:
+                return 0
+            source = f'{schema_name or "main"}.{table}'
+            if archive is not None:
+                retention.ensure_archive_table(conn, table, archive, schema_name or 'main')
+            last_rowid = conn.execute(f'SELECT MAX(rowid) FROM {source}').fetchone()[0] or 0
+            self._commit()
+
+        deleted, after_rowid = 0, 0
+        while True:
+            with self._writer() as conn:
+                schema_name = month and self._partitions.attach(conn, month)
+                if after_rowid >= last_rowid:
+                    # Хвост — под блокировкой записи, в одной транзакции с индексом
+                    conn.execute('BEGIN IMMEDIATE')
+                    last_rowid = conn.execute(
+                        f'SELECT MAX(rowid) FROM {schema_name or "main"}.{table}'
+                    ).fetchone()[0] or 0
+                    while after_rowid < last_rowid:
+                        deleted += natural_keys.deduplicate_chunk(
+                            conn, table, after_rowid, chunk_size, schema_name, archive
+                        )
+                        after_rowid += chunk_size
+                    natural_keys.create_unique_index(conn, table, schema_name or 'main')
+                    self._commit_now()
+                    return deleted
+                rows = natural_keys.deduplicate_chunk(
+                    conn, table, after_rowid, chunk_size, schema_name, archive
+                )
+                self._commit(rows)
+            deleted += rows
+            after_rowid += chunk_size
+
+    def move_rows_to_partitions(self, chunk_size=5000):
+        """Перенести сырые строки из основной базы в помесячные партиции
+
+        Нужен один раз после включения partitioned=True для базы, в которой
+        уже есть история: без переноса эти строки не видны запросам к сырым
+        таблицам. Каждая порция — целые сутки одного месяца, не меньше
+        chunk_size строк, — отдельная транзакция. Строка, совпавшая по
+        натуральному ключу (кабинет, fetched_at) со строкой партиции,
+        заменяет ее; агрегаты таких суток пересчитываются, остальные агрегаты
+        и снимки от переноса не меняются.
+
+        Returns:
+            dict: {сырая таблица: сколько строк перенесено}
+        """
+        if self._partitions is None:
+            raise RuntimeError("Режим партиций не включен (partitioned=False)")
+
+        moved = {}
+        for table, key in _RAW_KEYS:
+            _, columns = self._history_source(table)
+            names = ', '.join((key, *columns, 'fetched_at'))
+            moved[table] = 0
+            while True:
+                with self._writer() as conn:
+                    first = conn.execute(f'SELECT MIN(fetched_at) FROM main.{table}').fetchone()[0]
+                    if first is None:
+                        break
+                    month = partitions.month_of(first)
+                    month_from, month_to = partitions.month_bounds(month)
+                    # Порция — целые сутки (не меньше chunk_size строк, но не
+                    # дальше конца месяца): агрегаты суток, где строка совпала
+                    # по ключу со строкой партиции, пересчитываются по партиции
+                    # и должны видеть все строки этих суток
+                    cut = conn.execute(f'''
+                        SELECT DATE(fetched_at, '+1 day') FROM main.{table}
+                        WHERE fetched_at >= ? AND fetched_at < ?
+                        ORDER BY fetched_at LIMIT 1 OFFSET ?
+                    ''', (month_from, month_to, chunk_size - 1)).fetchone()
+                    params = (month_from, min(cut[0], month_to) if cut else month_to)
+                    source = self._raw_writer_source(table, month, create=True)
+                    conflicts = natural_keys.existing_keys(conn, table, source, conn.execute(
+                        f'SELECT {key}, fetched_at FROM main.{table} '
+                        f'WHERE fetched_at >= ? AND fetched_at < ?', params
+                    ).fetchall())
+                    conn.execute(f'''
+                        INSERT INTO {source} ({names})
+                        SELECT {names} FROM main.{table}
+                        WHERE fetched_at >= ? AND fetched_at < ?
+                        ORDER BY rowid
+                        {natural_keys.upsert_clause(table, self._keyed(source))}
+                    ''', params)
+                    count = conn.execute(
+                        f'DELETE FROM main.{table} WHERE fetched_at >= ? AND fetched_at < ?', params
+                    ).rowcount
+                    natural_keys.refresh_days(conn, table, conflicts, source.split('.')[0])
+                    self._commit(count)
+                moved[table] += count
+        return moved
+
+    def import_rows(self, table, source, format=None, chunk_size=10000,
+                    transaction_rows=200000, rebuild_indexes=True):
+        """Потоковый импорт строк таблицы из CSV или JSONL
+
+        Файл читается порциями по chunk_size строк, каждая порция пишется
+        одним executemany; коммит — раз в transaction_rows строк. Сырые
+        строки пишутся по натуральному ключу, как в save_*: повторный импорт
+        того же файла ничего не удваивает. Перед каждым коммитом суточные
+        агрегаты затронутых кабинето-дней пересчитываются из сырых строк,
+        снимки обновляются. При ошибке откатывается только текущая
+        транзакция.
+
+        Args:
+            table: 'projects', 'vk_balances', 'yandex_balances' или 'mt_stats';
+                колонки — как в export_rows (см. transfer.TABLES)
+            source: путь к файлу или текстовый файловый объект
+            format: 'csv' или 'jsonl' (по умолчанию по расширению)
+            chunk_size: сколько строк читать и писать за раз
+            transaction_rows: сколько строк писать в одной транзакции
+            rebuild_indexes: на время импорта удалить индексы сырой таблицы
+                по кабинету и времени и построить их заново в конце —
+                быстрее для больших загрузок, но пока импорт идет, запросы
+                других соединений к этой таблице идут полным проходом.
+                Уникальный индекс натурального ключа остается. В режиме
+                партиций не действует.
+
+        Returns:
+            int: сколько строк прочитано из файла
+        """
+        from . import transfer  # csv/json — только для импорта и выгрузки, не при старте
+        transfer.columns(table)
+        fmt = transfer.detect_format(source, format)
+        with self._writer() as conn:
+            if self._batch is not None:
+                raise RuntimeError("import_rows() нельзя вызывать внутри batch()")
+            if conn.in_transaction:
+                self._commit_now()
+            dropped = []
+            if rebuild_indexes and table != 'projects' and self._partitions is None:
+                for name, index_table, _ in INDEXES:
+                    if index_table == table:
+                        conn.execute(f'DROP INDEX IF EXISTS {name}')
+                        dropped.append(name)
+            count, pending, touched = 0, 0, {}
+            try:
+                with transfer.open_text(source, 'r') as file:
+                    for chunk in transfer.read_chunks(file, table, fmt, chunk_size):
+                        if table == 'projects':
+                            self._import_projects(conn, chunk)
+                        else:
+                            self._import_raw_rows(conn, table, chunk, touched)
+                        count += len(chunk)
+                        pending += len(chunk)
+                        if pending >= transaction_rows:
+                            self._finish_import(conn, table, touched)
+                            pending = 0
+                self._finish_import(conn, table, touched)
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                if dropped:
+                    schema.ensure_indexes(conn)
+            return count
+
+    def _import_projects(self, conn, rows):
+        """Проекты из файла: строка с id заменяет проект с этим id"""
+        conn.executemany('''
+            INSERT INTO projects (id, name, vk_cabinet_id, yandex_cabinet_id,
+                                  mytracker_project_id, is_active)
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, 1))
+            ON CONFLICT (id) DO UPDATE SET
+                name = excluded.name,
+                vk_cabinet_id = excluded.vk_cabinet_id,
+                yandex_cabinet_id = excluded.yandex_cabinet_id,
+                mytracker_project_id = excluded.mytracker_project_id,
+                is_active = excluded.is_active
+        ''', rows)
+        self._projects_changed = True
+
+    def _import_raw_rows(self, conn, table, rows, touched):
+        """Записать сырые строки без инкрементальных агрегатов
+
+        touched: {схема: {(кабинет, день), ...}} — пересчитывается в _finish_import
+        """
+        rows = natural_keys.latest_per_key(rows)
+        for month, month_rows in self._rows_by_month(rows, -1).items():
+            source = self._raw_writer_source(table, month, create=True)
+            conn.executemany(natural_keys.upsert_sql(table, source, self._keyed(source)), month_rows)
+            schema_name = source.split('.')[0] if '.' in source else None
+            touched.setdefault(schema_name, set()).update(
+                (row[0], str(row[-1])[:10]) for row in month_rows
+            )
+
+    def _finish_import(self, conn, table, touched):
+        """Пересчитать агрегаты и снимки затронутых строк и закоммитить"""
+        # Сначала ранние месяцы: снимок заменяется только более новой строкой
+        for schema_name in sorted(touched, key=lambda name: name or ''):
+            days = touched[schema_name]
+            rollups.refresh_days(conn, table, days, schema_name)
+            snapshots.upsert_latest(conn, table, {key for key, _ in days}, schema_name)
+        touched.clear()
+        self._commit_now()
+
+    def export_rows(self, table, target, format=None, date_from=None, date_to=None,
+                    chunk_size=5000):
+        """Потоковая выгрузка таблицы в CSV или JSONL
+
+        Строки читаются из базы порциями (iter_list_of_projects,
+        iter_balance_history) и сразу пишутся в файл, так что память не
+        зависит от объема выгрузки. Файл загружается обратно через
+        import_rows.
+
+        Args:
+            table: 'projects', 'vk_balances', 'yandex_balances' или 'mt_stats'
+            target: путь к файлу или текстовый файловый объект
+            format: 'csv' или 'jsonl' (по умолчанию по расширению)
+            date_from, date_to: период fetched_at для сырых таблиц
+                ([date_from, date_to), по умолчанию вся история)
+
+        Returns:
+            int: сколько строк выгружено
+        """
+        from . import transfer  # csv/json — только для импорта и выгрузки, не при старте
+        transfer.columns(table)
+        fmt = transfer.detect_format(target, format)
+        if table == 'projects':
+            rows = self.iter_list_of_projects(chunk_size, row_type='tuple')
+        else:
+            rows = self.iter_balance_history(table, None, date_from, date_to,
+                                             chunk_size, row_type='tuple')
+        with transfer.open_text(target, 'w') as file:
+            return transfer.write_rows(file, table, fmt, rows)
+
+    def backup(self, target_path, pages=1000, sleep=0.05, max_restarts=3):
+        """Онлайн-копия базы, не останавливающая запись
+
+        Копирует отдельное соединение через sqlite3.Connection.backup шагами
+        по pages страниц с паузой sleep секунд между шагами (см.
+        transfer.backup_database). В копию попадает только закоммиченное:
+        открытый batch() и очередь write_behind в нее не входят. В режиме
+        партиций рядом с копией создаются копии файлов партиций с тем же
+        именем базы.
+
+        Args:
+            target_path: путь к файлу копии; существующий файл заменяется
+            pages: страниц за шаг; -1 — вся база одним шагом
+            sleep: пауза между шагами, секунд
+            max_restarts: сколько раз позволить копированию начаться заново
+                из-за записи в базу, прежде чем снять копию одним шагом
+
+        Returns:
+            dict: {'pages', 'restarts', 'seconds'} по основной базе и
+                'partitions' — число скопированных партиций
+        """
+        from . import transfer
+        if self.db_path == ':memory:':
+            with self._writer() as conn:
+                result = transfer.backup_database(conn, target_path, pages=-1)
+            result['partitions'] = 0
+            return result
+
+        source = sqlite3.connect(_file_uri(self.db_path, mode='ro'), uri=True)
+        try:
+            result = transfer.backup_database(source, target_path, pages, sleep, max_restarts)
+        finally:
+            source.close()
+        result['partitions'] = 0
+        if self._partitions is not None:
+            target_store = partitions.PartitionStore(target_path)
+            for month in self._partitions.months():
+                source = sqlite3.connect(_file_uri(self._partitions.path(month), mode='ro'), uri=True)
+                try:
+                    transfer.backup_database(source, target_store.path(month), pages, sleep,
+                                             max_restarts)
+                finally:
+                    source.close()
+                result['partitions'] += 1
+        return result
+
+    def get_schema_version(self):
+        """Получить версию схемы базы
+
+        Returns:
+            dict: {'version': версия базы, 'latest': версия этой библиотеки}
+        """
+        with self._reader() as conn:
+            return {'version': schema.schema_version(conn), 'latest': schema.SCHEMA_VERSION}
+
+    def migrate_schema(self, target=None):
+        """Применить недостающие миграции схемы (см. schema.migrate)
+
+        Миграции идут короткими транзакциями через соединение на запись:
+        другие процессы ждут только текущую порцию, потоки этого
+        DataAggregator — всю миграцию.
+
+        Returns:
+            list: номера примененных миграций
+        """
+        with self._writer() as conn:
+            if self._batch is not None:
+                raise RuntimeError("migrate_schema() нельзя вызывать внутри batch()")
+            return schema.migrate(conn, target)
+
+    def get_connection_settings(self):
+        """Получить действующие настройки соединения
+
+        Значения читаются из SQLite, а не из профиля: например, для базы в
+        памяти journal_mode останется MEMORY даже в профиле с WAL.
+
+        Returns:
+            dict: {'journal_mode': 'WAL', 'synchronous': 'NORMAL', ...}
+        """
+        with self._reader() as conn:
+            return _read_connection_settings(conn)
+
+    def verify_indexes(self):
+        """Проверить, что индексы из INDEXES созданы с нужными колонками
+
+        Returns:
+            dict: {имя индекса: True, если индекс на месте и совпадает}
+        """
+        report = {}
+        with self._reader() as conn:
+            for name, table, columns in INDEXES:
+                existing = [row[2] for row in conn.execute(f'PRAGMA index_info({name})')]
+                report[name] = existing == list(columns)
+        return report
+
+    def explain_query_plan(self, sql, params=()):
+        """Получить план выполнения запроса (EXPLAIN QUERY PLAN)
+
+        Returns:
+            list: строки detail из плана, например 'SEARCH vb USING INDEX ...'
+        """
+        with self._reader() as conn:
+            cursor = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row['detail'] for row in cursor.fetchall()]
     
     def close(self):
-        """Закрыть соединение с БД"""
-        self.conn.close()
+        """Закрыть соединение с БД (и все соединения пула)
+
+        В режиме write_behind сначала записывается вся очередь.
+        """
+        if self._write_behind is not None:
+            self._write_behind.close()
+        if self._pool is not None:
+            self._pool.close()
+        with self._write_lock:
+            if self._conn is not None:
+                self._conn.close()
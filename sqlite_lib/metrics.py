@@ -0,0 +1,468 @@
+# Инструментирование DataAggregator: число вызовов, гистограммы времени,
+# прочитанные и записанные строки по каждому публичному методу и каждому
+# SQL-запросу, время коммитов и журнал медленных запросов с планом
+# выполнения. Выгрузка — словарем или текстом в формате Prometheus.
+#
+# Запросы замеряются подклассами sqlite3.Connection/sqlite3.Cursor: у
+# trace callback нет события окончания запроса, а время SELECT в основном
+# уходит на fetch. Progress handler считает шаги виртуальной машины SQLite
+# (с точностью до PROGRESS_STEPS) — оценку работы запроса без учета кэша
+# страниц. Когда метрики выключены, DataAggregator открывает обычные
+# соединения и не оборачивает методы, так что накладных расходов нет.
+
+import bisect
+import functools
+import logging
+import re
+import sqlite3
+import threading
+import time
+import types
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм времени, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Через сколько инструкций виртуальной машины вызывается progress handler
+PROGRESS_STEPS = 10000
+
+# Сколько разных текстов SQL запоминать нормализованными
+_NORMALIZED_CACHE_SIZE = 1024
+
+# Ключ, под которым считаются запросы сверх max_queries
+OTHER_QUERIES = '<other>'
+
+# Скобки только с параметрами: (?, ?, ?) или (?1, ?2)
+_PLACEHOLDER_GROUP = re.compile(r'\(\s*\?\d*(?:\s*,\s*\?\d*)*\s*\)')
+# Подряд идущие свернутые группы: VALUES (...), (...), ...
+_REPEATED_GROUPS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+
+
+class Histogram:
+    """Гистограмма времени с фиксированными корзинами (как в Prometheus)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def cumulative(self):
+        """Пары (граница, число наблюдений <= границы), последняя — '+Inf'"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'buckets': {str(bound): count for bound, count in self.cumulative()},
+        }
+
+
+class _Stats:
+    """Счетчики одного метода или одного SQL-запроса"""
+
+    def __init__(self, buckets):
+        self.latency = Histogram(buckets)
+        self.errors = 0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.vm_steps = 0
+
+    def to_dict(self):
+        return {
+            'calls': self.latency.count,
+            'errors': self.errors,
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'vm_steps': self.vm_steps,
+            'latency': self.latency.to_dict(),
+        }
+
+
+class QueryMetrics:
+    """Сборщик метрик методов и запросов; потокобезопасен
+
+    Один экземпляр можно передать нескольким DataAggregator, тогда метрики
+    складываются.
+
+    Вызовы публичных методов изнутри других публичных методов (например,
+    get_list_of_projects -> iter_list_of_projects) отдельно не считаются:
+    их время и строки входят во внешний вызов. Время iter_* — время
+    получения всех строк итератора, без времени обработки строк
+    вызывающим кодом.
+    """
+
+    def __init__(self, slow_query_threshold=0.1, slow_query_log_size=100,
+                 buckets=LATENCY_BUCKETS, max_queries=500):
+        """
+        Args:
+            slow_query_threshold: запрос дольше стольких секунд (вместе с
+                fetch) пишется в журнал медленных запросов и в лог с планом
+                EXPLAIN QUERY PLAN; None — не вести журнал
+            slow_query_log_size: сколько последних медленных запросов хранить
+            buckets: границы корзин гистограмм времени в секундах
+            max_queries: сколько разных запросов считать по отдельности;
+                остальные складываются под ключом OTHER_QUERIES
+        """
+        self.slow_query_threshold = slow_query_threshold
+        self.buckets = tuple(buckets)
+        self.max_queries = max_queries
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._normalized = {}
+        self._slow_queries = deque(maxlen=slow_query_log_size)
+        self.reset()
+
+    def reset(self):
+        """Обнулить все счетчики и журнал медленных запросов"""
+        with self._lock:
+            self._methods = {}
+            self._queries = {}
+            self._commits = Histogram(self.buckets)
+            self._slow_queries.clear()
+            self._slow_count = 0
+
+    def connect(self, database, **kwargs):
+        """Открыть инструментированное соединение (аргументы как у sqlite3.connect)"""
+        conn = sqlite3.connect(database, factory=InstrumentedConnection, **kwargs)
+        conn.metrics = self
+        conn.set_progress_handler(conn.count_steps, PROGRESS_STEPS)
+        return conn
+
+    def wrap(self, name, function):
+        """Обернуть метод: замер времени, ошибок и строк внешнего вызова"""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(self._local, 'counters', None) is not None:
+                return function(*args, **kwargs)
+            self._local.counters = counters = [0, 0, 0]
+            started = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                self._record_method(name, time.perf_counter() - started, counters, error=True)
+                raise
+            finally:
+                self._local.counters = None
+            elapsed = time.perf_counter() - started
+            if isinstance(result, types.GeneratorType):
+                return self._iterate(name, result, elapsed, counters)
+            self._record_method(name, elapsed, counters)
+            return result
+        return wrapper
+
+    def _iterate(self, name, iterator, elapsed, counters):
+        """Итератор-обертка: время и строки iter_* копятся по шагам"""
+        local, clock, error = self._local, time.perf_counter, False
+        try:
+            while True:
+                previous = getattr(local, 'counters', None)
+                local.counters = counters
+                started = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    elapsed += clock() - started
+                    local.counters = previous
+                yield item
+        finally:
+            iterator.close()
+            self._record_method(name, elapsed, counters, error)
+
+    def _record_method(self, name, elapsed, counters, error=False):
+        with self._lock:
+            stats = self._methods.get(name)
+            if stats is None:
+                stats = self._methods[name] = _Stats(self.buckets)
+            stats.latency.observe(elapsed)
+            stats.rows_read += counters[0]
+            stats.rows_written += counters[1]
+            stats.vm_steps += counters[2]
+            stats.errors += error
+
+    def _normalize(self, sql):
+        """SQL в одну строку: ключ статистики запроса
+
+        Списки параметров переменной длины сворачиваются: IN (?, ?, ?) и
+        VALUES (?, ?), (?, ?) дают IN (...) и VALUES (...), так что пачки
+        разного размера считаются одним запросом.
+        """
+        normalized = self._normalized.get(sql)
+        if normalized is None:
+            normalized = _PLACEHOLDER_GROUP.sub('(...)', ' '.join(sql.split()))
+            normalized = _REPEATED_GROUPS.sub('(...)', normalized)
+            if len(self._normalized) < _NORMALIZED_CACHE_SIZE:
+                self._normalized[sql] = normalized
+        return normalized
+
+    def record_query(self, conn, sql, parameters, elapsed, rows_read, rows_written,
+                     steps, error=False):
+        """Учесть выполненный запрос (вызывается курсором)"""
+        counters = getattr(self._local, 'counters', None)
+        if counters is not None:
+            counters[0] += rows_read
+            counters[1] += rows_written
+            counters[2] += steps
+        key = self._normalize(sql)
+        with self._lock:
+            stats = self._queries.get(key)
+            if stats is None:
+                bucket = key if len(self._queries) < self.max_queries else OTHER_QUERIES
+                stats = self._queries.get(bucket)
+                if stats is None:
+                    stats = self._queries[bucket] = _Stats(self.buckets)
+            stats.latency.observe(elapsed)
+            stats.rows_read += rows_read
+            stats.rows_written += rows_written
+            stats.vm_steps += steps
+            stats.errors += error
+        if self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold:
+            self._log_slow_query(conn, key, sql, parameters, elapsed)
+
+    def record_commit(self, elapsed):
+        with self._lock:
+            self._commits.observe(elapsed)
+
+    def _log_slow_query(self, conn, key, sql, parameters, elapsed):
+        plan = None
+        if parameters is not None:
+            try:
+                # Обычный курсор, чтобы сам EXPLAIN не попал в метрики
+                cursor = sqlite3.Cursor(conn)
+                cursor.row_factory = None
+                plan = [row[3] for row in
+                        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()]
+                cursor.close()
+            except sqlite3.Error:
+                plan = None
+        entry = {
+            'sql': key,
+            'seconds': elapsed,
+            'plan': plan,
+            'at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+        }
+        with self._lock:
+            self._slow_queries.append(entry)
+            self._slow_count += 1
+        logger.warning("Медленный запрос (%.3f с): %s; план: %s", elapsed, key,
+                       '; '.join(plan) if plan else 'нет')
+
+    def to_dict(self):
+        """Снимок метрик
+
+        Returns:
+            dict: methods и queries ({имя или SQL: calls, errors, rows_read,
+                rows_written, vm_steps, latency}), commits (гистограмма),
+                slow_queries (последние медленные запросы: sql, seconds, plan,
+                at) и slow_queries_total. Запросы сверх max_queries
+                считаются вместе под ключом OTHER_QUERIES
+        """
+        with self._lock:
+            return {
+                'methods': {name: stats.to_dict() for name, stats in self._methods.items()},
+                'queries': {sql: stats.to_dict() for sql, stats in self._queries.items()},
+                'commits': self._commits.to_dict(),
+                'slow_queries': list(self._slow_queries),
+                'slow_queries_total': self._slow_count,
+            }
+
+    def to_prometheus(self, prefix='sqlite_lib'):
+        """Метрики в текстовом формате Prometheus (exposition format 0.0.4)
+
+        Текст можно отдать своим HTTP-обработчиком или записать в файл для
+        textfile collector node_exporter.
+        """
+        snapshot = self.to_dict()
+        lines = []
+        for kind, label in (('method', 'method'), ('query', 'query')):
+            groups = snapshot['methods' if kind == 'method' else 'queries']
+            for counter, help_text in (('errors', 'Ошибок'), ('rows_read', 'Прочитано строк'),
+                                       ('rows_written', 'Записано строк'),
+                                       ('vm_steps', 'Шагов виртуальной машины SQLite')):
+                metric = f'{prefix}_{kind}_{counter}_total'
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} counter')
+                for name, stats in groups.items():
+                    lines.append(f'{metric}{{{label}="{_escape(name)}"}} {stats[counter]}')
+            metric = f'{prefix}_{kind}_duration_seconds'
+            lines.append(f'# HELP {metric} Время выполнения')
+            lines.append(f'# TYPE {metric} histogram')
+            for name, stats in groups.items():
+                lines.extend(_histogram_lines(metric, f'{label}="{_escape(name)}"',
+                                              stats['latency']))
+
+        metric = f'{prefix}_commit_duration_seconds'
+        lines.append(f'# HELP {metric} Время коммита')
+        lines.append(f'# TYPE {metric} histogram')
+        lines.extend(_histogram_lines(metric, '', snapshot['commits']))
+
+        metric = f'{prefix}_slow_queries_total'
+        lines.append(f'# HELP {metric} Медленных запросов')
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {snapshot["slow_queries_total"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(metric, labels, histogram):
+    separator = ',' if labels else ''
+    lines = [f'{metric}_bucket{{{labels}{separator}le="{bound}"}} {count}'
+             for bound, count in histogram['buckets'].items()]
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{metric}_sum{suffix} {histogram["sum"]}')
+    lines.append(f'{metric}_count{suffix} {histogram["count"]}')
+    return lines
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение, курсоры которого отчитываются в QueryMetrics"""
+
+    metrics = None
+    steps = 0
+
+    def count_steps(self):
+        self.steps += PROGRESS_STEPS
+        return 0
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    # Connection.execute вызывает execute курсора в обход Python-подкласса
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        self.metrics.record_commit(time.perf_counter() - started)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий запрос от execute до последнего fetch
+
+    Запрос учитывается, когда строки закончились, после fetchall или
+    первого fetchone, при повторном execute, close или удалении курсора.
+    """
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._run(sql, parameters, super().execute, parameters)
+        return self
+
+    def executemany(self, sql, parameters):
+        self._finish()
+        self._run(sql, None, super().executemany, parameters)
+        return self
+
+    def _run(self, sql, plan_parameters, execute, parameters):
+        conn = self.connection
+        steps = conn.steps
+        started = time.perf_counter()
+        try:
+            execute(sql, parameters)
+        except BaseException:
+            conn.metrics.record_query(conn, sql, None, time.perf_counter() - started,
+                                      0, 0, conn.steps - steps, error=True)
+            raise
+        self._sql = sql
+        self._parameters = plan_parameters
+        self._elapsed = time.perf_counter() - started
+        self._steps = conn.steps - steps
+        self._rows = 0
+        if self.description is None:
+            self._finish()
+
+    def _fetch(self, fetch, *args):
+        if self._sql is None:
+            return fetch(*args)
+        conn = self.connection
+        steps = conn.steps
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+            self._steps += conn.steps - steps
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if self._sql is not None:
+            self._rows += row is not None
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._fetch(super().fetchmany, size)
+        if self._sql is not None:
+            self._rows += len(rows)
+            if len(rows) < size or not size:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        if self._sql is not None:
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._fetch(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        if self._sql is not None:
+            self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, self._sql = self._sql, None
+        written = self.rowcount if self.description is None and self.rowcount > 0 else 0
+        conn = self.connection
+        conn.metrics.record_query(conn, sql, self._parameters, self._elapsed,
+                                  self._rows, written, self._steps)
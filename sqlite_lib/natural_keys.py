@@ -0,0 +1,219 @@
+# Натуральные ключи сырых таблиц: кабинет (проект) + fetched_at. Ключ
+# определяет повторную запись того же замера, а не интервал времени: замеры
+# одного кабинета с разным fetched_at — разные строки, даже если они сделаны
+# в один час или один день. Повторный запуск коллектора с тем же fetched_at
+# (свое время замера передает коллектор, см. save_*) не плодит дубликаты, а
+# перезаписывает строку через INSERT ... ON CONFLICT DO UPDATE. Без явного
+# fetched_at время берется текущим с точностью до секунды.
+#
+# Ключ — уникальный индекс (кабинет, fetched_at). Миграция создает его
+# только для таблиц без дубликатов ключа; таблицы с дубликатами пишутся
+# обычным INSERT, пока дубликаты не удалены явным вызовом
+# DataAggregator.deduplicate_raw_rows. При замене строки суточные агрегаты
+# ее дня пересчитываются из сырых строк, поэтому запись пачки стоит
+# O(размер пачки) независимо от размера таблицы.
+
+from . import retention, rollups, snapshots
+
+# Сырая таблица -> колонка кабинета (проекта) в ключе
+NATURAL_KEYS = {
+    'vk_balances': 'vk_cabinet_id',
+    'yandex_balances': 'yandex_cabinet_id',
+    'mt_stats': 'mytracker_project_id',
+}
+
+# Значения колонок, которые перезаписываются при конфликте
+_VALUE_COLUMNS = {
+    'vk_balances': ('balance',),
+    'yandex_balances': ('balance',),
+    'mt_stats': ('registrations', 'first_logins', 'reactivations'),
+}
+
+# Сколько ключей проверять одним запросом (по 2 параметра на ключ)
+_KEYS_PER_QUERY = 400
+
+
+def row_key(row):
+    """Натуральный ключ сырой строки (ключ, значения..., fetched_at)"""
+    return row[0], str(row[-1])
+
+
+def index_name(table):
+    return f'uq_{table}_natural_key'
+
+
+def has_unique_index(conn, table, schema='main'):
+    row = conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'index' AND name = ?",
+        (index_name(table),),
+    ).fetchone()
+    return row is not None
+
+
+def create_unique_index(conn, table, schema='main'):
+    conn.execute(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS {schema}.{index_name(table)} '
+        f'ON {table} ({NATURAL_KEYS[table]}, fetched_at)'
+    )
+
+
+def has_duplicates(conn, table, schema='main'):
+    """Есть ли в таблице строки с одинаковым натуральным ключом"""
+    key_column = NATURAL_KEYS[table]
+    row = conn.execute(f'''
+        SELECT 1 FROM {schema}.{table}
+        GROUP BY {key_column}, fetched_at
+        HAVING COUNT(*) > 1
+        LIMIT 1
+    ''').fetchone()
+    return row is not None
+
+
+def ensure_unique_index(conn, table, schema='main'):
+    """Создать уникальный индекс ключа, если в таблице нет дубликатов
+
+    Строки не удаляются: таблица с дубликатами остается без индекса (см.
+    DataAggregator.deduplicate_raw_rows).
+
+    Returns:
+        bool: есть ли индекс после вызова
+    """
+    if has_unique_index(conn, table, schema):
+        return True
+    if has_duplicates(conn, table, schema):
+        return False
+    create_unique_index(conn, table, schema)
+    return True
+
+
+def columns(table):
+    """Колонки сырой строки: ключ, значения, fetched_at"""
+    return (NATURAL_KEYS[table], *_VALUE_COLUMNS[table], 'fetched_at')
+
+
+def upsert_clause(table, keyed=True):
+    """ON CONFLICT для INSERT в сырую таблицу: строка ключа заменяется новой
+
+    Args:
+        keyed: есть ли у таблицы уникальный индекс ключа; без него
+            конфликт не определен и строка просто добавляется
+    """
+    if not keyed:
+        return ''
+    updates = ', '.join(f'{column} = excluded.{column}' for column in _VALUE_COLUMNS[table])
+    return f'ON CONFLICT ({NATURAL_KEYS[table]}, fetched_at) DO UPDATE SET {updates}'
+
+
+def upsert_sql(table, source, keyed=True):
+    """INSERT сырой строки с заменой строки того же ключа
+
+    Параметры — колонки ключа, значений и fetched_at по порядку.
+    """
+    names = columns(table)
+    return f'''
+        INSERT INTO {source} ({', '.join(names)})
+        VALUES ({', '.join('?' * len(names))})
+        {upsert_clause(table, keyed)}
+    '''
+
+
+def latest_per_key(rows):
+    """Оставить в пачке по одной строке на ключ — записанную последней
+
+    Args:
+        rows: кортежи (ключ, значения..., fetched_at)
+    """
+    latest = {row_key(row): row for row in rows}
+    return list(latest.values()) if len(latest) < len(rows) else rows
+
+
+def existing_keys(conn, table, source, rows):
+    """Ключи (кабинет, fetched_at) из rows, для которых в source уже есть строка
+
+    Поиск идет по индексу (кабинет, fetched_at).
+    """
+    key_column = NATURAL_KEYS[table]
+    keys = list(dict.fromkeys(row_key(row) for row in rows))
+    found = set()
+    for start in range(0, len(keys), _KEYS_PER_QUERY):
+        chunk = keys[start:start + _KEYS_PER_QUERY]
+        values = ', '.join('(?, ?)' for _ in chunk)
+        found.update(conn.execute(f'''
+            WITH batch (key, fetched_at) AS (VALUES {values})
+            SELECT key, fetched_at FROM batch
+            WHERE EXISTS (
+                SELECT 1 FROM {source}
+                WHERE {key_column} = batch.key AND fetched_at = batch.fetched_at
+            )
+        ''', [value for key in chunk for value in key]).fetchall())
+    return found
+
+
+def refresh_days(conn, table, keys, schema=None):
+    """Пересчитать агрегаты дней, в которых строки были заменены или удалены
+
+    Args:
+        keys: пары (кабинет, fetched_at)
+    """
+    days = {(key, str(stamp)[:10]) for key, stamp in keys}
+    if days:
+        rollups.refresh_days(conn, table, days, schema)
+
+
+def _duplicates(conn, table, source, after_rowid, chunk_size):
+    """Лишние строки для ключей строк с rowid в (after_rowid, after_rowid + chunk_size]
+
+    Лишняя — строка, у ключа которой есть строка с большим rowid (записанная
+    позже); сравниваются все строки ключа, а не только строки порции.
+
+    Returns:
+        list: (rowid, ключ, fetched_at)
+    """
+    key_column = NATURAL_KEYS[table]
+    return conn.execute(f'''
+        WITH keys AS (
+            SELECT DISTINCT {key_column} AS key, fetched_at
+            FROM {source}
+            WHERE rowid > ?1 AND rowid <= ?2
+        )
+        SELECT d.rowid, d.{key_column}, d.fetched_at
+        FROM keys
+        JOIN {source} d ON d.{key_column} = keys.key AND d.fetched_at = keys.fetched_at
+        WHERE EXISTS (
+            SELECT 1 FROM {source} o
+            WHERE o.{key_column} = d.{key_column} AND o.fetched_at = d.fetched_at
+              AND o.rowid > d.rowid
+        )
+    ''', (after_rowid, after_rowid + chunk_size)).fetchall()
+
+
+def deduplicate_chunk(conn, table, after_rowid, chunk_size=5000, schema=None, archive=None):
+    """Удалить дубликаты натуральных ключей для одной порции rowid
+
+    Остается строка ключа, записанная последней. Агрегаты затронутых дней
+    пересчитываются, снимки обновляются.
+
+    Args:
+        archive: куда перенести удаленные строки (см. RetentionPolicy.archive);
+            архивная таблица должна существовать (retention.ensure_archive_table)
+
+    Returns:
+        int: сколько строк удалено
+    """
+    source = f'{schema or "main"}.{table}'
+    duplicates = _duplicates(conn, table, source, after_rowid, chunk_size)
+    if not duplicates:
+        return 0
+    rowids = [row[0] for row in duplicates]
+    for start in range(0, len(rowids), _KEYS_PER_QUERY):
+        chunk = rowids[start:start + _KEYS_PER_QUERY]
+        where = f'rowid IN ({", ".join("?" * len(chunk))})'
+        if archive is not None:
+            conn.execute(f'INSERT INTO {retention.archive_table(table, archive)} '
+                         f'SELECT * FROM {source} WHERE {where}', chunk)
+        conn.execute(f'DELETE FROM {source} WHERE {where}', chunk)
+    refresh_days(conn, table, [(key, fetched_at) for _, key, fetched_at in duplicates], schema)
+    # Оставшаяся строка ключа записана последней: при равном fetched_at
+    # upsert_latest заменяет ею снимок, более новый снимок не трогает
+    snapshots.upsert_latest(conn, table, {key for _, key, _ in duplicates}, schema)
+    return len(duplicates)
@@ -0,0 +1,215 @@
+# Помесячные партиции сырых таблиц: строки vk_balances, yandex_balances и
+# mt_stats за месяц лежат в отдельном файле рядом с основной базой, который
+# подключается через ATTACH по мере надобности. Проекты, суточные агрегаты
+# и снимки остаются в основной базе, поэтому запись строки и обновление
+# агрегатов по-прежнему идут одной транзакцией одного соединения.
+#
+# Ограничение SQLite: к соединению подключается не больше 10 баз. Между
+# транзакциями лишние партиции отключаются автоматически; внутри одной
+# транзакции (например, batch()) можно затронуть не больше MAX_ATTACHED
+# месяцев.
+
+import glob
+import os
+import re
+import sqlite3
+from datetime import datetime, timezone
+
+from . import natural_keys
+
+RAW_TABLES = ('vk_balances', 'yandex_balances', 'mt_stats')
+
+# Сколько партиций держать подключенными к одному соединению (одно место
+# из десяти оставлено под архивную базу retention)
+MAX_ATTACHED = 8
+
+_SCHEMA_PREFIX = 'p_'
+
+# Версия схемы файла партиции (PRAGMA user_version партиции); 1 —
+# уникальные индексы натуральных ключей
+PARTITION_VERSION = 1
+
+_RAW_DDL = '''
+CREATE TABLE IF NOT EXISTS {schema}.vk_balances (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vk_cabinet_id TEXT NOT NULL,
+    balance REAL,
+    fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS {schema}.yandex_balances (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    yandex_cabinet_id TEXT NOT NULL,
+    balance REAL,
+    fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS {schema}.mt_stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mytracker_project_id TEXT NOT NULL,
+    registrations INTEGER NOT NULL DEFAULT 0,
+    first_logins INTEGER NOT NULL DEFAULT 0,
+    reactivations INTEGER NOT NULL DEFAULT 0,
+    fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS {schema}.idx_vk_balances_cabinet_fetched_at
+    ON vk_balances (vk_cabinet_id, fetched_at);
+CREATE INDEX IF NOT EXISTS {schema}.idx_vk_balances_fetched_at
+    ON vk_balances (fetched_at);
+CREATE INDEX IF NOT EXISTS {schema}.idx_yandex_balances_cabinet_fetched_at
+    ON yandex_balances (yandex_cabinet_id, fetched_at);
+CREATE INDEX IF NOT EXISTS {schema}.idx_yandex_balances_fetched_at
+    ON yandex_balances (fetched_at);
+CREATE INDEX IF NOT EXISTS {schema}.idx_mt_stats_project_fetched_at
+    ON mt_stats (mytracker_project_id, fetched_at);
+'''
+
+
+def month_of(timestamp):
+    """Месяц партиции 'YYYY_MM' для fetched_at (строка, date или datetime)"""
+    return str(timestamp)[:7].replace('-', '_')
+
+
+def month_bounds(month):
+    """Полуинтервал [первый день месяца, первый день следующего) для fetched_at"""
+    year, number = int(month[:4]), int(month[5:7])
+    next_year, next_number = (year + 1, 1) if number == 12 else (year, number + 1)
+    return f'{year:04d}-{number:02d}-01', f'{next_year:04d}-{next_number:02d}-01'
+
+
+def current_month():
+    return datetime.now(timezone.utc).strftime('%Y_%m')
+
+
+class PartitionStore:
+    """Файлы помесячных партиций одной базы и их подключение к соединениям"""
+
+    def __init__(self, db_path, directory=None, mmap_size=268435456):
+        """
+        Args:
+            db_path: путь к основной базе; файлы партиций называются
+                <имя базы>_YYYY_MM.db
+            directory: каталог партиций (по умолчанию каталог основной базы)
+            mmap_size: mmap_size для закрытых месяцев, которые читатели
+                подключают только на чтение; 0 — без mmap
+        """
+        stem = os.path.splitext(os.path.basename(db_path))[0]
+        self.directory = directory or os.path.dirname(os.path.abspath(db_path))
+        self.prefix = f'{stem}_'
+        self.mmap_size = mmap_size
+        self._pattern = re.compile(re.escape(self.prefix) + r'(\d{4}_\d{2})\.db$')
+        # Месяцы, схема которых уже доведена до PARTITION_VERSION
+        self._upgraded = set()
+
+    def path(self, month):
+        return os.path.join(self.directory, f'{self.prefix}{month}.db')
+
+    def months(self):
+        """Месяцы существующих партиций по возрастанию"""
+        found = []
+        for path in glob.glob(os.path.join(glob.escape(self.directory), f'{glob.escape(self.prefix)}*.db')):
+            match = self._pattern.search(os.path.basename(path))
+            if match:
+                found.append(match.group(1))
+        return sorted(found)
+
+    def months_for_range(self, date_from=None, date_to=None):
+        """Существующие партиции, пересекающиеся с [date_from, date_to)"""
+        first = month_of(date_from) if date_from is not None else None
+        result = []
+        for month in self.months():
+            if first is not None and month < first:
+                continue
+            if date_to is not None and month_bounds(month)[0] >= str(date_to):
+                continue
+            result.append(month)
+        return result
+
+    @staticmethod
+    def schema(month):
+        return f'{_SCHEMA_PREFIX}{month}'
+
+    def attach(self, conn, month, create=False, readonly=False):
+        """Подключить партицию месяца к соединению
+
+        Args:
+            create: создать файл и таблицы партиции, если их нет, и
+                обновить схему старой партиции (см. _upgrade); иначе
+                отсутствующая партиция не подключается
+            readonly: закрытые месяцы подключать только на чтение
+                (file:...?mode=ro, соединение должно быть открыто с uri=True)
+                с mmap. Соединению на запись так подключать нельзя: запись
+                в этот месяц потом не пройдет.
+
+        Returns:
+            str: имя схемы, например 'p_2024_05', или None, если партиции нет
+        """
+        schema = self.schema(month)
+        attached = [row[1] for row in conn.execute('PRAGMA database_list')]
+        if schema in attached:
+            if create:
+                self._upgrade(conn, month, schema)
+            return schema
+
+        path = self.path(month)
+        if not create and not os.path.exists(path):
+            return None
+
+        partitions = [name for name in attached if name.startswith(_SCHEMA_PREFIX)]
+        if len(partitions) >= MAX_ATTACHED and not conn.in_transaction:
+            for name in list(partitions):
+                try:
+                    conn.execute(f'DETACH DATABASE {name}')
+                except sqlite3.OperationalError:
+                    continue  # партицию еще читает открытый курсор
+                partitions.remove(name)
+        if len(partitions) >= MAX_ATTACHED:
+            raise sqlite3.OperationalError(
+                f"К соединению уже подключено {MAX_ATTACHED} партиций; в одной "
+                f"транзакции можно затронуть не больше {MAX_ATTACHED} месяцев"
+            )
+
+        if readonly and not create and month < current_month():
+            uri = 'file:' + path.replace('?', '%3f').replace('#', '%23') + '?mode=ro'
+            conn.execute(f'ATTACH DATABASE ? AS {schema}', (uri,))
+            if self.mmap_size:
+                conn.execute(f'PRAGMA {schema}.mmap_size = {int(self.mmap_size)}')
+        else:
+            conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+            if create:
+                # executescript коммитит открытую транзакцию, поэтому DDL
+                # выполняется по одной команде
+                for statement in _RAW_DDL.format(schema=schema).split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+                self._upgrade(conn, month, schema)
+        return schema
+
+    def _upgrade(self, conn, month, schema):
+        """Довести схему подключенной партиции до PARTITION_VERSION
+
+        Партиции, созданные до натуральных ключей, получают уникальные
+        индексы в текущей транзакции соединения; строки не удаляются, таблица
+        с дубликатами ключа остается без индекса (см.
+        natural_keys.ensure_unique_index).
+        """
+        if month in self._upgraded:
+            return
+        if conn.execute(f'PRAGMA {schema}.user_version').fetchone()[0] < PARTITION_VERSION:
+            for table in RAW_TABLES:
+                natural_keys.ensure_unique_index(conn, table, schema)
+            conn.execute(f'PRAGMA {schema}.user_version = {PARTITION_VERSION}')
+        elif not conn.in_transaction:
+            # Запоминается только закоммиченная версия: обновление в
+            # транзакции может быть отменено
+            self._upgraded.add(month)
+
+    def detach(self, conn, schema):
+        """Отключить партицию, если соединение не в транзакции"""
+        if schema is not None and not conn.in_transaction:
+            conn.execute(f'DETACH DATABASE {schema}')
+
+    def remove(self, month):
+        """Удалить файл партиции (например, опустевшей после retention)"""
+        self._upgraded.discard(month)
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(self.path(month) + suffix):
+                os.remove(self.path(month) + suffix)
@@ -0,0 +1,112 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений SQLite для чтения из нескольких потоков
+
+    Соединения создаются лениво, не больше size одновременно. Перед выдачей
+    простаивающее соединение проверяется запросом SELECT 1 и при ошибке
+    заменяется новым.
+    """
+
+    def __init__(self, connect, size, timeout=30.0):
+        """
+        Args:
+            connect: функция без аргументов, возвращающая новое соединение
+            size: максимальное число соединений в пуле
+            timeout: сколько секунд ждать свободное соединение
+        """
+        if size < 1:
+            raise ValueError("Размер пула должен быть не меньше 1")
+        self.size = size
+        self.timeout = timeout
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._closed = False
+
+    @contextmanager
+    def connection(self):
+        """Взять соединение из пула на время блока with"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Пул соединений закрыт")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(
+                f"Нет свободного соединения в пуле за {self.timeout} с"
+            )
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+            self._slots.release()
+
+    def _checkout(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+        conn = self._connect()
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def _checkin(self, conn):
+        if self._closed:
+            self._discard(conn)
+            return
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+                return
+        self._idle.put(conn)
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        """Текущее состояние пула
+
+        Returns:
+            dict: size, open (создано соединений), idle (свободно)
+        """
+        with self._lock:
+            opened = len(self._connections)
+        return {'size': self.size, 'open': opened, 'idle': self._idle.qsize()}
+
+    def close(self):
+        """Закрыть свободные соединения; занятые закроются при возврате"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
@@ -0,0 +1,228 @@
+# Хранение истории: сырые строки балансов и статистики живут ограниченное
+# время, старые строки сворачиваются в почасовые агрегаты (*_hourly) и, при
+# желании, переносятся в архивные таблицы или в отдельную архивную базу.
+# Суточные агрегаты (*_daily) ведутся при каждой записи и хранятся дольше
+# всего. Все шаги выполняются небольшими порциями: DataAggregator фиксирует
+# каждую порцию отдельной транзакцией, чтобы не блокировать запись надолго.
+
+from . import rollups
+from . import schema as _schema
+
+# Сырая таблица -> таблица почасовых агрегатов
+HOURLY = {
+    'vk_balances': 'vk_balances_hourly',
+    'yandex_balances': 'yandex_balances_hourly',
+    'mt_stats': 'mt_stats_hourly',
+}
+
+# Имя, под которым подключается архивная база (archive='database')
+ARCHIVE_SCHEMA = 'archive'
+ARCHIVE_MODES = (None, 'table', 'database')
+
+# Сколько кабинетов обрабатывать за транзакцию при удалении старых агрегатов
+KEYS_PER_CHUNK = 50
+
+_STATE_DDL = '''
+CREATE TABLE IF NOT EXISTS retention_state (
+    source TEXT PRIMARY KEY,
+    raw_before TEXT NOT NULL
+) WITHOUT ROWID
+'''
+
+
+class RetentionPolicy:
+    """Сроки хранения уровней истории
+
+    Пример: RetentionPolicy(raw_days=30, hourly_days=365) — сырые строки
+    30 дней, почасовые агрегаты год, суточные всегда.
+    """
+
+    def __init__(self, raw_days=30, hourly_days=365, daily_days=None,
+                 archive=None, archive_path=None):
+        """
+        Args:
+            raw_days: сколько дней хранить сырые строки; None — всегда
+            hourly_days: сколько дней хранить почасовые агрегаты; 0 — не
+                вести их вовсе, None — всегда
+            daily_days: сколько дней хранить суточные агрегаты; None — всегда
+            archive: куда переносить удаляемые сырые строки: None — никуда,
+                'table' — в таблицы <таблица>_archive этой же базы,
+                'database' — в одноименные таблицы базы archive_path
+            archive_path: путь к архивной базе для archive='database'
+        """
+        for name, days in (('raw_days', raw_days), ('hourly_days', hourly_days),
+                           ('daily_days', daily_days)):
+            if days is not None and (not isinstance(days, int) or days < 0):
+                raise ValueError(f"{name} должен быть неотрицательным целым или None")
+        if archive not in ARCHIVE_MODES:
+            raise ValueError("archive должен быть None, 'table' или 'database'")
+        if archive == 'database' and not archive_path:
+            raise ValueError("Для archive='database' нужен archive_path")
+        if daily_days is not None and raw_days is not None and daily_days < raw_days:
+            raise ValueError("daily_days не может быть меньше raw_days")
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.daily_days = daily_days
+        self.archive = archive
+        self.archive_path = archive_path
+
+    def __repr__(self):
+        return (f'RetentionPolicy(raw_days={self.raw_days!r}, hourly_days={self.hourly_days!r}, '
+                f'daily_days={self.daily_days!r}, archive={self.archive!r})')
+
+
+def ensure_retention_tables(conn, tables):
+    """Создать таблицы почасовых агрегатов и состояния хранения"""
+    conn.execute(_STATE_DDL)
+    for table in tables:
+        if not _schema.table_exists(conn, HOURLY[table]):
+            rollups.create_aggregate_table(conn, table, HOURLY[table], bucket_column='hour')
+
+
+def archive_table(table, archive):
+    """Полное имя архивной таблицы для сырой таблицы table"""
+    if archive == 'database':
+        return f'{ARCHIVE_SCHEMA}.{table}'
+    return f'main.{table}_archive'
+
+
+def ensure_archive_table(conn, table, archive, source_schema='main'):
+    """Создать архивную таблицу с колонками сырой таблицы"""
+    schema, name = archive_table(table, archive).split('.')
+    if not _schema.table_exists(conn, name, schema):
+        conn.execute(f'CREATE TABLE {schema}.{name} AS SELECT * FROM {source_schema}.{table} WHERE 0')
+
+
+def raw_horizon(conn, table=None):
+    """Граница, до которой сырые строки удалены политикой хранения
+
+    Агрегаты за дни до этой границы нельзя пересчитывать из сырых таблиц.
+
+    Args:
+        table: сырая таблица; None — самая поздняя граница по всем таблицам
+
+    Returns:
+        str 'YYYY-MM-DD' или None, если хранение не применялось
+    """
+    if not _schema.table_exists(conn, 'retention_state'):
+        return None
+    if table is None:
+        row = conn.execute('SELECT MAX(raw_before) FROM retention_state').fetchone()
+    else:
+        row = conn.execute(
+            'SELECT raw_before FROM retention_state WHERE source = ?', (table,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def record_horizon(conn, table, raw_before):
+    """Запомнить границу удаления сырых строк (граница только растет)"""
+    conn.execute('''
+        INSERT INTO retention_state (source, raw_before) VALUES (?, ?)
+        ON CONFLICT (source) DO UPDATE SET
+            raw_before = MAX(raw_before, excluded.raw_before)
+    ''', (table, raw_before))
+
+
+def _merge_expression(column):
+    """Как объединить уже сохраненный почасовой агрегат с новой порцией"""
+    if column == 'last_fetched_at':
+        return 'MAX(last_fetched_at, excluded.last_fetched_at)'
+    if column.startswith('last_'):
+        return (f'CASE WHEN excluded.last_fetched_at >= last_fetched_at '
+                f'THEN excluded.{column} ELSE {column} END')
+    if column.endswith('_min'):
+        return f'MIN(COALESCE({column}, excluded.{column}), COALESCE(excluded.{column}, {column}))'
+    if column.endswith('_max'):
+        return f'MAX(COALESCE({column}, excluded.{column}), COALESCE(excluded.{column}, {column}))'
+    # количества и суммы
+    return f'COALESCE({column} + excluded.{column}, {column}, excluded.{column})'
+
+
+def move_raw_chunk(conn, table, raw_before, hourly_from=None, archive=None, chunk_size=5000,
+                   schema=None):
+    """Свернуть, заархивировать и удалить одну порцию старых сырых строк
+
+    Берутся до chunk_size строк с fetched_at < raw_before в порядке rowid.
+    Строки новее hourly_from сворачиваются в почасовые агрегаты (строки,
+    которые почасовой уровень уже не хранит, не сворачиваются).
+
+    Args:
+        raw_before: граница 'YYYY-MM-DD' для сырых строк
+        hourly_from: граница почасового уровня; None — сворачивать все,
+            False — почасовой уровень не ведется
+        archive: режим архивации (см. RetentionPolicy)
+        schema: подключенная база с сырой таблицей (партиция)
+
+    Returns:
+        int: сколько сырых строк удалено
+    """
+    source = f'{schema or "main"}.{table}'
+    last_rowid = conn.execute(f'''
+        SELECT MAX(rowid) FROM (
+            SELECT rowid FROM {source} WHERE fetched_at < ? ORDER BY rowid LIMIT ?
+        )
+    ''', (raw_before, chunk_size)).fetchone()[0]
+    if last_rowid is None:
+        return 0
+
+    where = 'rowid <= ?2 AND fetched_at < ?1'
+    params = (raw_before, last_rowid)
+
+    if hourly_from is not False:
+        key_column, columns = rollups.aggregate_layout(table)
+        hourly_where = where if hourly_from is None else f'{where} AND fetched_at >= ?3'
+        hourly_params = params if hourly_from is None else params + (hourly_from,)
+        updates = ',\n'.join(f'{column} = {_merge_expression(column)}' for column in columns)
+        conn.execute(f'''
+            INSERT INTO {HOURLY[table]} ({key_column}, hour, {', '.join(columns)})
+            {rollups.aggregate_select(table, hourly_where, rollups.HOUR_BUCKET, schema)}
+            ON CONFLICT ({key_column}, hour) DO UPDATE SET
+            {updates}
+        ''', hourly_params)
+
+    if archive is not None:
+        conn.execute(
+            f'INSERT INTO {archive_table(table, archive)} SELECT * FROM {source} WHERE {where}',
+            params,
+        )
+
+    return conn.execute(f'DELETE FROM {source} WHERE {where}', params).rowcount
+
+
+def aggregate_keys(conn, aggregate_table, key_column):
+    """Все ключи (кабинеты/проекты) таблицы агрегатов"""
+    return [row[0] for row in conn.execute(f'SELECT DISTINCT {key_column} FROM {aggregate_table}')]
+
+
+def trim_aggregates(conn, aggregate_table, key_column, bucket_column, before, keys):
+    """Удалить агрегаты кабинетов keys с меткой интервала раньше before
+
+    Удаление по списку ключей идет поиском по первичному ключу
+    (кабинет, интервал), без полного прохода по таблице.
+
+    Returns:
+        int: сколько строк удалено
+    """
+    placeholders = ', '.join('?' * len(keys))
+    return conn.execute(f'''
+        DELETE FROM {aggregate_table}
+        WHERE {key_column} IN ({placeholders}) AND {bucket_column} < ?
+    ''', (*keys, before)).rowcount
+
+
+def incremental_vacuum(conn, pages):
+    """Вернуть файловой системе до pages свободных страниц
+
+    Работает только при auto_vacuum = INCREMENTAL (см.
+    DataAggregator.enable_incremental_vacuum).
+
+    Returns:
+        int: сколько страниц освобождено
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # PRAGMA выполняется по шагам: без fetchall освобождается одна страница
+    conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
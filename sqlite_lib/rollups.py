@@ -0,0 +1,400 @@
+# Суточные агрегаты (rollup) по сырым таблицам балансов и статистики: для
+# каждого кабинета и дня хранятся количество замеров, сумма, минимум,
+# максимум и последнее значение. DataAggregator обновляет их при каждой
+# записи, поэтому запросы за период читают одну строку на кабинет и день.
+
+# Модуль схемы под другим именем: параметр schema функций — имя схемы ATTACH
+from . import schema as _schema
+
+# Таблицы балансов: сырая таблица -> (колонка кабинета, таблица агрегатов)
+BALANCE_ROLLUPS = {
+    'vk_balances': ('vk_cabinet_id', 'vk_balances_daily'),
+    'yandex_balances': ('yandex_cabinet_id', 'yandex_balances_daily'),
+}
+MT_ROLLUP = 'mt_stats_daily'
+
+_BALANCE_DDL = '''
+CREATE TABLE IF NOT EXISTS {rollup} (
+    {cabinet_column} TEXT NOT NULL,
+    {bucket_column} TEXT NOT NULL,
+    balance_count INTEGER NOT NULL DEFAULT 0,
+    balance_sum REAL,
+    balance_min REAL,
+    balance_max REAL,
+    last_balance REAL,
+    last_fetched_at TEXT,
+    PRIMARY KEY ({cabinet_column}, {bucket_column})
+) WITHOUT ROWID
+'''
+
+_MT_DDL = '''
+CREATE TABLE IF NOT EXISTS {rollup} (
+    mytracker_project_id TEXT NOT NULL,
+    {bucket_column} TEXT NOT NULL,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    registrations_sum INTEGER NOT NULL DEFAULT 0,
+    first_logins_sum INTEGER NOT NULL DEFAULT 0,
+    reactivations_sum INTEGER NOT NULL DEFAULT 0,
+    last_registrations INTEGER,
+    last_first_logins INTEGER,
+    last_reactivations INTEGER,
+    last_fetched_at TEXT,
+    PRIMARY KEY (mytracker_project_id, {bucket_column})
+) WITHOUT ROWID
+'''
+
+# Параметры: ?1 кабинет, ?2 баланс, ?3 fetched_at
+_BALANCE_UPSERT = '''
+INSERT INTO {rollup} (
+    {cabinet_column}, day, balance_count, balance_sum, balance_min, balance_max,
+    last_balance, last_fetched_at
+)
+VALUES (?1, DATE(?3), ?2 IS NOT NULL, ?2, ?2, ?2, ?2, ?3)
+ON CONFLICT ({cabinet_column}, day) DO UPDATE SET
+    balance_count = balance_count + excluded.balance_count,
+    balance_sum = COALESCE(balance_sum + excluded.balance_sum, balance_sum, excluded.balance_sum),
+    balance_min = MIN(COALESCE(balance_min, excluded.balance_min),
+                      COALESCE(excluded.balance_min, balance_min)),
+    balance_max = MAX(COALESCE(balance_max, excluded.balance_max),
+                      COALESCE(excluded.balance_max, balance_max)),
+    last_balance = CASE WHEN excluded.last_fetched_at >= last_fetched_at
+                        THEN excluded.last_balance ELSE last_balance END,
+    last_fetched_at = MAX(last_fetched_at, excluded.last_fetched_at)
+'''
+
+# Параметры: ?1 проект, ?2 регистрации, ?3 первые входы, ?4 реактивации, ?5 fetched_at
+_MT_UPSERT = '''
+INSERT INTO mt_stats_daily (
+    mytracker_project_id, day, row_count, registrations_sum, first_logins_sum,
+    reactivations_sum, last_registrations, last_first_logins, last_reactivations,
+    last_fetched_at
+)
+VALUES (?1, DATE(?5), 1, COALESCE(?2, 0), COALESCE(?3, 0), COALESCE(?4, 0), ?2, ?3, ?4, ?5)
+ON CONFLICT (mytracker_project_id, day) DO UPDATE SET
+    row_count = row_count + 1,
+    registrations_sum = registrations_sum + excluded.registrations_sum,
+    first_logins_sum = first_logins_sum + excluded.first_logins_sum,
+    reactivations_sum = reactivations_sum + excluded.reactivations_sum,
+    last_registrations = CASE WHEN excluded.last_fetched_at >= last_fetched_at
+                              THEN excluded.last_registrations ELSE last_registrations END,
+    last_first_logins = CASE WHEN excluded.last_fetched_at >= last_fetched_at
+                             THEN excluded.last_first_logins ELSE last_first_logins END,
+    last_reactivations = CASE WHEN excluded.last_fetched_at >= last_fetched_at
+                              THEN excluded.last_reactivations ELSE last_reactivations END,
+    last_fetched_at = MAX(last_fetched_at, excluded.last_fetched_at)
+'''
+
+# Интервал агрегирования: выражение над fetched_at, дающее метку интервала
+DAY_BUCKET = 'DATE(fetched_at)'
+HOUR_BUCKET = "strftime('%Y-%m-%d %H:00:00', fetched_at)"
+
+# Пересчет из сырых строк; последнее значение интервала — по fetched_at, при
+# равенстве по rowid (как при инкрементальном обновлении)
+_BALANCE_SELECT = '''
+SELECT
+    {cabinet_column}, day, COUNT(balance), SUM(balance), MIN(balance), MAX(balance),
+    last_balance, MAX(fetched_at)
+FROM (
+    SELECT
+        {cabinet_column},
+        {bucket} AS day,
+        balance,
+        fetched_at,
+        LAST_VALUE(balance) OVER (
+            PARTITION BY {cabinet_column}, {bucket}
+            ORDER BY fetched_at, rowid
+            ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+        ) AS last_balance
+    FROM {table}
+    WHERE {where}
+)
+GROUP BY {cabinet_column}, day
+'''
+
+_MT_SELECT = '''
+SELECT
+    mytracker_project_id, day, COUNT(*),
+    COALESCE(SUM(registrations), 0), COALESCE(SUM(first_logins), 0),
+    COALESCE(SUM(reactivations), 0),
+    last_registrations, last_first_logins, last_reactivations, MAX(fetched_at)
+FROM (
+    SELECT
+        mytracker_project_id,
+        {bucket} AS day,
+        registrations,
+        first_logins,
+        reactivations,
+        fetched_at,
+        LAST_VALUE(registrations) OVER w AS last_registrations,
+        LAST_VALUE(first_logins) OVER w AS last_first_logins,
+        LAST_VALUE(reactivations) OVER w AS last_reactivations
+    FROM {table}
+    WHERE {where}
+    WINDOW w AS (
+        PARTITION BY mytracker_project_id, {bucket}
+        ORDER BY fetched_at, rowid
+        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+    )
+)
+GROUP BY mytracker_project_id, day
+'''
+
+# Колонки агрегатов в порядке SELECT выше (без ключа кабинет/день)
+_COLUMNS = {
+    'vk_balances_daily': ('balance_count', 'balance_sum', 'balance_min', 'balance_max',
+                          'last_balance', 'last_fetched_at'),
+    'yandex_balances_daily': ('balance_count', 'balance_sum', 'balance_min', 'balance_max',
+                              'last_balance', 'last_fetched_at'),
+    'mt_stats_daily': ('row_count', 'registrations_sum', 'first_logins_sum',
+                       'reactivations_sum', 'last_registrations', 'last_first_logins',
+                       'last_reactivations', 'last_fetched_at'),
+}
+
+
+def _sources(conn, schema=None):
+    """Пары (сырая таблица, таблица агрегатов) для таблиц, которые есть в базе
+
+    Args:
+        schema: подключенная база с сырыми таблицами (партиция); по
+            умолчанию основная
+    """
+    pairs = [(table, rollup) for table, (_, rollup) in BALANCE_ROLLUPS.items()]
+    pairs.append(('mt_stats', MT_ROLLUP))
+    return [(table, rollup) for table, rollup in pairs
+            if _schema.table_exists(conn, table, schema or 'main')]
+
+
+def ensure_rollup_tables(conn):
+    """Создать таблицы агрегатов для существующих сырых таблиц
+
+    Returns:
+        list: сырые таблицы, для которых агрегаты созданы впервые
+            (их нужно заполнить через rebuild_rollups).
+    """
+    created = []
+    for table, rollup in _sources(conn):
+        if _schema.table_exists(conn, rollup):
+            continue
+        create_aggregate_table(conn, table, rollup)
+        created.append(table)
+    return created
+
+
+def create_aggregate_table(conn, table, rollup, bucket_column='day'):
+    """Создать таблицу агрегатов сырой таблицы table с ключом (кабинет, bucket_column)"""
+    if table == 'mt_stats':
+        conn.execute(_MT_DDL.format(rollup=rollup, bucket_column=bucket_column))
+    else:
+        conn.execute(_BALANCE_DDL.format(
+            rollup=rollup, cabinet_column=BALANCE_ROLLUPS[table][0], bucket_column=bucket_column
+        ))
+
+
+def aggregate_layout(table):
+    """Ключ и колонки агрегатов сырой таблицы в порядке aggregate_select
+
+    Returns:
+        tuple: (колонка ключа, кортеж колонок агрегатов)
+    """
+    rollup = MT_ROLLUP if table == 'mt_stats' else BALANCE_ROLLUPS[table][1]
+    return _key_column(table), _COLUMNS[rollup]
+
+
+def apply_balance_rows(conn, table, rows):
+    """Учесть в агрегатах новые строки баланса
+
+    Args:
+        table: vk_balances или yandex_balances
+        rows: кортежи (кабинет, баланс, fetched_at)
+    """
+    cabinet_column, rollup = BALANCE_ROLLUPS[table]
+    conn.executemany(
+        _BALANCE_UPSERT.format(rollup=rollup, cabinet_column=cabinet_column), rows
+    )
+
+
+def apply_mt_rows(conn, rows):
+    """Учесть в агрегатах новые строки MyTracker
+
+    Args:
+        rows: кортежи (проект, регистрации, первые входы, реактивации, fetched_at)
+    """
+    conn.executemany(_MT_UPSERT, rows)
+
+
+def _range_filter(column, date_from, date_to):
+    conditions, params = [], []
+    if date_from is not None:
+        conditions.append(f'{column} >= ?')
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append(f'{column} < ?')
+        params.append(date_to)
+    return ' AND '.join(conditions) or '1', params
+
+
+def _key_column(table):
+    return 'mytracker_project_id' if table == 'mt_stats' else BALANCE_ROLLUPS[table][0]
+
+
+def aggregate_select(table, where, bucket=DAY_BUCKET, schema=None):
+    """SELECT, считающий строки агрегатов из сырых строк table по условию where
+
+    Колонки результата: ключ, метка интервала (bucket), затем колонки
+    агрегатов в порядке _COLUMNS.
+
+    Args:
+        schema: подключенная база, где лежит table (партиция)
+    """
+    source = f'{schema}.{table}' if schema else table
+    if table == 'mt_stats':
+        return _MT_SELECT.format(table=source, where=where, bucket=bucket)
+    return _BALANCE_SELECT.format(
+        table=source, cabinet_column=_key_column(table), where=where, bucket=bucket
+    )
+
+
+def _aggregate_select(table, date_from, date_to, schema=None):
+    """SELECT, считающий строки агрегатов из сырой таблицы за [date_from, date_to)"""
+    where, params = _range_filter('fetched_at', date_from, date_to)
+    return aggregate_select(table, where, schema=schema), params
+
+
+def rebuild_rollups(conn, date_from=None, date_to=None, tables=None, schema=None):
+    """Пересчитать агрегаты из сырых строк за дни [date_from, date_to)
+
+    Строки агрегатов в диапазоне удаляются и считаются заново. Без границ
+    пересчитывается вся история.
+
+    Args:
+        date_from, date_to: границы в формате 'YYYY-MM-DD'
+        tables: сырые таблицы для пересчета (по умолчанию все)
+        schema: подключенная база с сырыми таблицами (партиция месяца);
+            агрегаты всегда в основной базе
+
+    Returns:
+        dict: {таблица агрегатов: количество строк в диапазоне после пересчета}
+    """
+    result = {}
+    for table, rollup in _sources(conn, schema):
+        if tables is not None and table not in tables:
+            continue
+        rollup_where, rollup_params = _range_filter('day', date_from, date_to)
+        conn.execute(f'DELETE FROM {rollup} WHERE {rollup_where}', rollup_params)
+
+        select, params = _aggregate_select(table, date_from, date_to, schema)
+        columns = ', '.join((_key_column(table), 'day') + _COLUMNS[rollup])
+        conn.execute(f'INSERT INTO {rollup} ({columns}) {select}', params)
+        result[rollup] = conn.execute(
+            f'SELECT COUNT(*) FROM {rollup} WHERE {rollup_where}', rollup_params
+        ).fetchone()[0]
+    return result
+
+
+# С какого числа пар (кабинет, день) refresh_days пересчитывает их одним
+# запросом, а не по одной
+_SET_REFRESH_DAYS = 64
+
+
+def refresh_days(conn, table, days, schema=None):
+    """Пересчитать агрегаты отдельных кабинетов за отдельные дни
+
+    Нужен, когда сырые строки дня заменены или удалены: инкрементальное
+    обновление умеет только добавлять строки.
+
+    Args:
+        days: пары (кабинет, день 'YYYY-MM-DD')
+        schema: подключенная база с сырыми строками этих дней (партиция)
+    """
+    rollup = MT_ROLLUP if table == 'mt_stats' else BALANCE_ROLLUPS[table][1]
+    key_column = _key_column(table)
+    columns = ', '.join((key_column, 'day') + _COLUMNS[rollup])
+    days = list(days)
+    if len(days) < _SET_REFRESH_DAYS:
+        select = aggregate_select(
+            table, f'{key_column} = ?1 AND fetched_at >= ?2 AND fetched_at < DATE(?2, \'+1 day\')',
+            schema=schema,
+        )
+        for key, day in days:
+            conn.execute(f'DELETE FROM {rollup} WHERE {key_column} = ? AND day = ?', (key, day))
+            conn.execute(f'INSERT INTO {rollup} ({columns}) {select}', (key, day))
+        return
+
+    # Много дней (импорт, удаление дубликатов): пары кладутся во временную
+    # таблицу, и агрегаты пересчитываются двумя запросами на все пары
+    conn.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS refresh_days (
+            key TEXT NOT NULL,
+            day TEXT NOT NULL,
+            PRIMARY KEY (key, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('DELETE FROM temp.refresh_days')
+    conn.executemany('INSERT OR IGNORE INTO temp.refresh_days (key, day) VALUES (?, ?)', days)
+    conn.execute(f'''
+        DELETE FROM {rollup}
+        WHERE ({key_column}, day) IN (SELECT key, day FROM temp.refresh_days)
+    ''')
+    select = aggregate_select(table, f'''
+        {key_column} IN (SELECT key FROM temp.refresh_days)
+        AND fetched_at >= ? AND fetched_at < DATE(?, '+1 day')
+        AND EXISTS (
+            SELECT 1 FROM temp.refresh_days r
+            WHERE r.key = {key_column} AND r.day = substr(fetched_at, 1, 10)
+        )
+    ''', schema=schema)
+    conn.execute(f'INSERT INTO {rollup} ({columns}) {select}',
+                 (min(day for _, day in days), max(day for _, day in days)))
+    conn.execute('DELETE FROM temp.refresh_days')
+
+
+def check_rollups(conn, date_from=None, date_to=None, tolerance=1e-6, schema=None):
+    """Сверить агрегаты с сырыми таблицами за дни [date_from, date_to)
+
+    Эталон считается тем же запросом, что и в rebuild_rollups, и
+    сравнивается с сохраненными агрегатами. schema — как в rebuild_rollups.
+
+    Returns:
+        list: расхождения — словари с ключами table, cabinet_id, day,
+            column, expected, actual. Пустой список, если все сходится.
+    """
+    mismatches = []
+    for table, rollup in _sources(conn, schema):
+        if not _schema.table_exists(conn, rollup):
+            continue
+        key_column = _key_column(table)
+        columns = _COLUMNS[rollup]
+
+        select, params = _aggregate_select(table, date_from, date_to, schema)
+        expected = {(row[0], row[1]): tuple(row[2:]) for row in conn.execute(select, params)}
+
+        rollup_where, rollup_params = _range_filter('day', date_from, date_to)
+        cursor = conn.execute(
+            f'SELECT {key_column}, day, {", ".join(columns)} FROM {rollup} WHERE {rollup_where}',
+            rollup_params,
+        )
+        actual = {(row[0], row[1]): tuple(row[2:]) for row in cursor}
+
+        missing = (None,) * len(columns)
+        for key in sorted(set(expected) | set(actual)):
+            for column, exp, act in zip(columns, expected.get(key, missing),
+                                        actual.get(key, missing)):
+                if _same(exp, act, tolerance):
+                    continue
+                mismatches.append({
+                    'table': rollup,
+                    'cabinet_id': key[0],
+                    'day': key[1],
+                    'column': column,
+                    'expected': exp,
+                    'actual': act,
+                })
+    return mismatches
+
+
+def _same(expected, actual, tolerance):
+    if isinstance(expected, float) or isinstance(actual, float):
+        if expected is None or actual is None:
+            return expected is actual
+        return abs(expected - actual) <= tolerance * max(1.0, abs(expected))
+    return expected == actual
@@ -0,0 +1,233 @@
+# Схема базы и версионные миграции. Версия схемы хранится в PRAGMA
+# user_version: новая база получает все миграции по порядку, существующая —
+# только недостающие. Базы, созданные раньше из внешнего schema.sql
+# (user_version = 0), принимаются как есть: первая миграция создает только
+# отсутствующие таблицы.
+#
+# Миграции выполняются короткими транзакциями: заполнение агрегатов и
+# снимков идет по месяцам и по таблицам с коммитом после каждой порции,
+# каждый индекс строится отдельной транзакцией. В WAL читатели не ждут
+# миграцию; писатели ждут не дольше одной порции. Прерванная миграция
+# безопасно повторяется при следующем запуске: версия записывается только
+# после последней порции.
+#
+# Время хранится текстом UTC 'YYYY-MM-DD HH:MM:SS' (как CURRENT_TIMESTAMP), а
+# не числом секунд: такой текст сортируется так же, как время, поэтому
+# индексы и полуинтервалы fetched_at >= ? AND fetched_at < ? работают без
+# преобразований, границы суток и месяцев — просто префиксы строки, а
+# агрегаты, партиции и хранение истории опираются на этот формат. Переход
+# на числа сэкономил бы около 10 байт на строку ценой перестройки всех
+# таблиц и смены формата для всех потребителей базы.
+
+from collections import namedtuple
+
+from . import natural_keys, partitions, retention, rollups, snapshots
+
+# Индексы, которые библиотека создает и проверяет при старте:
+# (имя индекса, таблица, колонки)
+INDEXES = (
+    ('idx_vk_balances_cabinet_fetched', 'vk_balances', ('vk_cabinet_id', 'fetched_at')),
+    ('idx_yandex_balances_cabinet_fetched', 'yandex_balances', ('yandex_cabinet_id', 'fetched_at')),
+    ('idx_mt_stats_project_fetched', 'mt_stats', ('mytracker_project_id', 'fetched_at')),
+    ('idx_vk_balances_fetched', 'vk_balances', ('fetched_at',)),
+    ('idx_yandex_balances_fetched', 'yandex_balances', ('fetched_at',)),
+    ('idx_projects_vk_cabinet', 'projects', ('vk_cabinet_id',)),
+    ('idx_projects_yandex_cabinet', 'projects', ('yandex_cabinet_id',)),
+    ('idx_projects_mytracker', 'projects', ('mytracker_project_id',)),
+)
+
+# Таблицы проектов и сырых данных; колонки совпадают с прежним schema.sql
+_BASE_DDL = (
+    '''
+    CREATE TABLE IF NOT EXISTS projects (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        vk_cabinet_id TEXT,
+        yandex_cabinet_id TEXT,
+        mytracker_project_id TEXT,
+        is_active INTEGER NOT NULL DEFAULT 1 CHECK (is_active IN (0, 1)),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS vk_balances (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vk_cabinet_id TEXT NOT NULL,
+        balance REAL,
+        fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS yandex_balances (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        yandex_cabinet_id TEXT NOT NULL,
+        balance REAL,
+        fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS mt_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        mytracker_project_id TEXT NOT NULL,
+        registrations INTEGER NOT NULL DEFAULT 0,
+        first_logins INTEGER NOT NULL DEFAULT 0,
+        reactivations INTEGER NOT NULL DEFAULT 0,
+        fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+)
+
+# Сколько строк по rowid проверять на дубликаты за одну транзакцию
+# (DataAggregator.deduplicate_raw_rows)
+DEDUP_CHUNK_SIZE = 5000
+
+Migration = namedtuple('Migration', 'version description apply')
+
+
+def table_exists(conn, table, schema='main'):
+    """Есть ли таблица в схеме schema ('main' или имя ATTACH)"""
+    row = conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def enable_auto_vacuum(conn):
+    """Включить auto_vacuum = INCREMENTAL
+
+    Место, освобожденное apply_retention, можно возвращать через
+    incremental_vacuum. Для новой пустой базы режим действует сразу, для
+    существующей — только после полного VACUUM (см.
+    DataAggregator.enable_incremental_vacuum).
+    """
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+
+def _create_base_tables(conn):
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        enable_auto_vacuum(conn)
+    for statement in _BASE_DDL:
+        conn.execute(statement)
+
+
+def ensure_indexes(conn):
+    """Создать недостающие индексы из INDEXES и пересоздать измененные
+
+    Таблицы, которых еще нет в базе, пропускаются. Каждый индекс строится
+    и коммитится отдельно.
+
+    Returns:
+        list: имена созданных индексов.
+    """
+    created = []
+    for name, table, columns in INDEXES:
+        if not table_exists(conn, table):
+            continue
+        existing = [row[2] for row in conn.execute(f'PRAGMA index_info({name})')]
+        if existing == list(columns):
+            continue
+        if existing:
+            conn.execute(f'DROP INDEX {name}')
+        conn.execute(f'CREATE INDEX {name} ON {table} ({", ".join(columns)})')
+        conn.commit()
+        created.append(name)
+    return created
+
+
+def _raw_months(conn, table):
+    """Месяцы 'YYYY_MM', за которые в сырой таблице есть строки"""
+    first, last = conn.execute(f'SELECT MIN(fetched_at), MAX(fetched_at) FROM {table}').fetchone()
+    if first is None:
+        return []
+    months, month = [], partitions.month_of(first)
+    while month <= partitions.month_of(last):
+        months.append(month)
+        month = partitions.month_of(partitions.month_bounds(month)[1])
+    return months
+
+
+def _create_rollups(conn):
+    """Таблицы суточных агрегатов; новые заполняются помесячными порциями"""
+    for table in rollups.ensure_rollup_tables(conn):
+        conn.commit()
+        for month in _raw_months(conn, table):
+            rollups.rebuild_rollups(conn, *partitions.month_bounds(month), tables=[table])
+            conn.commit()
+
+
+def _create_snapshots(conn):
+    """Таблицы снимков последних значений; каждая заполняется своей транзакцией"""
+    for table in snapshots.ensure_snapshot_tables(conn):
+        conn.commit()
+        snapshots.rebuild_snapshots(conn, tables=[table])
+        conn.commit()
+
+
+def _create_retention_tables(conn):
+    retention.ensure_retention_tables(conn, [
+        table for table in retention.HOURLY if table_exists(conn, table)
+    ])
+
+
+def _create_natural_key_indexes(conn):
+    """Уникальные индексы натуральных ключей для таблиц без дубликатов
+
+    Строки не удаляются: дубликаты, если они есть, удаляются только явным
+    вызовом DataAggregator.deduplicate_raw_rows, который и создает индекс.
+    """
+    for table in natural_keys.NATURAL_KEYS:
+        if table_exists(conn, table):
+            natural_keys.ensure_unique_index(conn, table)
+            conn.commit()
+
+
+MIGRATIONS = (
+    Migration(1, 'таблицы проектов и сырых данных', _create_base_tables),
+    Migration(2, 'индексы по кабинетам и времени', ensure_indexes),
+    Migration(3, 'суточные агрегаты (*_daily)', _create_rollups),
+    Migration(4, 'снимки последних значений (*_latest)', _create_snapshots),
+    Migration(5, 'почасовые агрегаты и состояние хранения', _create_retention_tables),
+    Migration(6, 'натуральные ключи сырых таблиц (кабинет + fetched_at)', _create_natural_key_indexes),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(conn):
+    """Версия схемы базы (PRAGMA user_version); 0 — база без версии"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Применить недостающие миграции по порядку
+
+    Каждая миграция коммитит свои порции сама; номер версии записывается
+    отдельным коммитом после ее последней порции.
+
+    Args:
+        target: до какой версии мигрировать (по умолчанию SCHEMA_VERSION)
+
+    Returns:
+        list: номера примененных миграций
+
+    Raises:
+        RuntimeError: если база новее, чем знает эта версия библиотеки
+    """
+    target = SCHEMA_VERSION if target is None else target
+    current = schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Схема базы версии {current} новее поддерживаемой ({SCHEMA_VERSION}); "
+            f"обновите sqlite_lib"
+        )
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    for migration in MIGRATIONS:
+        if current < migration.version <= target:
+            migration.apply(conn)
+            conn.execute(f'PRAGMA user_version = {int(migration.version)}')
+            conn.commit()
+            applied.append(migration.version)
+    return applied
+
@@ -0,0 +1,271 @@
+# Запросы к нескольким базам сразу: по одному файлу SQLite на группу
+# клиентов. Каждая база открывается отдельным DataAggregator только на
+# чтение (file:...?mode=ro), запросы к базам идут параллельно в пуле потоков
+# или процессов, результаты склеиваются в порядке списка баз.
+#
+# Ошибка одной базы (нет файла, старая схема, битый файл) не прерывает
+# остальные: база попадает в отчет с текстом ошибки, а в общий результат
+# не входит.
+
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .database import DataAggregator, _period_start
+
+# Результат запроса к одной базе; result — None, если запрос упал
+ShardResult = namedtuple('ShardResult', 'db_path result seconds error')
+
+# Методы DataAggregator, которые можно выполнить по всем базам: только
+# чтение, результат — списки и словари (передаются между процессами)
+READ_METHODS = (
+    'get_digest_data',
+    'get_latest_data_for_digest',
+    'get_project_stats_for_period',
+    'get_list_of_projects',
+    'get_all_vk_balances',
+    'get_all_yandex_balances_today',
+)
+
+DIGEST_SECTIONS = ('yandex', 'vk', 'mt')
+
+# Раздел get_project_stats_for_period -> (таблица агрегатов, колонка кабинета)
+_BALANCE_PERIODS = {
+    'vk_balances': ('vk_balances_daily', 'vk_cabinet_id'),
+    'yandex_balances': ('yandex_balances_daily', 'yandex_cabinet_id'),
+}
+
+EXECUTORS = ('thread', 'process')
+
+
+def _plain(value):
+    """sqlite3.Row -> dict рекурсивно: Row нельзя передать в другой процесс"""
+    if isinstance(value, sqlite3.Row):
+        return dict(zip(value.keys(), value))
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+
+def _period_totals(aggregator, vk_cabinet_id, yandex_cabinet_id, mytracker_project_id, days):
+    """Суточные суммы и количества за период на одной базе
+
+    Как DataAggregator.get_project_stats_for_period, но вместо среднего
+    баланса — balance_sum и balance_count: средние разных баз складываются
+    только через них.
+    """
+    date_from = _period_start(days)
+    cabinets = {'vk_balances': vk_cabinet_id, 'yandex_balances': yandex_cabinet_id}
+    totals = {}
+    with aggregator._reader() as conn:
+        for key, (rollup, column) in _BALANCE_PERIODS.items():
+            if cabinets[key]:
+                totals[key] = conn.execute(f'''
+                    SELECT day AS date, balance_sum, balance_count
+                    FROM {rollup}
+                    WHERE {column} = ? AND day >= ?
+                    ORDER BY day
+                ''', (cabinets[key], date_from)).fetchall()
+        if mytracker_project_id:
+            totals['mt_stats'] = conn.execute('''
+                SELECT
+                    day AS date,
+                    registrations_sum AS total_registrations,
+                    first_logins_sum AS total_first_logins,
+                    reactivations_sum AS total_reactivations
+                FROM mt_stats_daily
+                WHERE mytracker_project_id = ? AND day >= ?
+                ORDER BY day
+            ''', (mytracker_project_id, date_from)).fetchall()
+    return totals
+
+
+def _run_shard(db_path, method, args, kwargs, options):
+    """Выполнить метод DataAggregator на одной базе (в потоке или процессе пула)
+
+    Args:
+        method: имя метода DataAggregator или функция модуля, которая
+            получает DataAggregator первым аргументом
+    """
+    started = time.perf_counter()
+    try:
+        aggregator = DataAggregator(db_path, readonly=True, **options)
+        try:
+            call = getattr(aggregator, method) if isinstance(method, str) else method
+            args = args if isinstance(method, str) else (aggregator, *args)
+            result = _plain(call(*args, **kwargs))
+        finally:
+            aggregator.close()
+    except Exception as exc:  # noqa: BLE001 - ошибка базы уходит в отчет
+        return ShardResult(db_path, None, time.perf_counter() - started, repr(exc))
+    return ShardResult(db_path, result, time.perf_counter() - started, None)
+
+
+class ShardedAggregator:
+    """Дайджест и запросы за период по нескольким базам параллельно
+
+    Пример:
+        with ShardedAggregator(['group_a.db', 'group_b.db'], executor='process') as shards:
+            digest, report = shards.get_digest_report()
+            failed = [shard for shard in report if shard['error']]
+    """
+
+    def __init__(self, db_paths, executor='thread', max_workers=None,
+                 profile='read-heavy', partitioned=False):
+        """
+        Args:
+            db_paths: пути к файлам баз
+            executor: 'thread' — пул потоков (SQLite отпускает GIL на время
+                выполнения запроса, дешевый старт); 'process' — пул
+                процессов, масштабируется по ядрам и на обработке строк
+                в Python, но каждый процесс импортирует библиотеку
+            max_workers: размер пула (по умолчанию — по числу баз, но не
+                больше числа ядер)
+            profile: профиль соединений (см. CONNECTION_PROFILES)
+            partitioned: базы хранят сырые строки в помесячных партициях
+        """
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor должен быть одним из: {', '.join(EXECUTORS)}")
+        self.db_paths = list(db_paths)
+        self.executor = executor
+        self._options = {
+            'profile': profile,
+            'partitioned': partitioned,
+            'project_cache_ttl': 0,
+        }
+        pool_class = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+        self._pool = pool_class(
+            max_workers=max_workers or min(len(self.db_paths), os.cpu_count() or 1) or None
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def run(self, method, *args, **kwargs):
+        """Выполнить метод чтения DataAggregator на всех базах
+
+        Args:
+            method: имя метода из READ_METHODS
+            *args, **kwargs: аргументы метода
+
+        Returns:
+            list: ShardResult в порядке db_paths; строки sqlite3.Row
+                заменены словарями
+        """
+        if method not in READ_METHODS:
+            raise ValueError(f"method должен быть одним из: {', '.join(READ_METHODS)}")
+        return self._run(method, args, kwargs)
+
+    def _run(self, method, args, kwargs):
+        futures = [
+            self._pool.submit(_run_shard, db_path, method, args, kwargs, self._options)
+            for db_path in self.db_paths
+        ]
+        results = []
+        for db_path, future in zip(self.db_paths, futures):
+            try:
+                results.append(future.result())
+            except Exception as exc:  # noqa: BLE001 - например, упавший процесс пула
+                results.append(ShardResult(db_path, None, None, repr(exc)))
+        return results
+
+    def get_digest_data(self, icon_path_template='logo/{project}.jpg', days_back=2):
+        """Общий дайджест по всем базам
+
+        Returns:
+            dict: разделы yandex, vk, mt как у DataAggregator.get_digest_data;
+                строки баз идут подряд в порядке db_paths, базы с ошибкой
+                пропускаются (см. get_digest_report)
+        """
+        return self.get_digest_report(icon_path_template, days_back)[0]
+
+    def get_digest_report(self, icon_path_template='logo/{project}.jpg', days_back=2):
+        """Общий дайджест по всем базам и отчет по каждой базе
+
+        Returns:
+            tuple: (дайджест как у get_digest_data, отчет по базам
+                [{'db_path', 'seconds', 'error', 'rows'}, ...], где rows —
+                число строк базы в каждом разделе)
+        """
+        results = self.run('get_digest_data', icon_path_template, days_back)
+        digest = {section: [] for section in DIGEST_SECTIONS}
+        for shard in results:
+            if shard.error is None:
+                for section in DIGEST_SECTIONS:
+                    digest[section].extend(shard.result[section])
+        return digest, [self._report(shard) for shard in results]
+
+    def get_latest_data_for_digest(self):
+        """Последние значения по активным проектам всех баз
+
+        Returns:
+            list: словари строк всех баз подряд; базы с ошибкой пропускаются
+                (см. run(), чтобы узнать, какие)
+        """
+        return [
+            row for shard in self.run('get_latest_data_for_digest') if shard.error is None
+            for row in shard.result
+        ]
+
+    def get_project_stats_for_period(self, vk_cabinet_id=None, yandex_cabinet_id=None,
+                                     mytracker_project_id=None, days=7):
+        """Статистика проекта за период по всем базам
+
+        Данные кабинета могут лежать в нескольких базах: сутки из разных баз
+        складываются так, как их посчитала бы одна база — средний баланс по
+        всем замерам суток, суммы MyTracker — суммой.
+
+        Returns:
+            dict: ключи vk_balances / yandex_balances / mt_stats, как у
+                DataAggregator.get_project_stats_for_period, строки — словари
+                по возрастанию даты
+        """
+        totals = {}
+        for shard in self._run(_period_totals, (vk_cabinet_id, yandex_cabinet_id,
+                                                mytracker_project_id, days), {}):
+            if shard.error is None:
+                for key, rows in shard.result.items():
+                    by_date = totals.setdefault(key, {})
+                    for row in rows:
+                        date = row.pop('date')
+                        if date not in by_date:
+                            by_date[date] = row
+                            continue
+                        for column, value in row.items():
+                            by_date[date][column] = (by_date[date][column] or 0) + (value or 0)
+
+        stats = {}
+        for key, by_date in totals.items():
+            if key == 'mt_stats':
+                stats[key] = [{'date': date, **by_date[date]} for date in sorted(by_date)]
+                continue
+            stats[key] = [
+                {'date': date,
+                 'avg_balance': (by_date[date]['balance_sum'] / by_date[date]['balance_count']
+                                 if by_date[date]['balance_count'] else None)}
+                for date in sorted(by_date)
+            ]
+        return stats
+
+    @staticmethod
+    def _report(shard):
+        rows = None
+        if shard.error is None:
+            rows = {section: len(shard.result[section]) for section in DIGEST_SECTIONS}
+        return {
+            'db_path': shard.db_path,
+            'seconds': shard.seconds,
+            'error': shard.error,
+            'rows': rows,
+        }
+
+    def close(self):
+        """Остановить пул потоков или процессов"""
+        self._pool.shutdown()
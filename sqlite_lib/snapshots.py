@@ -0,0 +1,165 @@
+# Снимки последних значений: для каждого кабинета VK/Yandex и проекта
+# MyTracker хранится самая свежая строка сырой таблицы. DataAggregator
+# обновляет снимки при каждой записи, поэтому чтение последних значений —
+# это один JOIN вместо ORDER BY fetched_at DESC LIMIT 1 по всей истории.
+
+from . import schema as _schema
+
+# Сырая таблица -> (ключ, колонки значений, таблица снимков)
+SNAPSHOTS = {
+    'vk_balances': ('vk_cabinet_id', ('balance',), 'vk_balances_latest'),
+    'yandex_balances': ('yandex_cabinet_id', ('balance',), 'yandex_balances_latest'),
+    'mt_stats': ('mytracker_project_id', ('registrations', 'first_logins', 'reactivations'),
+                 'mt_stats_latest'),
+}
+
+_COLUMN_TYPES = {
+    'balance': 'REAL',
+    'registrations': 'INTEGER',
+    'first_logins': 'INTEGER',
+    'reactivations': 'INTEGER',
+}
+
+
+def ensure_snapshot_tables(conn):
+    """Создать таблицы снимков для существующих сырых таблиц
+
+    Returns:
+        list: сырые таблицы, для которых снимки созданы впервые
+            (их нужно заполнить через rebuild_snapshots).
+    """
+    created = []
+    for table, (key, columns, snapshot) in SNAPSHOTS.items():
+        if not _schema.table_exists(conn, table) or _schema.table_exists(conn, snapshot):
+            continue
+        column_defs = ''.join(f'    {column} {_COLUMN_TYPES[column]},\n' for column in columns)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {snapshot} (
+                {key} TEXT PRIMARY KEY,
+            {column_defs}    fetched_at TEXT NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        created.append(table)
+    return created
+
+
+def apply_rows(conn, table, rows):
+    """Обновить снимки новыми строками сырой таблицы
+
+    Строка заменяет снимок, только если она не старше него; при равном
+    fetched_at побеждает записанная позже.
+
+    Args:
+        table: сырая таблица (vk_balances, yandex_balances, mt_stats)
+        rows: кортежи (ключ, значения..., fetched_at) в порядке колонок SNAPSHOTS
+    """
+    key, columns, snapshot = SNAPSHOTS[table]
+    names = (key, *columns, 'fetched_at')
+    updates = ', '.join(f'{name} = excluded.{name}' for name in (*columns, 'fetched_at'))
+    conn.executemany(f'''
+        INSERT INTO {snapshot} ({', '.join(names)})
+        VALUES ({', '.join('?' * len(names))})
+        ON CONFLICT ({key}) DO UPDATE SET {updates}
+        WHERE excluded.fetched_at >= {snapshot}.fetched_at
+    ''', rows)
+
+
+def _latest_from(conn, table, target, schema, where, params):
+    """Записать в target последние строки table, если они новее сохраненных"""
+    key, columns, _ = SNAPSHOTS[table]
+    names = ', '.join((key, *columns, 'fetched_at'))
+    updates = ', '.join(f'{name} = excluded.{name}' for name in (*columns, 'fetched_at'))
+    source = f'{schema}.{table}' if schema else table
+    conn.execute(f'''
+        INSERT INTO {target} ({names})
+        SELECT {names}
+        FROM (
+            SELECT
+                {names},
+                ROW_NUMBER() OVER (
+                    PARTITION BY {key} ORDER BY fetched_at DESC, rowid DESC
+                ) AS rn
+            FROM {source}
+            WHERE {where}
+        )
+        WHERE rn = 1
+        ON CONFLICT ({key}) DO UPDATE SET {updates}
+        WHERE excluded.fetched_at >= {target}.fetched_at
+    ''', params)
+
+
+def upsert_latest(conn, table, keys, schema=None):
+    """Обновить снимки ключей keys последними строками одной базы
+
+    В отличие от refresh_snapshots снимки не удаляются: строка из schema
+    заменяет снимок, только если она не старше него.
+    """
+    key, _, snapshot = SNAPSHOTS[table]
+    keys = list(keys)
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        _latest_from(conn, table, snapshot, schema, f'{key} IN ({", ".join("?" * len(chunk))})', chunk)
+
+
+def refresh_snapshots(conn, table, keys=None, schemas=(None,)):
+    """Пересчитать снимки из сырой таблицы
+
+    Нужен после удаления сырых строк, которые могли быть последними.
+
+    Args:
+        table: сырая таблица
+        keys: ключи (кабинеты/проекты) для пересчета; None — все
+        schemas: подключенные базы, где лежат сырые строки (партиции);
+            None — основная база
+    """
+    key, _, snapshot = SNAPSHOTS[table]
+    if keys is not None:
+        keys = list(keys)
+        if not keys:
+            return
+        where = f'{key} IN ({", ".join("?" * len(keys))})'
+        params = keys
+    else:
+        where, params = '1', []
+
+    conn.execute(f'DELETE FROM {snapshot} WHERE {where}', params)
+    for schema in schemas:
+        _latest_from(conn, table, snapshot, schema, where, params)
+
+
+def rebuild_snapshots(conn, tables=None):
+    """Пересчитать все снимки (или снимки указанных сырых таблиц)"""
+    for table, (_, _, snapshot) in SNAPSHOTS.items():
+        if tables is not None and table not in tables:
+            continue
+        if _schema.table_exists(conn, table) and _schema.table_exists(conn, snapshot):
+            refresh_snapshots(conn, table)
+
+
+def stage_snapshots(conn, table):
+    """Создать пустую временную копию таблицы снимков (для пересчета по частям)
+
+    Returns:
+        str: имя временной таблицы
+    """
+    key, columns, snapshot = SNAPSHOTS[table]
+    stage = f'temp.{snapshot}_stage'
+    column_defs = ''.join(f'{column} {_COLUMN_TYPES[column]}, ' for column in columns)
+    conn.execute(f'DROP TABLE IF EXISTS {stage}')
+    conn.execute(
+        f'CREATE TABLE {stage} ({key} TEXT PRIMARY KEY, {column_defs}fetched_at TEXT NOT NULL)'
+    )
+    return stage
+
+
+def stage_from(conn, table, stage, schema):
+    """Добавить во временную копию последние строки из базы schema"""
+    _latest_from(conn, table, stage, schema, '1', [])
+
+
+def replace_from_stage(conn, table, stage):
+    """Заменить снимки содержимым временной копии и удалить ее"""
+    _, _, snapshot = SNAPSHOTS[table]
+    conn.execute(f'DELETE FROM {snapshot}')
+    conn.execute(f'INSERT INTO {snapshot} SELECT * FROM {stage}')
+    conn.execute(f'DROP TABLE {stage}')
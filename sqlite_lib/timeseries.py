@@ -0,0 +1,273 @@
+# Колоночные временные ряды для аналитики: метки времени, коды кабинетов и
+# значения лежат в отдельных массивах, а не в списке словарей. Если
+# установлен numpy, колонки — массивы numpy и пересчеты векторизованы;
+# без него используются array.array и обычные циклы с тем же результатом.
+
+import itertools
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # numpy — необязательная зависимость
+    np = None
+
+# Шаг передискретизации в секундах
+FREQUENCIES = {'hour': 3600, 'day': 86400}
+AGGREGATIONS = ('mean', 'sum', 'min', 'max', 'first', 'last', 'count')
+
+
+def _column(values):
+    """Колонка из array.array: numpy-массив поверх того же буфера или сам array"""
+    if np is None:
+        return values
+    if not len(values):
+        return np.array([], dtype=values.typecode)
+    return np.frombuffer(values, dtype=values.typecode)
+
+
+def change_percent(current, previous, exact=False):
+    """Процентное изменение current относительно previous поэлементно
+
+    То же, что DataAggregator._calculate_change, но для целых колонок:
+    при previous == 0 изменение равно 0, результат округлен до сотых.
+
+    Args:
+        exact: округлять встроенным round() и возвращать список — ровно как
+            _calculate_change (np.round на границе .xx5 может дать другую
+            последнюю цифру); при previous == 0 элемент — int 0
+
+    Returns:
+        numpy-массив float64 или array('d'); при exact=True — список
+    """
+    if np is not None:
+        current = np.asarray(current, dtype='float64')
+        previous = np.asarray(previous, dtype='float64')
+        result = np.zeros(len(current))
+        nonzero = (previous != 0) & ~np.isnan(previous)
+        np.divide(current - previous, previous, out=result, where=nonzero)
+        result *= 100
+        if exact:
+            return [round(value, 2) if ok else 0
+                    for value, ok in zip(result.tolist(), nonzero.tolist())]
+        return np.round(result, 2)
+    changes = (round((c - p) / p * 100, 2) if p else 0 for c, p in zip(current, previous))
+    return list(changes) if exact else array('d', changes)
+
+
+class TimeSeries:
+    """Временные ряды нескольких кабинетов в колоночном виде
+
+    Строки отсортированы по кабинету, затем по времени, так что ряд каждого
+    кабинета — непрерывный отрезок колонок.
+
+    Attributes:
+        timestamps: Unix-время (UTC, секунды), int64
+        cabinet_codes: индекс кабинета в cabinets для каждой строки, int32
+        values: значения, float64
+        cabinets: список ID кабинетов (словарь для cabinet_codes, как
+            dictionary-колонка в Arrow)
+    """
+
+    def __init__(self, timestamps, cabinet_codes, values, cabinets):
+        self.timestamps = timestamps
+        self.cabinet_codes = cabinet_codes
+        self.values = values
+        self.cabinets = cabinets
+
+    @classmethod
+    def from_cursor(cls, cursor, chunk_size=10000, cabinets=None):
+        """Заполнить колонки из курсора порциями fetchmany
+
+        Курсор должен отдавать строки (cabinet_id, unix_time, value),
+        отсортированные по кабинету и времени.
+
+        Args:
+            cabinets: заранее известный порядок кабинетов; кабинеты, которых
+                нет в списке, добавляются в конец
+        """
+        cabinets = list(cabinets or ())
+        index = {cabinet: code for code, cabinet in enumerate(cabinets)}
+        timestamps, codes, values = array('q'), array('i'), array('d')
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk_cabinets, chunk_timestamps, chunk_values = zip(*rows)
+            for cabinet in dict.fromkeys(chunk_cabinets):
+                if cabinet not in index:
+                    index[cabinet] = len(cabinets)
+                    cabinets.append(cabinet)
+            codes.extend(map(index.__getitem__, chunk_cabinets))
+            timestamps.extend(chunk_timestamps)
+            values.extend(chunk_values)
+
+        return cls(_column(timestamps), _column(codes), _column(values), cabinets)
+
+    @classmethod
+    def concat(cls, parts):
+        """Склеить ряды, прочитанные по частям (например, по партициям)
+
+        Части идут по возрастанию времени, у каждой следующей список
+        cabinets продолжает список предыдущей. Результат снова отсортирован
+        по кабинету и времени: устойчивая сортировка по коду кабинета
+        сохраняет порядок времени внутри кабинета.
+        """
+        parts = [part for part in parts if len(part)] or parts[-1:]
+        if not parts:
+            return cls(_column(array('q')), _column(array('i')), _column(array('d')), [])
+        if len(parts) == 1:
+            return parts[0]
+        cabinets = parts[-1].cabinets
+        if np is not None:
+            timestamps = np.concatenate([part.timestamps for part in parts])
+            codes = np.concatenate([part.cabinet_codes for part in parts])
+            values = np.concatenate([part.values for part in parts])
+            order = np.argsort(codes, kind='stable')
+            return cls(timestamps[order], codes[order], values[order], cabinets)
+
+        timestamps, codes, values = array('q'), array('i'), array('d')
+        for part in parts:
+            timestamps.extend(part.timestamps)
+            codes.extend(part.cabinet_codes)
+            values.extend(part.values)
+        order = sorted(range(len(codes)), key=codes.__getitem__)
+        return cls(
+            array('q', map(timestamps.__getitem__, order)),
+            array('i', map(codes.__getitem__, order)),
+            array('d', map(values.__getitem__, order)),
+            cabinets,
+        )
+
+    def __len__(self):
+        return len(self.values)
+
+    def cabinet_ids(self):
+        """ID кабинета для каждой строки (раскрытые cabinet_codes)"""
+        if np is not None:
+            return np.asarray(self.cabinets, dtype=object)[self.cabinet_codes] \
+                if len(self) else np.array([], dtype=object)
+        return [self.cabinets[code] for code in self.cabinet_codes]
+
+    def to_dict(self):
+        """Колонки словарем, например для pandas.DataFrame(series.to_dict())"""
+        return {
+            'cabinet_id': self.cabinet_ids(),
+            'timestamp': self.timestamps,
+            'value': self.values,
+        }
+
+    def to_arrow(self):
+        """Таблица pyarrow; кабинеты хранятся dictionary-колонкой без копирования ID
+
+        Raises:
+            ImportError: если pyarrow не установлен
+        """
+        import pyarrow as pa
+
+        return pa.table({
+            'cabinet_id': pa.DictionaryArray.from_arrays(
+                pa.array(self.cabinet_codes, type=pa.int32()), pa.array(self.cabinets)
+            ),
+            'timestamp': pa.array(self.timestamps, type=pa.int64()).cast(pa.timestamp('s', tz='UTC')),
+            'value': pa.array(self.values, type=pa.float64()),
+        })
+
+    def _group_starts(self, step):
+        """Начала групп (кабинет, интервал step) и метки начала интервалов"""
+        if np is not None:
+            buckets = self.timestamps // step
+            changed = (np.diff(self.cabinet_codes) != 0) | (np.diff(buckets) != 0)
+            starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+            return starts, buckets[starts] * step
+        starts, bucket_starts = array('q'), array('q')
+        previous = None
+        for position, (code, timestamp) in enumerate(zip(self.cabinet_codes, self.timestamps)):
+            key = (code, timestamp // step)
+            if key != previous:
+                starts.append(position)
+                bucket_starts.append(key[1] * step)
+                previous = key
+        return starts, bucket_starts
+
+    def resample(self, freq='day', how='mean'):
+        """Передискретизировать ряды каждого кабинета по часам или дням
+
+        Args:
+            freq: 'hour' или 'day' (интервалы по UTC)
+            how: агрегат значений внутри интервала: mean, sum, min, max,
+                first, last или count
+
+        Returns:
+            TimeSeries: одна строка на (кабинет, интервал), timestamp —
+                начало интервала
+        """
+        if freq not in FREQUENCIES:
+            raise ValueError(f"freq должен быть одним из: {', '.join(FREQUENCIES)}")
+        if how not in AGGREGATIONS:
+            raise ValueError(f"how должен быть одним из: {', '.join(AGGREGATIONS)}")
+        if not len(self):
+            return TimeSeries(self.timestamps, self.cabinet_codes, self.values, list(self.cabinets))
+
+        starts, bucket_starts = self._group_starts(FREQUENCIES[freq])
+        codes = self.cabinet_codes[starts] if np is not None else \
+            array('i', (self.cabinet_codes[start] for start in starts))
+        values = self._aggregate(starts, how)
+        return TimeSeries(bucket_starts, codes, values, list(self.cabinets))
+
+    def _aggregate(self, starts, how):
+        values = self.values
+        if np is not None:
+            ends = np.append(starts[1:], len(values))
+            if how == 'first':
+                return values[starts]
+            if how == 'last':
+                return values[ends - 1]
+            if how == 'count':
+                return (ends - starts).astype('float64')
+            if how == 'min':
+                return np.minimum.reduceat(values, starts)
+            if how == 'max':
+                return np.maximum.reduceat(values, starts)
+            sums = np.add.reduceat(values, starts)
+            return sums if how == 'sum' else sums / (ends - starts)
+
+        functions = {
+            'first': lambda group: group[0],
+            'last': lambda group: group[-1],
+            'count': lambda group: float(len(group)),
+            'min': min,
+            'max': max,
+            'sum': sum,
+            'mean': lambda group: sum(group) / len(group),
+        }
+        function = functions[how]
+        ends = itertools.chain(starts[1:], (len(values),))
+        return array('d', (function(values[start:end]) for start, end in zip(starts, ends)))
+
+    def day_over_day(self, how='mean'):
+        """Изменение дневного значения к предыдущему дню, в процентах
+
+        Для каждого кабинета значение дня сравнивается с предыдущим днем,
+        по которому есть данные; у первого дня кабинета изменение 0.
+
+        Args:
+            how: как получить дневное значение (см. resample)
+
+        Returns:
+            TimeSeries: одна строка на (кабинет, день), value — изменение в %
+        """
+        daily = self.resample('day', how)
+        if not len(daily):
+            return daily
+        values, codes = daily.values, daily.cabinet_codes
+        if np is not None:
+            previous = np.concatenate((values[:1], values[:-1]))
+            first_day = np.concatenate(([True], codes[1:] != codes[:-1]))
+            previous[first_day] = values[first_day]
+        else:
+            previous = array('d', values)
+            for position in range(1, len(values)):
+                if codes[position] == codes[position - 1]:
+                    previous[position] = values[position - 1]
+        return TimeSeries(daily.timestamps, codes, change_percent(values, previous), daily.cabinets)
@@ -0,0 +1,283 @@
+# Потоковые импорт и экспорт таблиц в CSV и JSONL и онлайн-копия базы.
+#
+# Файлы читаются и пишутся построчно: в памяти держится одна порция строк,
+# поэтому объем выгрузки ограничен только диском. Формат определяется по
+# расширению (.csv, .jsonl, .ndjson) или задается явно. В CSV первая строка —
+# имена колонок; в JSONL каждая строка — объект {колонка: значение}.
+# Колонки те же, что отдают iter_list_of_projects и iter_balance_history,
+# так что выгрузка загружается обратно без преобразований.
+#
+# Командная строка:
+#     python -m sqlite_lib.transfer export --db marketing_digest.db vk_balances vk.csv
+#     python -m sqlite_lib.transfer import --db marketing_digest.db vk_balances vk.csv
+#     python -m sqlite_lib.transfer backup --db marketing_digest.db backup.db
+# Без --db берется путь из SQLITE_LIB_DB_PATH (см. database.default_db_path).
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+FORMATS = ('csv', 'jsonl')
+
+_EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def _text(value):
+    return None if value is None or value == '' else str(value)
+
+
+def _float(value):
+    return None if value is None or value == '' else float(value)
+
+
+def _int(value):
+    return None if value is None or value == '' else int(value)
+
+
+# Таблица -> ((колонка, преобразование, обязательна ли), ...) в порядке
+# колонок выгрузки
+TABLES = {
+    'projects': (
+        ('id', _int, False),
+        ('name', _text, True),
+        ('vk_cabinet_id', _text, False),
+        ('yandex_cabinet_id', _text, False),
+        ('mytracker_project_id', _text, False),
+        ('is_active', _int, False),
+    ),
+    'vk_balances': (
+        ('vk_cabinet_id', _text, True),
+        ('balance', _float, False),
+        ('fetched_at', _text, True),
+    ),
+    'yandex_balances': (
+        ('yandex_cabinet_id', _text, True),
+        ('balance', _float, False),
+        ('fetched_at', _text, True),
+    ),
+    'mt_stats': (
+        ('mytracker_project_id', _text, True),
+        ('registrations', _int, False),
+        ('first_logins', _int, False),
+        ('reactivations', _int, False),
+        ('fetched_at', _text, True),
+    ),
+}
+
+
+def columns(table):
+    """Имена колонок выгрузки таблицы"""
+    if table not in TABLES:
+        raise ValueError(f"Неизвестная таблица: {table!r}. Доступны: {', '.join(TABLES)}")
+    return tuple(column for column, _, _ in TABLES[table])
+
+
+def detect_format(path, fmt=None):
+    """Формат файла: явно заданный или по расширению"""
+    if fmt is None:
+        if not isinstance(path, (str, os.PathLike)):
+            raise ValueError("Для файлового объекта формат нужно указать явно")
+        fmt = _EXTENSIONS.get(os.path.splitext(os.fspath(path))[1].lower())
+    if fmt not in FORMATS:
+        raise ValueError(f"Формат должен быть одним из: {', '.join(FORMATS)}")
+    return fmt
+
+
+@contextmanager
+def open_text(target, mode):
+    """Открыть путь как текстовый файл UTF-8 или отдать файловый объект как есть"""
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, mode, encoding='utf-8', newline='') as file:
+            yield file
+    else:
+        yield target
+
+
+def _records(file, fmt):
+    """Словари строк файла с номерами строк (для сообщений об ошибках)"""
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(file, 1):
+        if line.strip():
+            yield line_number, json.loads(line)
+
+
+def read_chunks(file, table, fmt, chunk_size=10000):
+    """Читать файл порциями кортежей в порядке columns(table)
+
+    Отсутствующие необязательные колонки становятся None, лишние
+    игнорируются.
+
+    Yields:
+        list: до chunk_size кортежей
+
+    Raises:
+        ValueError: если у строки нет обязательного значения или оно
+            не преобразуется к типу колонки
+    """
+    spec = TABLES[table]
+    chunk = []
+    for line_number, record in _records(file, fmt):
+        row = []
+        for column, convert, required in spec:
+            try:
+                value = convert(record.get(column))
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f"Строка {line_number}: {column}: {exc}") from None
+            if value is None and required:
+                raise ValueError(f"Строка {line_number}: нет значения {column}")
+            row.append(value)
+        chunk.append(tuple(row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_rows(file, table, fmt, rows):
+    """Записать строки (кортежи в порядке columns(table)) в файл
+
+    Returns:
+        int: сколько строк записано
+    """
+    names = columns(table)
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(names)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    for row in rows:
+        file.write(json.dumps(dict(zip(names, row)), ensure_ascii=False))
+        file.write('\n')
+        count += 1
+    return count
+
+
+class _TooManyRestarts(Exception):
+    """Прервать пошаговое копирование, которое все время начинается заново"""
+
+
+def backup_database(source, target_path, pages=1000, sleep=0.05, max_restarts=3):
+    """Онлайн-копия базы через sqlite3.Connection.backup
+
+    Страницы копируются шагами по pages с паузой sleep секунд: между шагами
+    источник не заблокирован, и писатели продолжают работать. Если базу
+    меняет другое соединение, SQLite начинает копирование заново; после
+    max_restarts перезапусков копия снимается одним шагом (в WAL это не
+    мешает писателям, в rollback journal блокирует их на время шага).
+    Копия пишется во временный файл и атомарно подменяет target_path.
+
+    Args:
+        source: соединение с базой-источником
+
+    Returns:
+        dict: {'pages': страниц в копии, 'restarts': перезапусков,
+               'seconds': длительность}
+    """
+    started = time.perf_counter()
+    state = {'remaining': None, 'restarts': 0, 'total': 0}
+
+    def progress(status, remaining, total):
+        # Обычный шаг уменьшает остаток ровно на pages; после перезапуска
+        # остаток снова отсчитывается от начала и может совпасть с прежним
+        previous = state['remaining']
+        if previous is not None and remaining and remaining > previous - pages:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        state['remaining'], state['total'] = remaining, total
+        # backup() сам ждет только после SQLITE_BUSY; пауза между успешными
+        # шагами — здесь, когда блокировка источника уже отпущена
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    temporary = f'{target_path}.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    target = sqlite3.connect(temporary)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        except _TooManyRestarts:
+            source.backup(target, pages=-1)
+            state['total'] = target.execute('PRAGMA page_count').fetchone()[0]
+    except BaseException:
+        target.close()
+        os.remove(temporary)
+        raise
+    target.close()
+    os.replace(temporary, target_path)
+    return {
+        'pages': state['total'],
+        'restarts': state['restarts'],
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def main(argv=None):
+    import argparse
+
+    from .database import DataAggregator
+
+    parser = argparse.ArgumentParser(
+        prog='python -m sqlite_lib.transfer',
+        description='Импорт и экспорт таблиц в CSV/JSONL, онлайн-копия базы',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command in ('import', 'export'):
+        sub = commands.add_parser(command)
+        sub.add_argument('--db', help='путь к базе (по умолчанию SQLITE_LIB_DB_PATH)')
+        sub.add_argument('--format', choices=FORMATS, help='по умолчанию по расширению файла')
+        sub.add_argument('--partitioned', action='store_true')
+        sub.add_argument('table', choices=list(TABLES))
+        sub.add_argument('path', help="файл; '-' — stdin/stdout")
+    commands.choices['import'].add_argument('--keep-indexes', action='store_true',
+                                            help='не перестраивать индексы после импорта')
+    commands.choices['export'].add_argument('--date-from')
+    commands.choices['export'].add_argument('--date-to')
+    backup = commands.add_parser('backup')
+    backup.add_argument('--db', help='путь к базе (по умолчанию SQLITE_LIB_DB_PATH)')
+    backup.add_argument('--partitioned', action='store_true')
+    backup.add_argument('--pages', type=int, default=1000)
+    backup.add_argument('--sleep', type=float, default=0.05)
+    backup.add_argument('target')
+    args = parser.parse_args(argv)
+
+    # Выгрузка и копия только читают: не создают пустой файл, не берут
+    # блокировку записи и не применяют миграции к базе-источнику. backup()
+    # открывает свое соединение, поэтому основное не открывается вовсе
+    aggregator = DataAggregator(args.db, partitioned=args.partitioned,
+                                readonly=args.command != 'import',
+                                lazy=args.command == 'backup')
+    try:
+        if args.command == 'backup':
+            result = aggregator.backup(args.target, pages=args.pages, sleep=args.sleep)
+            print(f"Скопировано страниц: {result['pages']} за {result['seconds']:.1f} с")
+            return
+        fmt = args.format or ('csv' if args.path == '-' else detect_format(args.path))
+        if args.command == 'import':
+            source = sys.stdin if args.path == '-' else args.path
+            count = aggregator.import_rows(args.table, source, fmt,
+                                           rebuild_indexes=not args.keep_indexes)
+            print(f"Загружено строк: {count}", file=sys.stderr)
+        else:
+            target = sys.stdout if args.path == '-' else args.path
+            count = aggregator.export_rows(args.table, target, fmt, args.date_from, args.date_to)
+            print(f"Выгружено строк: {count}", file=sys.stderr)
+    finally:
+        aggregator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Буфер одиночных записей с фоновым сбросом пачками
+
+    Элементы копятся в ограниченной очереди; фоновый поток передает их в
+    flush_func списком, когда набралось flush_rows элементов или прошло
+    flush_interval секунд. Если очередь заполнена, put() ждет, пока фоновый
+    поток ее разгрузит (backpressure).
+
+    Если сброс в фоне упал, элементы не теряются: ошибка пишется в лог, а
+    пачка повторяется при следующем сбросе. Явные flush() и close()
+    пробрасывают ошибку вызывающему. Элементы, которые flush_func отвергла
+    как неисправимые, не повторяются: они пишутся в лог и откладываются в
+    rejected.
+    """
+
+    def __init__(self, flush_func, flush_rows=500, flush_interval=1.0, max_size=10000,
+                 validate=None):
+        """
+        Args:
+            flush_func: функция, получающая список элементов для записи;
+                возвращает список отвергнутых пар (элемент, ошибка) или None
+            flush_rows: сбрасывать, когда в очереди столько элементов
+            flush_interval: сбрасывать не реже, чем раз в столько секунд
+            max_size: максимальный размер очереди
+            validate: функция проверки элемента в put(); бросает исключение,
+                если элемент нельзя записать
+        """
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._flush_func = flush_func
+        self._validate = validate
+        self._queue = queue.Queue(maxsize=max_size)
+        self._retry = []
+        self.rejected = []
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='sqlite-write-behind', daemon=True
+        )
+        self._thread.start()
+
+    def put(self, item, timeout=None):
+        """Поставить элемент в очередь; при заполненной очереди ждать
+
+        Raises:
+            queue.Full: если за timeout секунд место не освободилось
+        """
+        if self._stopped.is_set():
+            raise RuntimeError("Очередь записи закрыта")
+        if self._validate is not None:
+            self._validate(item)
+        if self._queue.full():
+            self._wakeup.set()
+        self._queue.put(item, timeout=timeout)
+        if self._queue.qsize() >= self.flush_rows:
+            self._wakeup.set()
+
+    def qsize(self):
+        return self._queue.qsize() + len(self._retry)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Фоновый сброс очереди записи не удался, повтор при следующем сбросе")
+
+    def flush(self):
+        """Записать все накопленные элементы
+
+        Returns:
+            int: сколько элементов записано
+        """
+        with self._flush_lock:
+            written = 0
+            while True:
+                items = self._retry
+                self._retry = []
+                while True:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not items:
+                    return written
+                try:
+                    rejected = self._flush_func(items) or []
+                except BaseException:
+                    self._retry = items
+                    raise
+                for item, error in rejected:
+                    logger.error("Строка очереди записи отвергнута и отложена: %r (%s)", item, error)
+                self.rejected.extend(rejected)
+                written += len(items) - len(rejected)
+
+    def close(self):
+        """Остановить фоновый поток и записать остаток очереди"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,74 @@
+"""Общие фикстуры тестов: временная база и DataAggregator поверх нее."""
+
+import itertools
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite_lib.database import DataAggregator  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'test.db')
+
+
+@pytest.fixture
+def aggregator(db_path):
+    aggregator = DataAggregator(db_path)
+    yield aggregator
+    aggregator.close()
+
+
+def count_rows(aggregator, table):
+    return aggregator.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def seed(aggregator, projects=20, days=5, samples_per_day=24):
+    """Заполнить базу проектами и историей через публичные методы save_*
+
+    Кабинеты проекта i: vk_i, ya_i, mt_i; каждый десятый проект неактивен.
+    История идет назад от текущих суток (UTC), замеры — равномерно по суткам.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    with aggregator.batch():
+        for i in range(projects):
+            project_id = aggregator.add_project(f'Project {i}', f'vk_{i}', f'ya_{i}', f'mt_{i}')
+            if i % 10 == 9:
+                aggregator.toggle_project_status(project_id, False)
+        step = timedelta(days=1) / samples_per_day
+        for day in range(days):
+            day_start = (now - timedelta(days=day)).replace(hour=0, minute=0, second=0)
+            for sample in range(samples_per_day):
+                fetched_at = (day_start + step * sample).strftime('%Y-%m-%d %H:%M:%S')
+                aggregator.save_vk_balances_bulk(
+                    [{'vk_cabinet_id': f'vk_{i}', 'balance': float(i + sample)}
+                     for i in range(projects)], fetched_at)
+                aggregator.save_yandex_balances_bulk(
+                    [{'login': f'ya_{i}', 'amount': float(i * 2 + sample)}
+                     for i in range(projects)], fetched_at)
+            aggregator.save_mt_stats_bulk(
+                [{'mytracker_project_id': f'mt_{i}', 'registrations': i, 'first_logins': day,
+                  'reactivations': 1} for i in range(projects)],
+                day_start.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+class PollClock:
+    """Метки fetched_at подряд, каждая на секунду позже предыдущей
+
+    Натуральный ключ сырых строк — (кабинет, fetched_at): с текущим временем
+    замеры одного кабинета в одну секунду заменяли бы друг друга. Часы можно
+    делить между потоками: next() у itertools.count атомарен.
+    """
+
+    def __init__(self, start='2024-05-01 00:00:00'):
+        self.start = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+        self._counter = itertools.count()
+
+    def __call__(self):
+        moment = self.start + timedelta(seconds=next(self._counter))
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
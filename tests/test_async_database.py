@@ -0,0 +1,82 @@
+"""AsyncDataAggregator: потоковые iter_*, выгрузка и импорт, flush."""
+
+import asyncio
+
+import pytest
+from conftest import seed
+
+from sqlite_lib.async_database import AsyncDataAggregator
+from sqlite_lib.database import DataAggregator
+
+
+@pytest.fixture
+def seeded_path(db_path):
+    aggregator = DataAggregator(db_path)
+    seed(aggregator, projects=10, days=2, samples_per_day=12)
+    aggregator.close()
+    return db_path
+
+
+async def collect(rows):
+    return [row async for row in rows]
+
+
+@pytest.mark.parametrize('readers', [0, 2])
+def test_iter_methods_match_sync(seeded_path, readers):
+    aggregator = DataAggregator(seeded_path)
+    expected = {
+        'projects': list(aggregator.iter_list_of_projects()),
+        'vk': list(aggregator.iter_all_vk_balances()),
+        'yandex': list(aggregator.iter_yandex_balances_today()),
+        'history': list(aggregator.iter_balance_history('vk_balances', date_from='2000-01-01')),
+        'series': aggregator.get_time_series('vk_balances', date_from='2000-01-01',
+                                             resample='day').to_dict(),
+    }
+    aggregator.close()
+
+    async def main():
+        async with AsyncDataAggregator(seeded_path, readers=readers) as db:
+            return {
+                'projects': await collect(db.iter_list_of_projects(chunk_size=3)),
+                'vk': await collect(db.iter_all_vk_balances(chunk_size=3)),
+                'yandex': await collect(db.iter_yandex_balances_today(chunk_size=3)),
+                'history': await collect(db.iter_balance_history(
+                    'vk_balances', date_from='2000-01-01', chunk_size=7)),
+                'series': (await db.get_time_series('vk_balances', date_from='2000-01-01',
+                                                    resample='day')).to_dict(),
+            }
+
+    assert asyncio.run(main()) == expected
+
+
+def test_early_break_returns_pool_connection(seeded_path):
+    async def main():
+        async with AsyncDataAggregator(seeded_path, readers=1) as db:
+            for _ in range(3):  # в пуле одно соединение: без возврата второй проход зависнет
+                rows = db.iter_balance_history('vk_balances', date_from='2000-01-01',
+                                               chunk_size=2)
+                async for _ in rows:
+                    break
+                await rows.aclose()
+            return await db.get_list_of_projects()
+
+    assert len(asyncio.run(asyncio.wait_for(main(), timeout=30))) == 10
+
+
+def test_export_import_roundtrip(seeded_path, tmp_path):
+    target = str(tmp_path / 'vk.jsonl')
+    copy_path = str(tmp_path / 'copy.db')
+
+    async def main():
+        async with AsyncDataAggregator(seeded_path) as db:
+            exported = await db.export_rows('vk_balances', target)
+        async with AsyncDataAggregator(copy_path) as db:
+            await db.save_vk_balance('vk_extra', 1.0, '2024-05-01 00:00:00')
+            imported = await db.import_rows('vk_balances', target)
+            await db.flush()
+            history = await collect(db.iter_balance_history('vk_balances', date_from='2000-01-01'))
+        return exported, imported, len(history)
+
+    exported, imported, total = asyncio.run(main())
+    assert exported == imported == 10 * 2 * 12
+    assert total == exported + 1
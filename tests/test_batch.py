@@ -0,0 +1,68 @@
+"""batch(): одна транзакция на блок, откат при исключении, промежуточные коммиты."""
+
+import sqlite3
+
+import pytest
+from conftest import PollClock, count_rows
+
+
+def committed_rows(db_path, table):
+    """Строки, видимые другому соединению (только закоммиченные)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_commit_on_exit(aggregator, db_path):
+    clock = PollClock()
+    with aggregator.batch():
+        for _ in range(10):
+            aggregator.save_vk_balance('vk_1', 1.0, clock())
+        assert committed_rows(db_path, 'vk_balances') == 0
+        assert count_rows(aggregator, 'vk_balances') == 10
+    assert committed_rows(db_path, 'vk_balances') == 10
+    assert aggregator.check_rollups() == []
+
+
+def test_rollback_on_exception(aggregator, db_path):
+    clock = PollClock()
+    aggregator.save_vk_balance('vk_1', 1.0, clock())
+    with pytest.raises(RuntimeError):
+        with aggregator.batch():
+            aggregator.add_project('P', vk_cabinet_id='vk_2')
+            aggregator.save_vk_balance('vk_2', 2.0, clock())
+            aggregator.save_mt_stats('mt_2', registrations=5, fetched_at=clock())
+            raise RuntimeError('откат')
+
+    assert committed_rows(db_path, 'vk_balances') == 1
+    assert committed_rows(db_path, 'mt_stats') == 0
+    assert aggregator.get_project_by_vk_cabinet('vk_2') is None
+    assert aggregator.check_rollups() == []
+    latest = aggregator.conn.execute('SELECT vk_cabinet_id FROM vk_balances_latest').fetchall()
+    assert [row[0] for row in latest] == ['vk_1']
+
+
+def test_nested_batch_joins_outer(aggregator, db_path):
+    clock = PollClock()
+    with pytest.raises(RuntimeError):
+        with aggregator.batch():
+            aggregator.save_vk_balance('vk_1', 1.0, clock())
+            with aggregator.batch():
+                aggregator.save_vk_balance('vk_1', 2.0, clock())
+            assert committed_rows(db_path, 'vk_balances') == 0
+            raise RuntimeError('откат')
+    assert committed_rows(db_path, 'vk_balances') == 0
+
+
+def test_flush_rows_commits_intermediately(aggregator, db_path):
+    clock = PollClock()
+    with pytest.raises(RuntimeError):
+        with aggregator.batch(flush_rows=5):
+            for _ in range(12):
+                aggregator.save_yandex_balance('ya_1', 1.0, clock())
+            raise RuntimeError('откат')
+    # Откатываются только строки после последнего промежуточного коммита
+    assert committed_rows(db_path, 'yandex_balances') == 10
+    assert aggregator.check_rollups() == []
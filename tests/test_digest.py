@@ -0,0 +1,33 @@
+"""Изменения дайджеста: векторный расчет совпадает с _calculate_change."""
+
+import random
+
+from sqlite_lib import database, timeseries
+from sqlite_lib.database import DataAggregator
+
+
+def digest_rows(count, seed=1):
+    rnd = random.Random(seed)
+    return [{'current': rnd.choice([None, 0, rnd.uniform(0, 1e5), float(rnd.randint(0, 100))]),
+             'previous': rnd.choice([None, 0, rnd.uniform(0, 1e5), float(rnd.randint(0, 100))]),
+             'days_count': rnd.choice([1, 2])}
+            for _ in range(count)]
+
+
+def test_change_percent_exact_matches_calculate_change():
+    rnd = random.Random(2)
+    current = [rnd.choice([0.0, rnd.uniform(0, 1e4), rnd.randint(0, 50)]) for _ in range(5000)]
+    previous = [rnd.choice([0.0, rnd.uniform(0, 1e4), rnd.randint(0, 50)]) for _ in range(5000)]
+    expected = [DataAggregator._calculate_change(c, p) for c, p in zip(current, previous)]
+    actual = timeseries.change_percent(current, previous, exact=True)
+    assert actual == expected
+    assert [type(value) for value in actual] == [type(value) for value in expected]
+
+
+def test_vectorized_digest_changes_match_loop(monkeypatch):
+    rows = digest_rows(3000)
+    monkeypatch.setattr(database, '_VECTORIZED_DIGEST_ROWS', 10 ** 9)
+    loop = DataAggregator._digest_changes(rows, 'current', 'previous')
+    monkeypatch.setattr(database, '_VECTORIZED_DIGEST_ROWS', 0)
+    vectorized = DataAggregator._digest_changes(rows, 'current', 'previous')
+    assert vectorized == loop
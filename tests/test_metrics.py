@@ -0,0 +1,39 @@
+"""Метрики запросов: ключи не растут с размером пачек, число ключей ограничено."""
+
+from conftest import PollClock
+
+from sqlite_lib.database import DataAggregator
+from sqlite_lib.metrics import OTHER_QUERIES, QueryMetrics
+
+
+def test_placeholder_lists_collapse():
+    metrics = QueryMetrics()
+    assert metrics._normalize('SELECT * FROM t WHERE id IN (?, ?,\n ?)') == \
+        'SELECT * FROM t WHERE id IN (...)'
+    assert metrics._normalize('WITH b (k, f) AS (VALUES (?, ?), (?, ?)) SELECT k FROM b') == \
+        'WITH b (k, f) AS (VALUES (...)) SELECT k FROM b'
+    assert metrics._normalize('SELECT a FROM t WHERE a = ? AND b > ?') == \
+        'SELECT a FROM t WHERE a = ? AND b > ?'
+
+
+def test_bulk_sizes_share_query_keys(db_path):
+    aggregator = DataAggregator(db_path, metrics=True)
+    clock = PollClock()
+    aggregator.save_vk_balances_bulk(
+        [{'vk_cabinet_id': 'vk_0', 'balance': 1.0}], clock())
+    keys = set(aggregator.get_metrics()['queries'])
+    for size in range(2, 30):
+        aggregator.save_vk_balances_bulk(
+            [{'vk_cabinet_id': f'vk_{i}', 'balance': 1.0} for i in range(size)], clock())
+    assert set(aggregator.get_metrics()['queries']) == keys
+    aggregator.close()
+
+
+def test_query_keys_are_capped():
+    metrics = QueryMetrics(max_queries=3)
+    for i in range(10):
+        metrics.record_query(None, f'SELECT {i}', None, 0.001, 1, 0, 0)
+    queries = metrics.to_dict()['queries']
+    assert len(queries) == 4
+    assert queries[OTHER_QUERIES]['calls'] == 7
+    assert f'query="{OTHER_QUERIES}"' in metrics.to_prometheus()
@@ -0,0 +1,87 @@
+"""Натуральные ключи (кабинет, fetched_at): идемпотентная запись и явная дедупликация."""
+
+import sqlite3
+
+from conftest import count_rows
+
+from sqlite_lib import natural_keys
+from sqlite_lib.database import DataAggregator
+
+
+def test_rewrite_of_same_poll_replaces_row(aggregator):
+    fetched_at = '2024-05-01 10:00:00'
+    for _ in range(3):
+        aggregator.save_vk_balances_bulk(
+            [{'vk_cabinet_id': 'vk_1', 'balance': 10.0},
+             {'vk_cabinet_id': 'vk_2', 'balance': 20.0}], fetched_at)
+    aggregator.save_vk_balance('vk_1', 15.0, fetched_at)
+
+    rows = aggregator.conn.execute(
+        'SELECT vk_cabinet_id, balance FROM vk_balances ORDER BY vk_cabinet_id').fetchall()
+    assert [tuple(row) for row in rows] == [('vk_1', 15.0), ('vk_2', 20.0)]
+    assert aggregator.check_rollups() == []
+
+
+def test_polls_in_same_hour_are_kept(aggregator):
+    for minute in range(0, 60, 5):
+        aggregator.save_yandex_balance('ya_1', float(minute), f'2024-05-01 10:{minute:02d}:00')
+    aggregator.save_mt_stats('mt_1', 1, fetched_at='2024-05-01 10:00:00')
+    aggregator.save_mt_stats('mt_1', 2, fetched_at='2024-05-01 10:30:00')
+    assert count_rows(aggregator, 'yandex_balances') == 12
+    assert count_rows(aggregator, 'mt_stats') == 2
+
+
+def legacy_database(db_path):
+    """База до натуральных ключей: схема без user_version и повторы одного замера"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript('''
+        CREATE TABLE vk_balances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vk_cabinet_id TEXT NOT NULL,
+            balance REAL,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO vk_balances (vk_cabinet_id, balance, fetched_at) VALUES
+            ('vk_1', 1.0, '2024-05-01 10:00:00'),
+            ('vk_1', 2.0, '2024-05-01 10:00:00'),
+            ('vk_1', 3.0, '2024-05-01 11:00:00'),
+            ('vk_2', 4.0, '2024-05-01 10:00:00');
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def test_migration_keeps_duplicates(db_path):
+    legacy_database(db_path)
+    aggregator = DataAggregator(db_path)
+    assert count_rows(aggregator, 'vk_balances') == 4
+    assert not natural_keys.has_unique_index(aggregator.conn, 'vk_balances')
+    # Без индекса строки добавляются обычным INSERT
+    aggregator.save_vk_balance('vk_1', 5.0, '2024-05-01 10:00:00')
+    assert count_rows(aggregator, 'vk_balances') == 5
+    assert aggregator.check_rollups() == []
+    aggregator.close()
+
+
+def test_deduplicate_archives_removed_rows(db_path):
+    legacy_database(db_path)
+    aggregator = DataAggregator(db_path)
+    removed = aggregator.deduplicate_raw_rows(archive='table')
+
+    assert removed['vk_balances'] == 1
+    rows = aggregator.conn.execute(
+        'SELECT vk_cabinet_id, balance, fetched_at FROM vk_balances ORDER BY id').fetchall()
+    assert [tuple(row) for row in rows] == [
+        ('vk_1', 2.0, '2024-05-01 10:00:00'),
+        ('vk_1', 3.0, '2024-05-01 11:00:00'),
+        ('vk_2', 4.0, '2024-05-01 10:00:00'),
+    ]
+    archived = aggregator.conn.execute('SELECT balance FROM vk_balances_archive').fetchall()
+    assert [row[0] for row in archived] == [1.0]
+    assert natural_keys.has_unique_index(aggregator.conn, 'vk_balances')
+    assert aggregator.check_rollups() == []
+
+    # После дедупликации повторная запись заменяет строку
+    aggregator.save_vk_balance('vk_1', 9.0, '2024-05-01 10:00:00')
+    assert count_rows(aggregator, 'vk_balances') == 3
+    aggregator.close()
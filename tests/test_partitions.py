@@ -0,0 +1,84 @@
+"""Помесячные партиции: сырые строки в файлах месяцев, агрегаты в основной базе."""
+
+import sqlite3
+
+from conftest import count_rows
+
+from sqlite_lib import partitions
+from sqlite_lib.database import DataAggregator
+
+MONTHS = ('2024-01', '2024-02', '2024-03')
+# Имена партиций месяцев (см. partitions.month_of)
+PARTITIONS = [partitions.month_of(f'{month}-01 00:00:00') for month in MONTHS]
+
+
+def write_months(aggregator):
+    for month in MONTHS:
+        for day in (1, 15):
+            fetched_at = f'{month}-{day:02d} 10:00:00'
+            aggregator.save_vk_balance('vk_1', float(day), fetched_at)
+            aggregator.save_mt_stats('mt_1', registrations=day, fetched_at=fetched_at)
+
+
+def partition_rows(aggregator, month, table):
+    conn = sqlite3.connect(aggregator._partitions.path(month))
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_rows_land_in_month_partitions(db_path):
+    aggregator = DataAggregator(db_path, partitioned=True)
+    aggregator.add_project('P', vk_cabinet_id='vk_1', mytracker_project_id='mt_1')
+    write_months(aggregator)
+
+    assert aggregator._partitions.months() == PARTITIONS
+    assert count_rows(aggregator, 'main.vk_balances') == 0
+    for month in PARTITIONS:
+        assert partition_rows(aggregator, month, 'vk_balances') == 2
+        assert partition_rows(aggregator, month, 'mt_stats') == 2
+
+    history = list(aggregator.iter_balance_history('vk_balances', ['vk_1'], date_from='2024-01-01'))
+    assert len(history) == 6
+    assert aggregator.check_rollups() == []
+    aggregator.close()
+
+
+def test_upsert_within_partition(db_path):
+    aggregator = DataAggregator(db_path, partitioned=True)
+    aggregator.save_vk_balance('vk_1', 1.0, '2024-02-01 10:00:00')
+    aggregator.save_vk_balance('vk_1', 2.0, '2024-02-01 10:00:00')
+    assert partition_rows(aggregator, PARTITIONS[1], 'vk_balances') == 1
+    assert aggregator.check_rollups() == []
+    aggregator.close()
+
+
+def test_delete_project_clears_all_partitions(db_path):
+    aggregator = DataAggregator(db_path, partitioned=True)
+    project_id = aggregator.add_project('P', vk_cabinet_id='vk_1', mytracker_project_id='mt_1')
+    write_months(aggregator)
+    aggregator.delete_project(project_id)
+    for month in PARTITIONS:
+        assert partition_rows(aggregator, month, 'vk_balances') == 0
+        assert partition_rows(aggregator, month, 'mt_stats') == 0
+    assert count_rows(aggregator, 'vk_balances_daily') == 0
+    aggregator.close()
+
+
+def test_move_existing_rows_to_partitions(db_path):
+    aggregator = DataAggregator(db_path)
+    write_months(aggregator)
+    daily = [tuple(row) for row in aggregator.conn.execute(
+        'SELECT * FROM vk_balances_daily ORDER BY 1, 2')]
+    aggregator.close()
+
+    aggregator = DataAggregator(db_path, partitioned=True)
+    moved = aggregator.move_rows_to_partitions()
+    assert moved == {'vk_balances': 6, 'yandex_balances': 0, 'mt_stats': 6}
+    assert count_rows(aggregator, 'main.vk_balances') == 0
+    assert aggregator._partitions.months() == PARTITIONS
+    assert [tuple(row) for row in aggregator.conn.execute(
+        'SELECT * FROM vk_balances_daily ORDER BY 1, 2')] == daily
+    assert aggregator.check_rollups() == []
+    aggregator.close()
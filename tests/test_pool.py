@@ -0,0 +1,99 @@
+"""Режим пула: одновременные чтения и записи из нескольких потоков."""
+
+import random
+import threading
+
+from conftest import PollClock, count_rows, seed
+
+from sqlite_lib.database import DataAggregator
+
+THREADS = 8
+OPS = 150
+
+
+def worker(aggregator, worker_id, clock, written, errors):
+    rnd = random.Random(worker_id)
+    try:
+        for _ in range(OPS):
+            action = rnd.random()
+            if action < 0.25:
+                aggregator.save_vk_balance(f'vk_{rnd.randrange(20)}', rnd.uniform(0, 1000), clock())
+                written['vk_balances'][worker_id] += 1
+            elif action < 0.4:
+                written['yandex_balances'][worker_id] += aggregator.save_yandex_balances_bulk([
+                    {'login': f'ya_{cabinet}', 'amount': rnd.uniform(0, 1000)}
+                    for cabinet in rnd.sample(range(20), 5)
+                ], fetched_at=clock())
+            elif action < 0.5:
+                with aggregator.batch():
+                    for _ in range(3):
+                        aggregator.save_mt_stats(f'mt_{rnd.randrange(20)}', registrations=1,
+                                                 fetched_at=clock())
+                written['mt_stats'][worker_id] += 3
+            elif action < 0.65:
+                aggregator.get_digest_data()
+            elif action < 0.75:
+                aggregator.get_all_yandex_balances_today()
+            elif action < 0.85:
+                aggregator.get_project_by_vk_cabinet(f'vk_{rnd.randrange(20)}')
+            elif action < 0.95:
+                aggregator.get_latest_data_for_digest()
+            else:
+                list(aggregator.iter_balance_history('vk_balances', ['vk_1'], date_from='2000-01-01'))
+    except Exception as exc:  # noqa: BLE001 - собираются все ошибки потоков
+        errors.append((worker_id, repr(exc)))
+
+
+def run_workers(aggregator):
+    clock = PollClock()
+    written = {table: [0] * THREADS for table in ('vk_balances', 'yandex_balances', 'mt_stats')}
+    errors = []
+    threads = [
+        threading.Thread(target=worker, args=(aggregator, n, clock, written, errors))
+        for n in range(THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {table: sum(counts) for table, counts in written.items()}, errors
+
+
+def test_concurrent_reads_and_writes(db_path):
+    aggregator = DataAggregator(db_path, pool_size=4)
+    seed(aggregator, projects=20, days=2, samples_per_day=4)
+    before = {table: count_rows(aggregator, table)
+              for table in ('vk_balances', 'yandex_balances', 'mt_stats')}
+
+    written, errors = run_workers(aggregator)
+
+    assert errors == []
+    for table, count in written.items():
+        assert count_rows(aggregator, table) == before[table] + count, table
+    assert aggregator.check_rollups() == []
+    aggregator.close()
+
+
+def test_second_writer_process_does_not_lock(db_path):
+    """Другое соединение (как второй процесс-коллектор) пишет параллельно с пулом"""
+    aggregator = DataAggregator(db_path, pool_size=4)
+    other = DataAggregator(db_path, pool_size=2)
+    clock = PollClock('2024-06-01 00:00:00')
+    errors = []
+
+    def write_other():
+        try:
+            for i in range(300):
+                other.save_vk_balance('vk_other', float(i), clock())
+        except Exception as exc:  # noqa: BLE001
+            errors.append(repr(exc))
+
+    thread = threading.Thread(target=write_other)
+    thread.start()
+    written, worker_errors = run_workers(aggregator)
+    thread.join()
+
+    assert errors == [] and worker_errors == []
+    assert count_rows(aggregator, 'vk_balances') == written['vk_balances'] + 300
+    other.close()
+    aggregator.close()
@@ -0,0 +1,96 @@
+"""Планы запросов: ни один горячий метод не сканирует сырые таблицы целиком.
+
+SQL, выполненные методом, перехватываются через trace callback и
+прогоняются через DataAggregator.explain_query_plan; в плане не должно
+быть SCAN по vk_balances, yandex_balances или mt_stats.
+"""
+
+import re
+from datetime import datetime, timezone
+
+import pytest
+from conftest import seed
+
+from sqlite_lib.database import DataAggregator
+
+RAW_TABLES = ('vk_balances', 'yandex_balances', 'mt_stats')
+
+TODAY = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+# Имя -> вызов метода на заполненной базе
+HOT_CALLS = {
+    'get_all_vk_balances': lambda db: db.get_all_vk_balances(),
+    'get_all_yandex_balances_today': lambda db: db.get_all_yandex_balances_today(),
+    'get_all_yandex_balances_today_all_rows':
+        lambda db: db.get_all_yandex_balances_today(latest_per_cabinet=False),
+    'get_latest_data_for_digest': lambda db: db.get_latest_data_for_digest(),
+    'get_project_stats_for_period':
+        lambda db: db.get_project_stats_for_period('vk_1', 'ya_1', 'mt_1', days=7),
+    'get_digest_data': lambda db: db.get_digest_data(),
+    'iter_balance_history':
+        lambda db: list(db.iter_balance_history('vk_balances', ['vk_1'], date_from='2000-01-01')),
+    'get_time_series_day':
+        lambda db: db.get_time_series('yandex_balances', ['ya_1', 'ya_2'], resample='day'),
+    'get_time_series_raw':
+        lambda db: db.get_time_series('mt_stats', ['mt_1'], date_from='2000-01-01'),
+    'get_project_by_vk_cabinet': lambda db: db.get_project_by_vk_cabinet('vk_1'),
+    'get_project_by_yandex_cabinet': lambda db: db.get_project_by_yandex_cabinet('ya_1'),
+    'get_project_by_mytracker_id': lambda db: db.get_project_by_mytracker_id('mt_1'),
+    'save_vk_balance': lambda db: db.save_vk_balance('vk_1', 1.0),
+    'save_yandex_balances_bulk':
+        lambda db: db.save_yandex_balances_bulk([{'login': 'ya_1', 'amount': 2.0}]),
+    'save_mt_stats_bulk_replace_for_date': lambda db: db.save_mt_stats_bulk(
+        [{'mytracker_project_id': 'mt_1', 'registrations': 1}],
+        fetched_at=TODAY, replace_for_date=True),
+    'delete_project': lambda db: db.delete_project(1),
+}
+
+
+@pytest.fixture(scope='module')
+def seeded(tmp_path_factory):
+    aggregator = DataAggregator(str(tmp_path_factory.mktemp('plans') / 'plans.db'))
+    seed(aggregator, projects=50, days=10)
+    aggregator.conn.execute('ANALYZE')
+    aggregator.conn.commit()
+    yield aggregator
+    aggregator.close()
+
+
+def capture_statements(aggregator, call):
+    statements = []
+    aggregator.conn.set_trace_callback(statements.append)
+    try:
+        call(aggregator)
+    finally:
+        aggregator.conn.set_trace_callback(None)
+    return [sql for sql in statements
+            if re.match(r'\s*(SELECT|DELETE|UPDATE|WITH|INSERT)', sql, re.IGNORECASE)]
+
+
+def full_scans(aggregator, sql):
+    """Строки плана со SCAN по сырым таблицам"""
+    # Алиасы (vb, yb, ...) раскрываются по FROM/JOIN запроса
+    aliases = dict(re.findall(r'\b(\w+)\s+(?:AS\s+)?(\w+)\s*(?:ON|WHERE|JOIN|\n|$)', sql))
+    scans = []
+    for detail in aggregator.explain_query_plan(sql):
+        match = re.match(r'SCAN (\w+)', detail)
+        if not match:
+            continue
+        name = match.group(1)
+        table = name if name in RAW_TABLES else next(
+            (t for t, alias in aliases.items() if alias == name and t in RAW_TABLES), None)
+        if table:
+            scans.append(detail)
+    return scans
+
+
+def test_indexes_exist(seeded):
+    assert all(seeded.verify_indexes().values())
+
+
+@pytest.mark.parametrize('name', HOT_CALLS)
+def test_no_full_scans(seeded, name):
+    statements = capture_statements(seeded, HOT_CALLS[name])
+    assert statements, f'{name} не выполнил ни одного запроса'
+    scans = {' '.join(sql.split())[:200]: full_scans(seeded, sql) for sql in statements}
+    assert {sql: details for sql, details in scans.items() if details} == {}
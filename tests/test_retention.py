@@ -0,0 +1,72 @@
+"""Хранение истории: свертка старых сырых строк в почасовые агрегаты и архив."""
+
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from conftest import count_rows, seed
+
+from sqlite_lib.retention import RetentionPolicy
+
+RAW_TABLES = ('vk_balances', 'yandex_balances', 'mt_stats')
+
+
+def days_ago(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def table_rows(aggregator, table):
+    return [tuple(row) for row in aggregator.conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2')]
+
+
+@pytest.fixture
+def history(aggregator):
+    seed(aggregator, projects=3, days=20, samples_per_day=4)
+    return aggregator
+
+
+def test_old_raw_rows_move_to_hourly_and_archive(history):
+    before = {table: count_rows(history, table) for table in RAW_TABLES}
+    daily = table_rows(history, 'vk_balances_daily')
+
+    result = history.apply_retention(RetentionPolicy(raw_days=5, archive='table'))
+
+    horizon = days_ago(5)
+    for table in RAW_TABLES:
+        stats = result['tables'][table]
+        assert stats['raw_deleted'] > 0
+        assert stats['archived'] == stats['raw_deleted']
+        assert count_rows(history, table) == before[table] - stats['raw_deleted']
+        assert count_rows(history, f'{table}_archive') == stats['raw_deleted']
+        oldest = history.conn.execute(f'SELECT MIN(fetched_at) FROM {table}').fetchone()[0]
+        assert oldest >= horizon
+    hourly = history.conn.execute('SELECT SUM(balance_count) FROM vk_balances_hourly').fetchone()[0]
+    assert hourly == result['tables']['vk_balances']['raw_deleted']
+    # Суточные агрегаты ведутся при записи и не меняются
+    assert table_rows(history, 'vk_balances_daily') == daily
+    assert history.check_rollups() == []
+
+
+def test_retention_is_idempotent(history):
+    history.apply_retention(RetentionPolicy(raw_days=5))
+    again = history.apply_retention(RetentionPolicy(raw_days=5))
+    assert all(stats['raw_deleted'] == 0 for stats in again['tables'].values())
+
+
+def test_hourly_rows_expire(history):
+    history.apply_retention(RetentionPolicy(raw_days=5, hourly_days=10))
+    oldest = history.conn.execute('SELECT MIN(hour) FROM vk_balances_hourly').fetchone()[0]
+    assert oldest >= days_ago(10)
+    # Период длиннее сырой истории по-прежнему читается из суточных агрегатов
+    stats = history.get_project_stats_for_period('vk_1', days=15)
+    assert len(stats['vk_balances']) == 16
+
+
+def test_archive_database(history, tmp_path):
+    archive_path = str(tmp_path / 'archive.db')
+    result = history.apply_retention(
+        RetentionPolicy(raw_days=5, archive='database', archive_path=archive_path))
+    conn = sqlite3.connect(archive_path)
+    archived = conn.execute('SELECT COUNT(*) FROM vk_balances').fetchone()[0]
+    conn.close()
+    assert archived == result['tables']['vk_balances']['raw_deleted'] > 0
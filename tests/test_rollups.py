@@ -0,0 +1,73 @@
+"""Суточные агрегаты (*_daily) согласованы с сырыми строками после любых записей."""
+
+from conftest import seed
+
+
+def daily_balances(aggregator, cabinet):
+    rows = aggregator.conn.execute('''
+        SELECT day, balance_count, balance_sum, balance_min, balance_max, last_balance
+        FROM vk_balances_daily WHERE vk_cabinet_id = ? ORDER BY day
+    ''', (cabinet,)).fetchall()
+    return [tuple(row) for row in rows]
+
+
+def test_rollups_follow_inserts(aggregator):
+    aggregator.save_vk_balance('vk_1', 10.0, '2024-05-01 09:00:00')
+    aggregator.save_vk_balance('vk_1', 30.0, '2024-05-01 18:00:00')
+    aggregator.save_vk_balance('vk_1', 20.0, '2024-05-01 12:00:00')
+    aggregator.save_vk_balance('vk_1', 5.0, '2024-05-02 00:00:00')
+    assert daily_balances(aggregator, 'vk_1') == [
+        ('2024-05-01', 3, 60.0, 10.0, 30.0, 30.0),
+        ('2024-05-02', 1, 5.0, 5.0, 5.0, 5.0),
+    ]
+    assert aggregator.check_rollups() == []
+
+
+def test_rollups_follow_replacement(aggregator):
+    aggregator.save_vk_balance('vk_1', 10.0, '2024-05-01 09:00:00')
+    aggregator.save_vk_balance('vk_1', 30.0, '2024-05-01 18:00:00')
+    aggregator.save_vk_balance('vk_1', 1.0, '2024-05-01 18:00:00')
+    assert daily_balances(aggregator, 'vk_1') == [('2024-05-01', 2, 11.0, 1.0, 10.0, 1.0)]
+
+    aggregator.save_mt_stats_bulk(
+        [{'mytracker_project_id': 'mt_1', 'registrations': 5}], '2024-05-01 08:00:00')
+    aggregator.save_mt_stats_bulk(
+        [{'mytracker_project_id': 'mt_1', 'registrations': 7}], '2024-05-01',
+        replace_for_date=True)
+    row = aggregator.conn.execute(
+        'SELECT row_count, registrations_sum FROM mt_stats_daily').fetchone()
+    assert tuple(row) == (1, 7)
+    assert aggregator.check_rollups() == []
+
+
+def test_rollups_follow_delete_project(aggregator):
+    seed(aggregator, projects=3, days=2, samples_per_day=4)
+    aggregator.delete_project(aggregator.get_project_by_vk_cabinet('vk_1')['id'])
+    for table, key, cabinet in (('vk_balances_daily', 'vk_cabinet_id', 'vk_1'),
+                                ('yandex_balances_daily', 'yandex_cabinet_id', 'ya_1'),
+                                ('mt_stats_daily', 'mytracker_project_id', 'mt_1')):
+        count = aggregator.conn.execute(
+            f'SELECT COUNT(*) FROM {table} WHERE {key} = ?', (cabinet,)).fetchone()[0]
+        assert count == 0, table
+    assert aggregator.check_rollups() == []
+
+
+def test_rebuild_after_manual_edit(aggregator):
+    seed(aggregator, projects=3, days=3, samples_per_day=4)
+    aggregator.conn.execute("UPDATE vk_balances SET balance = balance + 1 WHERE vk_cabinet_id = 'vk_0'")
+    aggregator.conn.commit()
+    assert aggregator.check_rollups() != []
+    aggregator.rebuild_rollups()
+    assert aggregator.check_rollups() == []
+
+
+def test_period_stats_match_raw_rows(aggregator):
+    seed(aggregator, projects=3, days=5, samples_per_day=6)
+    stats = aggregator.get_project_stats_for_period('vk_1', 'ya_1', 'mt_1', days=3)
+    expected = aggregator.conn.execute('''
+        SELECT DATE(fetched_at) AS date, AVG(balance) AS avg_balance FROM vk_balances
+        WHERE vk_cabinet_id = 'vk_1' AND fetched_at >= DATE('now', '-3 days')
+        GROUP BY DATE(fetched_at) ORDER BY date
+    ''').fetchall()
+    assert [(row['date'], row['avg_balance']) for row in stats['vk_balances']] == [
+        (row['date'], row['avg_balance']) for row in expected]
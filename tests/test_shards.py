@@ -0,0 +1,79 @@
+"""ShardedAggregator: результат в форме DataAggregator и склейка суток по базам."""
+
+from datetime import datetime, timezone
+
+import pytest
+from conftest import seed
+
+from sqlite_lib.database import DataAggregator
+from sqlite_lib.shards import ShardedAggregator
+
+
+def today(hour):
+    return datetime.now(timezone.utc).strftime(f'%Y-%m-%d {hour:02d}:00:00')
+
+
+@pytest.fixture
+def shard_paths(tmp_path):
+    paths = []
+    for shard in range(2):
+        path = str(tmp_path / f'shard_{shard}.db')
+        aggregator = DataAggregator(path)
+        seed(aggregator, projects=3, days=2, samples_per_day=2)
+        aggregator.close()
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_digest_has_single_database_shape(shard_paths, executor):
+    with ShardedAggregator(shard_paths, executor=executor) as shards:
+        digest = shards.get_digest_data()
+        combined, report = shards.get_digest_report()
+    assert set(digest) == {'yandex', 'vk', 'mt'}
+    assert combined == digest
+    assert [shard['error'] for shard in report] == [None, None]
+
+    expected = {'yandex': [], 'vk': [], 'mt': []}
+    for path in shard_paths:
+        aggregator = DataAggregator(path)
+        for section, rows in aggregator.get_digest_data().items():
+            expected[section].extend(rows)
+        aggregator.close()
+    assert digest == expected
+
+
+def test_period_stats_merge_cabinet_split_across_shards(tmp_path):
+    paths = [str(tmp_path / 'a.db'), str(tmp_path / 'b.db')]
+    first = DataAggregator(paths[0])
+    first.save_vk_balance('vk_x', 10.0, today(1))
+    first.save_vk_balance('vk_x', 20.0, today(2))
+    first.save_mt_stats('mt_x', registrations=3, first_logins=1, fetched_at=today(1))
+    first.close()
+    second = DataAggregator(paths[1])
+    second.save_vk_balance('vk_x', 60.0, today(3))
+    second.save_vk_balance('vk_x', 5.0, '2000-01-01 00:00:00')
+    second.save_mt_stats('mt_x', registrations=4, reactivations=2, fetched_at=today(2))
+    second.close()
+
+    with ShardedAggregator(paths) as shards:
+        stats = shards.get_project_stats_for_period('vk_x', mytracker_project_id='mt_x', days=3)
+
+    date = today(0)[:10]
+    # Среднее по всем замерам суток, а не среднее средних баз
+    assert stats['vk_balances'] == [{'date': date, 'avg_balance': 30.0}]
+    assert stats['mt_stats'] == [{'date': date, 'total_registrations': 7,
+                                  'total_first_logins': 1, 'total_reactivations': 2}]
+
+
+def test_period_stats_sorted_by_date(tmp_path):
+    paths = [str(tmp_path / 'a.db'), str(tmp_path / 'b.db')]
+    for path, days in zip(paths, (1, 5)):
+        aggregator = DataAggregator(path)
+        seed(aggregator, projects=2, days=days, samples_per_day=2)
+        aggregator.close()
+    with ShardedAggregator(paths) as shards:
+        stats = shards.get_project_stats_for_period('vk_1', 'ya_1', 'mt_1', days=7)
+    for rows in stats.values():
+        dates = [row['date'] for row in rows]
+        assert dates == sorted(set(dates))
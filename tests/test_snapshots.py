@@ -0,0 +1,54 @@
+"""Снимки последних значений (*_latest) совпадают с самой свежей сырой строкой."""
+
+from conftest import seed
+
+
+def snapshot(aggregator, table, key, cabinet):
+    row = aggregator.conn.execute(
+        f'SELECT * FROM {table}_latest WHERE {key} = ?', (cabinet,)).fetchone()
+    return dict(row) if row is not None else None
+
+
+def test_snapshot_keeps_newest_row(aggregator):
+    aggregator.save_yandex_balance('ya_1', 1.0, '2024-05-01 10:00:00')
+    aggregator.save_yandex_balance('ya_1', 2.0, '2024-05-01 12:00:00')
+    # Запоздавший старый замер не вытесняет более новый
+    aggregator.save_yandex_balance('ya_1', 3.0, '2024-05-01 11:00:00')
+    assert snapshot(aggregator, 'yandex_balances', 'yandex_cabinet_id', 'ya_1') == {
+        'yandex_cabinet_id': 'ya_1', 'balance': 2.0, 'fetched_at': '2024-05-01 12:00:00'}
+
+    # Перезапись того же замера обновляет снимок
+    aggregator.save_yandex_balance('ya_1', 4.0, '2024-05-01 12:00:00')
+    assert snapshot(aggregator, 'yandex_balances', 'yandex_cabinet_id', 'ya_1')['balance'] == 4.0
+
+
+def test_latest_data_for_digest_matches_raw(aggregator):
+    seed(aggregator, projects=10, days=3, samples_per_day=4)
+    latest = {row['name']: dict(row) for row in aggregator.get_latest_data_for_digest()}
+    for row in aggregator.get_list_of_projects():
+        if not row['is_active']:
+            assert row['name'] not in latest
+            continue
+        expected = aggregator.conn.execute('''
+            SELECT balance FROM vk_balances WHERE vk_cabinet_id = ?
+            ORDER BY fetched_at DESC LIMIT 1
+        ''', (row['vk_cabinet_id'],)).fetchone()[0]
+        assert latest[row['name']]['vk_balance'] == expected
+
+
+def test_snapshot_follows_delete_project(aggregator):
+    seed(aggregator, projects=3, days=1, samples_per_day=2)
+    aggregator.delete_project(aggregator.get_project_by_mytracker_id('mt_2')['id'])
+    assert snapshot(aggregator, 'mt_stats', 'mytracker_project_id', 'mt_2') is None
+    assert snapshot(aggregator, 'mt_stats', 'mytracker_project_id', 'mt_1') is not None
+
+
+def test_rebuild_snapshots_after_manual_edit(aggregator):
+    aggregator.save_vk_balance('vk_1', 1.0, '2024-05-01 10:00:00')
+    aggregator.conn.execute(
+        "INSERT INTO vk_balances (vk_cabinet_id, balance, fetched_at) "
+        "VALUES ('vk_1', 9.0, '2024-05-02 10:00:00')")
+    aggregator.conn.commit()
+    assert snapshot(aggregator, 'vk_balances', 'vk_cabinet_id', 'vk_1')['balance'] == 1.0
+    aggregator.rebuild_snapshots()
+    assert snapshot(aggregator, 'vk_balances', 'vk_cabinet_id', 'vk_1')['balance'] == 9.0
@@ -0,0 +1,87 @@
+import threading
+
+from conftest import count_rows
+
+from sqlite_lib.database import DataAggregator
+
+
+def stamp(second):
+    return f'2024-05-01 10:{second // 60:02d}:{second % 60:02d}'
+
+
+def run_with_timeout(func, timeout=10):
+    """Выполнить func в отдельном потоке; False, если не успела (взаимоблокировка)"""
+    errors = []
+
+    def target():
+        try:
+            func()
+        except BaseException as exc:  # noqa: BLE001 - передается в тест
+            errors.append(exc)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if errors:
+        raise errors[0]
+    return not thread.is_alive()
+
+
+def test_batch_does_not_deadlock_on_full_queue(db_path):
+    aggregator = DataAggregator(db_path, write_behind=True, queue_size=10, flush_rows=5)
+
+    def save():
+        with aggregator.batch():
+            for second in range(50):
+                aggregator.save_vk_balance('vk-1', float(second), stamp(second))
+
+    assert run_with_timeout(save), 'save_vk_balance внутри batch() заблокировался'
+    aggregator.close()
+    aggregator = DataAggregator(db_path)
+    assert count_rows(aggregator, 'vk_balances') == 50
+    aggregator.close()
+
+
+def test_batch_rollback_discards_rows_written_inside_batch(db_path):
+    aggregator = DataAggregator(db_path, write_behind=True, queue_size=10, flush_rows=5)
+    try:
+        with aggregator.batch():
+            for second in range(20):
+                aggregator.save_yandex_balance('ya-1', 1.0, stamp(second))
+            raise RuntimeError('откат')
+    except RuntimeError:
+        pass
+    aggregator.close()
+    aggregator = DataAggregator(db_path)
+    assert count_rows(aggregator, 'yandex_balances') == 0
+    aggregator.close()
+
+
+def test_queue_is_written_on_flush(db_path):
+    aggregator = DataAggregator(db_path, write_behind=True, flush_interval=60)
+    for second in range(30):
+        aggregator.save_vk_balance(f'vk-{second % 3}', float(second), stamp(second))
+    aggregator.flush()
+    assert count_rows(aggregator, 'vk_balances') == 30
+    assert aggregator.check_rollups() == []
+    aggregator.close()
+
+
+def test_rejected_row_is_set_aside_and_others_written(db_path):
+    aggregator = DataAggregator(db_path, write_behind=True, flush_interval=60)
+    aggregator.conn.execute('''
+        CREATE TRIGGER reject_bad BEFORE INSERT ON vk_balances
+        WHEN NEW.vk_cabinet_id = 'bad'
+        BEGIN SELECT RAISE(ABORT, 'bad cabinet'); END
+    ''')
+    aggregator.conn.commit()
+    aggregator.save_vk_balance('good', 1.0, stamp(1))
+    aggregator.save_vk_balance('bad', 2.0, stamp(2))
+    aggregator.save_vk_balance('good', 3.0, stamp(3))
+    aggregator.flush()
+
+    assert count_rows(aggregator, 'vk_balances') == 2
+    rejected = aggregator.get_rejected_rows()
+    assert [item for item, _ in rejected] == [('vk_balances', 'bad', 2.0, stamp(2))]
+    assert aggregator.check_rollups() == []
+    aggregator.close()